@@ -23,6 +23,10 @@
 #include <math.h>               // Math library
 #include <stdint.h>             // So I can use nice data structures
 #include <QueueArray.h>         // Library for creating command sequences
+#include <Wire.h>               // I2C for the PMIC
+#include <LT_SMBusNoPec.h>      // Linear's SMBus layer that PMBus sits on
+#include <EEPROM.h>             // Board id, kept across resets
+#include <util/crc16.h>         // CRC for packets, see BOARD_PACKETS
 
 // NO LONGER USED?
 // #include <StandardCplusplus.h>        // Praise the lord that someone actually ported the C++ STL to Arduino
@@ -41,16 +45,28 @@ using namespace std;
 const uint_fast8_t SS_DDS = 9;
 const uint_fast8_t SS_DAC = 10;
 
+// Chip selects of every DDS and DAC on the board, picked by the instance number after the indicator ("D1wa32768!").
+//  Everything else (SPI, IO_UPDATE, reset, LDAC) is shared between them.
+const uint_fast8_t SS_DDSS[] = {SS_DDS, A3};
+const uint_fast8_t SS_DACS[] = {SS_DAC, A2};
+const uint8_t DDS_INSTANCES = sizeof(SS_DDSS) / sizeof(SS_DDSS[0]);
+const uint8_t DAC_INSTANCES = sizeof(SS_DACS) / sizeof(SS_DACS[0]);
+
 const uint_fast8_t DDS_IO_UPDATE_PIN = 4;
 const uint_fast8_t DDS_PROFILE_PIN_0 = 5;
 const uint_fast8_t DDS_PROFILE_PIN_1 = 6;
 const uint_fast8_t DDS_PROFILE_PIN_2 = 7;
 
 const uint_fast8_t DDS_RESET_CTRL = 8;
-const uint_fast8_t DDS_RAMP_CTRL = 2;
-const uint_fast8_t DDS_RAMP_LIMIT = 3;
+const uint_fast8_t DDS_RAMP_CTRL = 2;     // DRCTL: ramps up while high, down while low
+const uint_fast8_t DDS_RAMP_LIMIT = 3;    // DRHOLD: stops the ramp where it is while high
+
+// LTC2977 ALERT (open drain, active low). 2 and 3 are taken, so this uses a pin change interrupt instead.
+const uint_fast8_t PMIC_ALERT_PIN = A0;
 
-// const uint_fast8_t LDAC = 8;
+// Held high so DAC writes wait in the input registers until it's pulsed, see DACpulseLoad(). Every DAC on the bus
+//  shares it, so one pulse moves all of them at once.
+const uint_fast8_t DAC_LDAC_PIN = A1;
 // SDI = 11;
 // SDO = 12;
 // CLK = 13;
@@ -73,12 +89,112 @@ const uint8_t PMIC_INDICATOR = 'P';
 // AD9910 DDS
 const uint8_t DDS_INDICATOR = 'd';
 
+// The board itself
+const uint8_t BOARD_INDICATOR = 'B';
+
 
 //////////////
 // EXECUTOR //
 //////////////
 const uint8_t DONE = '!';
 
+// Frames sent back to the host: FRAME_START, type, payload length, payload, checksum of everything after FRAME_START
+//  (the low byte of the sum, or a CRC low byte first while packets are on, see BOARD_PACKETS)
+const uint8_t FRAME_START = 0xA5;
+const uint8_t FRAME_TELEMETRY = 'T';
+const uint8_t FRAME_FAULT = 'F';
+const uint8_t FRAME_VOUT_MODE = 'M';
+const uint8_t FRAME_DAC_READBACK = 'R';
+const uint8_t FRAME_IDENTIFY = 'I';
+const uint8_t FRAME_CAPABILITIES = 'C';
+const uint8_t FRAME_BAUD = 'S';
+const uint8_t FRAME_CREDIT = 'K';
+const uint8_t FRAME_ACK = 'A';
+const uint8_t FRAME_NAK = 'N';
+const uint8_t FRAME_COMMIT = 'X';
+
+// Packets from the host: PACKET_START, sequence number, payload length, payload, CRC of everything after PACKET_START
+//  (CRC-16/CCITT starting from 0xFFFF, low byte first)
+const uint8_t PACKET_START = 0x5A;
+const uint8_t PACKET_HEADER_SIZE = 3;
+const uint8_t PACKET_MAX_PAYLOAD = 128;
+
+
+////////////////////
+// BOARD COMMANDS //
+////////////////////
+
+  // Identify: "Bi!", answered with an identify frame: board id (2 bytes), firmware version (major, minor) and a
+  //  bit mask of the devices on the board
+  const uint8_t BOARD_IDENTIFY = 'i';
+
+  // Sets the board id: "Bs<id>!"
+  const uint8_t BOARD_SET_ID = 's';
+
+  // Capabilities: "Bc!", answered with a capabilities frame so the host can work out what it may use
+  const uint8_t BOARD_CAPABILITIES = 'c';
+
+  // Baud change: "Bb<baud>!", answered at the old baud with a baud frame before switching. If no command comes in at
+  //  the new baud within BAUD_CONFIRM_TIMEOUT ms it goes back to DEFAULT_BAUD, so a failed switch can't strand the host.
+  const uint8_t BOARD_BAUD = 'b';
+
+  // Flow control: "Bf1!" turns it on, "Bf0!" off. While it's on the board keeps telling the host how many bytes it has
+  //  taken out of the serial receive buffer (a running count, so a lost credit frame is made up by the next one) and
+  //  the host never has more than the buffer's worth in flight. "Bk!" asks for the count right away.
+  const uint8_t BOARD_FLOW = 'f';
+  const uint8_t BOARD_CREDIT = 'k';
+  const uint8_t CREDIT_BATCH = 16;                // Bytes read before a credit frame goes out even if more are waiting
+
+  // Packets: "Bp1!" makes every command after it come wrapped in CRC checked packets (see PACKET_START), answered with
+  //  an ack frame for sequence number 255 so the first packet is 0. Each packet is acked with its sequence number once
+  //  it checks out, and bytes that don't make a good packet are skipped up to the next start marker. A packet past the
+  //  one expected means something got lost, so a nak frame asks for everything from the expected one again (once, until
+  //  something gets through) along with the count of bad packets so far. Packets already seen are acked again but not
+  //  run twice. Frames going back get a CRC too. A plain "Bc!" between packets turns them off again, so a host that
+  //  lost track can still negotiate.
+  const uint8_t BOARD_PACKETS = 'p';
+
+  // Commit: "Bx!" makes everything staged on the board take effect together. PMIC writes staged with "Pq" go out back
+  //  to back, then IO_UPDATE and LDAC move every DDS and DAC on the same edge. Answered with a commit frame: PMIC writes
+  //  done, PMIC writes that didn't fit, then the microseconds the PMIC writes and the whole commit took (4 bytes each).
+  const uint8_t BOARD_COMMIT = 'x';
+
+  const uint8_t FIRMWARE_VERSION_MAJOR = 0;
+  const uint8_t FIRMWARE_VERSION_MINOR = 5;
+
+  // Bumped whenever the command grammar changes in a way the host has to know about. Has to match pyduino.
+  const uint8_t PROTOCOL_VERSION = 1;
+
+  const uint32_t DEFAULT_BAUD = 9600;
+  const uint32_t MAX_BAUD = 1000000;              // Exact at 16MHz with double speed, as are 250k and 500k
+  const uint16_t BAUD_CONFIRM_TIMEOUT = 1000;
+
+  // Bits of the features mask, same as pyduino.FEATURES
+  const uint16_t FEATURE_FRAMES = 1;              // Binary frames back to the host
+  const uint16_t FEATURE_SEQUENCES = 2;           // Repeated fields in one command (PMIC batches, DAC readback)
+  const uint16_t FEATURE_REGISTERS = 4;           // Single register writes ("Dg", "dw")
+  const uint16_t FEATURE_READBACK = 8;
+  const uint16_t FEATURE_TELEMETRY = 16;
+  const uint16_t FEATURE_BAUD = 32;
+  const uint16_t FEATURE_CREDITS = 64;
+  const uint16_t FEATURE_PACKETS = 128;
+  const uint16_t FEATURE_SIMULTANEOUS = 256;      // DAC channels loaded together ("Dm")
+  const uint16_t FEATURE_INSTANCES = 512;         // More than one DAC/DDS ("D1...", "Dn", "Dl")
+  const uint16_t FEATURE_TRANSACTIONS = 1024;     // Staged PMIC writes and one commit for every device ("Pq", "Bx")
+  const uint16_t FEATURE_RAMPS = 2048;            // DRG pins and stored ramps ("dp", "dk", "dj")
+  const uint16_t FEATURES = FEATURE_FRAMES | FEATURE_SEQUENCES | FEATURE_REGISTERS | FEATURE_READBACK |
+                            FEATURE_TELEMETRY | FEATURE_BAUD | FEATURE_CREDITS | FEATURE_PACKETS |
+                            FEATURE_SIMULTANEOUS | FEATURE_INSTANCES | FEATURE_TRANSACTIONS |
+                            FEATURE_RAMPS;
+
+  // Bits of the devices mask
+  const uint8_t BOARD_HAS_DAC = 1;
+  const uint8_t BOARD_HAS_DDS = 2;
+  const uint8_t BOARD_HAS_PMIC = 4;
+
+  // Where the board id lives in EEPROM
+  const uint8_t BOARD_ID_ADDRESS = 0;
+
 
 //////////////////
 // DDS COMMANDS //
@@ -114,6 +230,18 @@ const uint8_t DONE = '!';
   // Command to reset the DDS to my preferred defaults
   const uint8_t DDS_RESET = 'r';
 
+  // DRG pins: "p<DRCTL>,<DRHOLD>!", so a ramp can be turned around or held without sending it again. Shared by every
+  //  DDS on the board.
+  const uint8_t DDS_RAMP_PINS = 'p';
+
+  // Stored ramps, so switching between ramps the host has used before only takes "j<slot>!". "k<slot>,<register>,
+  //  <high>,<low>...!" keeps the registers a ramp writes (replacing whatever the slot had), "j" writes them to the DDS
+  //  the command is for. Both wait for a load like any other write. Slots are lost on reset.
+  const uint8_t DDS_RAMP_STORE = 'k';
+  const uint8_t DDS_RAMP_SELECT = 'j';
+  const uint8_t DDS_RAMP_SLOTS = 4;
+  const uint8_t DDS_RAMP_SLOT_REGISTERS = 4;
+
   // Single tone / RAM profiles
   const uint8_t DDS_PROFILES [8] = {'0', '1', '3', '4', '5', '6', '7'};
   const uint8_t DDS_PROFILES_BIN [8] = {14, 15, 16, 17, 18, 19, 20, 21};
@@ -147,6 +275,9 @@ const uint8_t DONE = '!';
   const uint8_t DDS_PROFILE_7_BIN = 0x15;
   const uint8_t DDS_RAM_BIN = 0x16;
 
+  // Size in bytes of each register, indexed by its address. 0 for addresses that don't exist.
+  const uint8_t DDS_REGISTER_SIZES [23] = {4, 4, 4, 4, 4, 0, 0, 4, 2, 4, 4, 8, 8, 4, 8, 8, 8, 8, 8, 8, 8, 8, 4};
+
   
 ///////////////////
 // PMIC COMMANDS //
@@ -157,6 +288,29 @@ const uint8_t DONE = '!';
   const uint8_t PMIC_SENSE = 's';
   const uint8_t PMIC_ENABLE = 'e';
 
+  // Paged writes: "w<page>,<code>,<word>,<page>,<code>,<word>...!" and the same with bytes for "b"
+  const uint8_t PMIC_WRITE_WORD = 'w';
+  const uint8_t PMIC_WRITE_BYTE = 'b';
+
+  // Telemetry streaming: "t<least ms between samples>,<bit mask of pages>!", no pages to stop
+  const uint8_t PMIC_TELEMETRY = 't';
+
+  // VOUT_MODE readback: "m<bit mask of pages>!". The host caches these and does all the L11/L16 math itself.
+  const uint8_t PMIC_READ_VOUT_MODE = 'm';
+
+  // Staged writes: "qw<page>,<code>,<word>...!" (or "qb" for bytes) are held until a commit ("Bx!") writes them
+  const uint8_t PMIC_STAGE = 'q';
+  const uint8_t PMIC_STAGE_MAX = 16;
+
+  const uint8_t PMIC_I2C_ADDRESS = 0x33;
+  const uint8_t PMIC_PAGE_BIN = 0x00;
+  const uint8_t PMIC_VOUT_MODE_BIN = 0x20;
+  const uint8_t PMIC_STATUS_WORD_BIN = 0x79;
+  const uint8_t PMIC_PAGES = 8;
+  const uint8_t PMIC_READ_VOUT_BIN = 0x8B;
+  const uint8_t PMIC_READ_IOUT_BIN = 0x8C;
+  const uint8_t PMIC_READ_TEMPERATURE_BIN = 0x8D;
+
 
 //////////////////
 // DAC COMMANDS //
@@ -181,6 +335,12 @@ const uint8_t DONE = '!';
   const uint8_t DAC_GAIN_2 = '1';
   const uint8_t DAC_GAIN_4 = '2';
   const uint8_t DAC_GAIN_432 = '3';
+
+  const uint8_t DAC_REGISTER = 'g';        // Write any one register with a value worked out on the host
+  const uint8_t DAC_READBACK_MAX = 20;     // Most registers read back in one frame (3 bytes each)
+  const uint8_t DAC_SIMULTANEOUS = 'm';    // Write several channels' data and load them all at once with LDAC
+  const uint8_t DAC_STAGE = 'n';           // The same without loading, so other DACs can be written first
+  const uint8_t DAC_LDAC = 'l';            // Loads every DAC on the board
   
 
   ///////////////////////////
@@ -227,10 +387,14 @@ const uint8_t DONE = '!';
 void setup() {
 
   // Set up slave-select pins. SPI lib handles others
-  pinMode(SS_DDS, OUTPUT);
-  pinMode(SS_DAC, OUTPUT);
-  digitalWrite(SS_DDS, HIGH);
-  digitalWrite(SS_DAC, HIGH);
+  for (uint8_t i = 0; i < DDS_INSTANCES; i++){
+    pinMode(SS_DDSS[i], OUTPUT);
+    digitalWrite(SS_DDSS[i], HIGH);
+  }
+  for (uint8_t i = 0; i < DAC_INSTANCES; i++){
+    pinMode(SS_DACS[i], OUTPUT);
+    digitalWrite(SS_DACS[i], HIGH);
+  }
 
   // Sets the profile to 0 and sets the load buffer pin to low
   pinMode(DDS_IO_UPDATE_PIN, OUTPUT);
@@ -251,12 +415,18 @@ void setup() {
   digitalWrite(DDS_RAMP_LIMIT, LOW);
   
 
-  // Sets LDAC to low because synchronous updating isn't important for this
-  // pinMode(LDAC, OUTPUT);
-  // digitalWrite(LDAC, LOW);
+  // LDAC stays high between loads (boards with it tied low just update on every write)
+  pinMode(DAC_LDAC_PIN, OUTPUT);
+  digitalWrite(DAC_LDAC_PIN, HIGH);
+
+  // PMIC ALERT interrupt: PCINT8 is A0 on the ATmega328
+  pinMode(PMIC_ALERT_PIN, INPUT_PULLUP);
+  PCMSK1 |= bit(PCINT8);
+  PCIFR |= bit(PCIF1);
+  PCICR |= bit(PCIE1);
 
   // Initializes Serial communication through USB for commands
-  Serial.begin(9600);
+  Serial.begin(DEFAULT_BAUD);
   
   // Initializes the SPI protocol
   SPI.begin();
@@ -271,21 +441,237 @@ void setup() {
 // Initializes the current command to be executed until the execution byte is sent
 QueueArray <uint8_t> currentCommand;
 
+// Set after a baud change until the first command at the new baud, see BOARD_BAUD
+bool baudPending = false;
+unsigned long baudChangedAt = 0;
+
+// Flow control, see BOARD_FLOW. Counts wrap at 16 bits on both sides.
+bool flowControl = false;
+uint16_t bytesRead = 0;
+uint16_t bytesReported = 0;
+
+// Packets, see BOARD_PACKETS. The one being received is kept whole until its CRC has been checked.
+bool packetMode = false;
+uint8_t packetBuffer [PACKET_HEADER_SIZE + PACKET_MAX_PAYLOAD + 2];
+uint8_t packetLength = 0;
+uint8_t packetExpected = 0;
+bool nakSent = false;
+uint16_t crcErrors = 0;
+
+// How much of a plain "Bc!" has come in between packets
+const uint8_t PACKET_ESCAPE [3] = {BOARD_INDICATOR, BOARD_CAPABILITIES, DONE};
+uint8_t escapeMatched = 0;
+
+// Registers of each stored ramp, see DDS_RAMP_STORE
+struct DDSramp {
+  uint8_t count;
+  uint8_t registers [DDS_RAMP_SLOT_REGISTERS];
+  uint64_t values [DDS_RAMP_SLOT_REGISTERS];
+};
+DDSramp ddsRamps [DDS_RAMP_SLOTS];
+
+// PMIC writes waiting for a commit, and how many didn't fit since the last one, see BOARD_COMMIT
+struct PMICwrite {
+  uint8_t page;
+  uint8_t code;
+  uint16_t value;
+  bool word;
+};
+PMICwrite pmicStaged [PMIC_STAGE_MAX];
+uint8_t pmicStagedCount = 0;
+uint8_t pmicStagedDropped = 0;
+
 void loop() {
 
   uint8_t newDataEntry;
   
+  // Faults go out before anything else gets done
+  PMICfault();
+
   while (Serial.available() > 0){
 
     newDataEntry = Serial.read();
-    currentCommand.push(newDataEntry);
-  
-    // Executes when the termination statement is received
-    if (newDataEntry == DONE){
-      executeCommand(currentCommand);
-      purge(currentCommand);
+    bytesRead++;
+    if (flowControl && (uint16_t)(bytesRead - bytesReported) >= CREDIT_BATCH){
+      sendCredit();
+    }
+
+    if (packetMode){
+      packetReceive(newDataEntry);
+    }
+    else{
+      receiveByte(newDataEntry);
+    }
+  }
+
+  // Everything waiting has been read, so the whole buffer is free
+  if (flowControl && bytesRead != bytesReported){
+    sendCredit();
+  }
+
+  // Nothing made it through at the new baud, so go back to where the host can find the board again
+  if (baudPending && millis() - baudChangedAt > BAUD_CONFIRM_TIMEOUT){
+    Serial.end();
+    Serial.begin(DEFAULT_BAUD);
+    baudPending = false;
+  }
+
+  // At most one page gets read per pass so commands never wait behind a whole telemetry sweep
+  PMICtelemetry();
+}
+
+// Adds a byte to the command being put together and runs it once it's complete
+void receiveByte(uint8_t newDataEntry){
+  currentCommand.push(newDataEntry);
+
+  // Executes when the termination statement is received
+  if (newDataEntry == DONE){
+    PMICfault();
+    baudPending = false;
+    executeCommand(currentCommand);
+    purge(currentCommand);
+  }
+}
+
+// Tells the host how many bytes have been read so far
+void sendCredit(){
+  uint8_t payload [2] = {(uint8_t)bytesRead, (uint8_t)(bytesRead >> 8)};
+  sendFrame(FRAME_CREDIT, payload, sizeof(payload));
+  bytesReported = bytesRead;
+}
+
+// Sends a frame back to the host
+void sendFrame(uint8_t type, uint8_t *payload, uint8_t length){
+  Serial.write(FRAME_START);
+  Serial.write(type);
+  Serial.write(length);
+  Serial.write(payload, length);
+
+  if (packetMode){
+    uint16_t crc = 0xFFFF;
+    crc = _crc_xmodem_update(crc, type);
+    crc = _crc_xmodem_update(crc, length);
+    for (uint8_t i = 0; i < length; i++){
+      crc = _crc_xmodem_update(crc, payload[i]);
+    }
+    Serial.write((uint8_t)crc);
+    Serial.write((uint8_t)(crc >> 8));
+    return;
+  }
+
+  uint8_t checksum = type + length;
+  for (uint8_t i = 0; i < length; i++){
+    checksum += payload[i];
+  }
+  Serial.write(checksum);
+}
+
+
+/////////////
+// PACKETS //
+/////////////
+// Same parser as emulator.PacketParser, which gets fuzzed on the host. Change both together.
+
+// Takes one byte while packets are on
+void packetReceive(uint8_t newDataEntry){
+  if (packetLength == 0){
+    if (newDataEntry != PACKET_START){
+      packetEscape(newDataEntry);
+      return;
+    }
+    escapeMatched = 0;
+  }
+
+  packetBuffer[packetLength++] = newDataEntry;
+  packetCheck();
+}
+
+// Looks for a plain "Bc!" in the bytes between packets
+void packetEscape(uint8_t newDataEntry){
+  if (newDataEntry == PACKET_ESCAPE[escapeMatched]){
+    escapeMatched++;
+  }
+  else{
+    escapeMatched = newDataEntry == PACKET_ESCAPE[0];
+  }
+
+  if (escapeMatched == sizeof(PACKET_ESCAPE)){
+    escapeMatched = 0;
+    packetMode = false;
+    purge(currentCommand);
+    BOARDcapabilities();
+  }
+}
+
+// Runs the packets in the buffer that are complete and good. A bad one only costs its start marker: whatever came
+//  after it gets looked through again, which can turn up more than one packet when a false start held them back.
+void packetCheck(){
+  while (packetLength > 0){
+    if (packetLength >= PACKET_HEADER_SIZE && packetBuffer[2] > PACKET_MAX_PAYLOAD){
+      packetSkip(1);
+      continue;
+    }
+    if (packetLength < PACKET_HEADER_SIZE || packetLength < PACKET_HEADER_SIZE + packetBuffer[2] + 2){
+      return;
+    }
+
+    uint8_t end = PACKET_HEADER_SIZE + packetBuffer[2];
+    uint16_t crc = 0xFFFF;
+    for (uint8_t i = 1; i < end; i++){
+      crc = _crc_xmodem_update(crc, packetBuffer[i]);
+    }
+    if (crc == (packetBuffer[end] | ((uint16_t)packetBuffer[end + 1] << 8))){
+      uint8_t used = end + 2;
+      uint8_t remaining = packetLength - used;
+
+      // Emptied first so a packet that turns packets off or on again starts from nothing
+      packetLength = 0;
+      packetDeliver();
+      if (packetMode && packetLength == 0 && remaining > 0){
+        memmove(packetBuffer, packetBuffer + used, remaining);
+        packetLength = remaining;
+        packetSkip(0);
+      }
+      continue;
+    }
+
+    crcErrors++;
+    nakSent = false;
+    packetSkip(1);
+  }
+}
+
+// Drops the bytes before the first start marker at or after "from"
+void packetSkip(uint8_t from){
+  uint8_t next = from;
+  while (next < packetLength && packetBuffer[next] != PACKET_START){
+    next++;
+  }
+  memmove(packetBuffer, packetBuffer + next, packetLength - next);
+  packetLength -= next;
+}
+
+// Runs a packet that checked out, unless it's one already run or one after a packet that got lost
+void packetDeliver(){
+  uint8_t sequence = packetBuffer[1];
+
+  if (sequence == packetExpected){
+    packetExpected++;
+    nakSent = false;
+    sendFrame(FRAME_ACK, &sequence, 1);
+    for (uint8_t i = 0; i < packetBuffer[2]; i++){
+      receiveByte(packetBuffer[PACKET_HEADER_SIZE + i]);
     }
   }
+  else if ((uint8_t)(packetExpected - sequence) < 128){
+    uint8_t last = packetExpected - 1;
+    sendFrame(FRAME_ACK, &last, 1);
+  }
+  else if (!nakSent){
+    uint8_t payload [3] = {packetExpected, (uint8_t)crcErrors, (uint8_t)(crcErrors >> 8)};
+    sendFrame(FRAME_NAK, payload, sizeof(payload));
+    nakSent = true;
+  }
 }
 
 
@@ -293,13 +679,30 @@ void loop() {
 // COMMAND HANDLING //
 //////////////////////
 
+// Chip select of the DAC and DDS the command being run is for
+uint_fast8_t dacSelect = SS_DAC;
+uint_fast8_t ddsSelect = SS_DDS;
+
+// Reads the instance number after the indicator, if there is one, and returns whether the board has that many
+bool selectInstance(QueueArray <uint8_t> &command, const uint_fast8_t *selects, uint8_t instances,
+                    uint_fast8_t &select){
+  uint8_t instance = parseNumber(command);
+  if (instance >= instances){
+    return false;
+  }
+  select = selects[instance];
+  return true;
+}
+
 void executeCommand(QueueArray <uint8_t> &command){
 
   // Expandable so that I could potentially run different execution commands for other devices?
   // PMIC monitoring system will be added.
   if (command.front() == DAC_INDICATOR){
     command.pop();
-    DACcommand(command);
+    if (selectInstance(command, SS_DACS, DAC_INSTANCES, dacSelect)){
+      DACcommand(command);
+    }
     purge(command);
     return;
   }
@@ -313,7 +716,16 @@ void executeCommand(QueueArray <uint8_t> &command){
   // Access the DDS and control it
   else if (command.front() == DDS_INDICATOR){
     command.pop();
-    DDScommand(command);
+    if (selectInstance(command, SS_DDSS, DDS_INSTANCES, ddsSelect)){
+      DDScommand(command);
+    }
+    purge(command);
+    return;
+  }
+  // Questions about the board itself
+  else if (command.front() == BOARD_INDICATOR){
+    command.pop();
+    BOARDcommand(command);
     purge(command);
     return;
   }
@@ -330,6 +742,119 @@ void purge(QueueArray <uint8_t> &queue){
   // while(!queue.isEmpty()) queue.pop();
 }
 
+/////////// BOARD ///////////
+
+void BOARDcommand(QueueArray <uint8_t> &command){
+
+  uint8_t front = command.pop();
+  if (front == BOARD_IDENTIFY){
+    BOARDidentify();
+  }
+  else if (front == BOARD_SET_ID){
+    uint16_t id = parseNumber(command);
+    EEPROM.update(BOARD_ID_ADDRESS, id);
+    EEPROM.update(BOARD_ID_ADDRESS + 1, id >> 8);
+  }
+  else if (front == BOARD_CAPABILITIES){
+    BOARDcapabilities();
+  }
+  else if (front == BOARD_BAUD){
+    BOARDsetBaud(parseNumber(command));
+  }
+  else if (front == BOARD_FLOW){
+    flowControl = parseNumber(command);
+    bytesRead = 0;
+    sendCredit();
+  }
+  else if (front == BOARD_CREDIT){
+    sendCredit();
+  }
+  else if (front == BOARD_PACKETS){
+    packetMode = parseNumber(command);
+    packetLength = 0;
+    packetExpected = 0;
+    nakSent = false;
+    escapeMatched = 0;
+    uint8_t last = packetExpected - 1;
+    sendFrame(FRAME_ACK, &last, 1);
+  }
+  else if (front == BOARD_COMMIT){
+    BOARDcommit();
+  }
+
+  purge(command);
+  return;
+}
+
+// Sends back who this board is, so the host can pick it out of every serial port without guessing. The DAC and DDS
+//  can't be asked, the PMIC counts as there if it answers on I2C.
+void BOARDidentify(){
+  uint8_t devices = BOARD_HAS_DAC | BOARD_HAS_DDS;
+  Wire.beginTransmission(PMIC_I2C_ADDRESS);
+  if (Wire.endTransmission() == 0){
+    devices |= BOARD_HAS_PMIC;
+  }
+
+  uint8_t payload [5] = {EEPROM.read(BOARD_ID_ADDRESS), EEPROM.read(BOARD_ID_ADDRESS + 1),
+                         FIRMWARE_VERSION_MAJOR, FIRMWARE_VERSION_MINOR, devices};
+  sendFrame(FRAME_IDENTIFY, payload, sizeof(payload));
+}
+
+// Protocol version, fastest baud, serial receive buffer size, devices and features, little endian
+void BOARDcapabilities(){
+  uint8_t payload [10] = {PROTOCOL_VERSION,
+                          (uint8_t)MAX_BAUD, (uint8_t)(MAX_BAUD >> 8), (uint8_t)(MAX_BAUD >> 16),
+                          (uint8_t)(MAX_BAUD >> 24),
+                          (uint8_t)SERIAL_RX_BUFFER_SIZE, (uint8_t)(SERIAL_RX_BUFFER_SIZE >> 8),
+                          BOARD_HAS_DAC | BOARD_HAS_DDS | BOARD_HAS_PMIC,
+                          (uint8_t)FEATURES, (uint8_t)(FEATURES >> 8)};
+  sendFrame(FRAME_CAPABILITIES, payload, sizeof(payload));
+}
+
+// Writes the staged PMIC registers, then loads every DDS and DAC on one edge, right after the last PMIC write so the
+//  rails, tones and voltages all change as close together as the board can manage
+void BOARDcommit(){
+  DDSwriteDefaults();
+
+  uint32_t start = micros();
+  uint8_t written = PMICflushStaged();
+  uint32_t pmicTime = micros() - start;
+
+  digitalWrite(DDS_IO_UPDATE_PIN, HIGH);
+  digitalWrite(DAC_LDAC_PIN, LOW);
+  digitalWrite(DAC_LDAC_PIN, HIGH);
+  digitalWrite(DDS_IO_UPDATE_PIN, LOW);
+  uint32_t commitTime = micros() - start;
+
+  uint8_t payload [10] = {written, pmicStagedDropped,
+                          (uint8_t)pmicTime, (uint8_t)(pmicTime >> 8), (uint8_t)(pmicTime >> 16),
+                          (uint8_t)(pmicTime >> 24),
+                          (uint8_t)commitTime, (uint8_t)(commitTime >> 8), (uint8_t)(commitTime >> 16),
+                          (uint8_t)(commitTime >> 24)};
+  pmicStagedDropped = 0;
+  sendFrame(FRAME_COMMIT, payload, sizeof(payload));
+}
+
+// Says yes (or no, with a baud of 0) at the old baud, then switches once it's all gone out
+void BOARDsetBaud(uint32_t baud){
+  if (baud == 0 || baud > MAX_BAUD){
+    baud = 0;
+  }
+
+  uint8_t payload [4] = {(uint8_t)baud, (uint8_t)(baud >> 8), (uint8_t)(baud >> 16), (uint8_t)(baud >> 24)};
+  sendFrame(FRAME_BAUD, payload, sizeof(payload));
+  if (baud == 0){
+    return;
+  }
+
+  Serial.flush();
+  Serial.end();
+  Serial.begin(baud);
+  baudPending = true;
+  baudChangedAt = millis();
+}
+
+
 /////////// DDS ///////////
 
 ///////////////////
@@ -365,6 +890,36 @@ void DDScommand(QueueArray <uint8_t> &command){
     purge(command);
     return;
   }
+  // Writes a single register that the host already has the value for
+  else if (front == DDS_WRITE){
+    DDSregisterWrite(command);
+    purge(command);
+    return;
+  }
+  // Turns the ramp around or holds it
+  else if (front == DDS_RAMP_PINS){
+    digitalWrite(DDS_RAMP_CTRL, parseNumber(command) ? HIGH : LOW);
+    digitalWrite(DDS_RAMP_LIMIT, parseNumber(command) ? HIGH : LOW);
+    purge(command);
+    return;
+  }
+  // Keeps ramps for later
+  else if (front == DDS_RAMP_STORE){
+    DDSrampStore(command);
+    purge(command);
+    return;
+  }
+  // Writes a kept ramp
+  else if (front == DDS_RAMP_SELECT){
+    uint8_t slot = parseNumber(command);
+    if (slot < DDS_RAMP_SLOTS){
+      for (uint8_t i = 0; i < ddsRamps[slot].count; i++){
+        DDSwriteRegister(ddsRamps[slot].registers[i], ddsRamps[slot].values[i]);
+      }
+    }
+    purge(command);
+    return;
+  }
   // Catch invalid commands
   else{
     purge(command);
@@ -377,18 +932,13 @@ void DDScommand(QueueArray <uint8_t> &command){
 //  Timing here is arbitrary, but follow figure 49 for appropriate timing and the minimum number of cycles on SYNC_CLK to ensure that it will load properly.
 //  The Arduino is much, much slower than the SYNC_CLK and this timing is arbitrary and slow, but fast enough to be undetectable on the human scale, Which
 //  is what this is being used for currently.
-void DDSloadBuffer(){
-
-  QueueArray <uint8_t> controlBytes;
-  controlBytes.push(DDS_CFR3_BIN);
+//  CFR3 only has to be set to my defaults once after a reset since nothing else writes to it.
+//  IO_UPDATE is shared, so this loads every DDS on the board, and any of them that haven't had CFR3 set get it first.
+bool ddsCFR3Written[DDS_INSTANCES] = {false};
 
-  // Sets the control values of register 3 to preferred defaults, bypassing the clock divider
-  controlBytes.push(0x1F);
-  controlBytes.push(0x3F);
-  controlBytes.push(0xC0);
-  controlBytes.push(0x00);
+void DDSloadBuffer(){
 
-  DDSsendData(controlBytes, DEFAULT_SETTINGS);
+  DDSwriteDefaults();
 
   // Loads that spicy binche into the dds yum yum
   digitalWrite(DDS_IO_UPDATE_PIN, HIGH);
@@ -397,6 +947,31 @@ void DDSloadBuffer(){
 
 }
 
+// Sets CFR3 on every DDS that hasn't had it since a reset, so it's in place for the next IO_UPDATE
+void DDSwriteDefaults(){
+
+  uint_fast8_t select = ddsSelect;
+  for (uint8_t i = 0; i < DDS_INSTANCES; i++){
+    if (ddsCFR3Written[i]){
+      continue;
+    }
+    QueueArray <uint8_t> controlBytes;
+    controlBytes.push(DDS_CFR3_BIN);
+
+    // Sets the control values of register 3 to preferred defaults, bypassing the clock divider
+    controlBytes.push(0x1F);
+    controlBytes.push(0x3F);
+    controlBytes.push(0xC0);
+    controlBytes.push(0x00);
+
+    ddsSelect = SS_DDSS[i];
+    DDSsendData(controlBytes, DEFAULT_SETTINGS);
+    ddsCFR3Written[i] = true;
+  }
+  ddsSelect = select;
+
+}
+
 // Resets this spicy boi
 void DDSreset(){
 
@@ -404,7 +979,10 @@ void DDSreset(){
   delay(5);
   digitalWrite(DDS_RESET_CTRL, LOW);
 
-  // Really only doing this so that I get those defaults that I like
+  // Really only doing this so that I get those defaults that I like. The reset line goes to every DDS.
+  for (uint8_t i = 0; i < DDS_INSTANCES; i++){
+    ddsCFR3Written[i] = false;
+  }
   DDSloadBuffer();
 
 }
@@ -732,15 +1310,84 @@ void DDSrampSetup(QueueArray <uint8_t> &command){
 void DDSsendData(QueueArray <uint8_t> &bytesToSend, SPISettings settings){
 
   SPI.beginTransaction(settings);
-  digitalWrite(SS_DDS, LOW);
+  digitalWrite(ddsSelect, LOW);
   while(!bytesToSend.isEmpty()){
     SPI.transfer(bytesToSend.pop());
   }
-  digitalWrite(SS_DDS, HIGH);
+  digitalWrite(ddsSelect, HIGH);
   SPI.endTransaction();
   delayMicroseconds(30);        // Mostly arbitrary, but it's a good amount of delay relative to everything
 }
 
+// Writes one whole register: "w<register>,<high 32 bits>,<low 32 bits>!". Registers shorter than 8 bytes only get the
+//  low bytes. This is what the host uses to send only the registers that changed.
+void DDSregisterWrite(QueueArray <uint8_t> &command){
+
+  uint8_t registerAddress = parseNumber(command);
+  uint64_t high = parseNumber(command);
+  uint64_t low = parseNumber(command);
+
+  DDSwriteRegister(registerAddress, (high << 32) + low);
+  purge(command);
+}
+
+// Writes a whole register, skipping addresses that aren't registers
+void DDSwriteRegister(uint8_t registerAddress, uint64_t value){
+
+  if (registerAddress >= sizeof(DDS_REGISTER_SIZES) || DDS_REGISTER_SIZES[registerAddress] == 0){
+    return;
+  }
+
+  QueueArray <uint8_t> registerBytes;
+  registerBytes.push(registerAddress);
+
+  QueueArray <uint8_t> data = intToBytes(value, DDS_REGISTER_SIZES[registerAddress]);
+  while (!data.isEmpty()){
+    registerBytes.push(data.pop());
+  }
+
+  DDSsendData(registerBytes, DEFAULT_SETTINGS);
+}
+
+// "k<slot>,<register>,<high>,<low>...!" Every slot in the command is cleared before its first register goes in, and
+//  registers past DDS_RAMP_SLOT_REGISTERS are dropped.
+void DDSrampStore(QueueArray <uint8_t> &command){
+  uint8_t cleared = 0;
+  while (!command.isEmpty() && command.front() >= '0' && command.front() <= '9'){
+    uint8_t slot = parseNumber(command);
+    uint8_t registerAddress = parseNumber(command);
+    uint64_t high = parseNumber(command);
+    uint64_t low = parseNumber(command);
+    if (slot >= DDS_RAMP_SLOTS){
+      continue;
+    }
+    if (!(cleared & bit(slot))){
+      ddsRamps[slot].count = 0;
+      cleared |= bit(slot);
+    }
+    if (ddsRamps[slot].count < DDS_RAMP_SLOT_REGISTERS){
+      ddsRamps[slot].registers[ddsRamps[slot].count] = registerAddress;
+      ddsRamps[slot].values[ddsRamps[slot].count] = (high << 32) + low;
+      ddsRamps[slot].count++;
+    }
+  }
+}
+
+// Reads an unsigned decimal number off the front of the command and pops the ',' after it (but not a '!').
+//  Unlike String.toInt() this doesn't overflow on 32 bit words above 2^31.
+uint32_t parseNumber(QueueArray <uint8_t> &command){
+  uint32_t number = 0;
+
+  while (!command.isEmpty() && command.front() >= '0' && command.front() <= '9'){
+    number = number * 10 + (command.pop() - '0');
+  }
+  if (!command.isEmpty() && command.front() == ','){
+    command.pop();
+  }
+
+  return number;
+}
+
 // Another beautifully named function. Creates an instruction byte for communicating to the selected DDS register.
 uint8_t DDSinstructionConstruction(uint8_t rwBin, uint8_t registerValue){
   uint8_t byteBoi;
@@ -755,14 +1402,197 @@ uint8_t DDSinstructionConstruction(uint8_t rwBin, uint8_t registerValue){
 // PMIC COMMANDS //
 ///////////////////
 
-// To be implemented
+// No packet error checking, 100kHz like in the standalone PMIC sketch
+static LT_SMBusNoPec *smbus = new LT_SMBusNoPec(100000);
+
+// Page the PMIC is on, so PAGE only gets written when it changes. -1 until the first write.
+int16_t pmicPage = -1;
+
+void PMICsetPage(uint8_t page){
+  if (pmicPage != page){
+    smbus->writeByte(PMIC_I2C_ADDRESS, PMIC_PAGE_BIN, page);
+    pmicPage = page;
+  }
+}
+
+// Telemetry settings, no pages means it's off
+uint16_t pmicTelemetryPeriod = 0;
+uint8_t pmicTelemetryPages = 0;
+uint8_t pmicTelemetryNext = 0;
+unsigned long pmicTelemetryLast = 0;
+
+void PMICtelemetrySetup(QueueArray <uint8_t> &command){
+  pmicTelemetryPeriod = parseNumber(command);
+  pmicTelemetryPages = parseNumber(command);
+  pmicTelemetryNext = 0;
+}
+
+// Reads the next page in the mask and sends it as a telemetry frame, if it's time to
+void PMICtelemetry(){
+  if (pmicTelemetryPages == 0 || millis() - pmicTelemetryLast < pmicTelemetryPeriod){
+    return;
+  }
+
+  while (!(pmicTelemetryPages & (1 << pmicTelemetryNext))){
+    pmicTelemetryNext = (pmicTelemetryNext + 1) % 8;
+  }
+  uint8_t page = pmicTelemetryNext;
+  pmicTelemetryNext = (pmicTelemetryNext + 1) % 8;
+  pmicTelemetryLast = millis();
+
+  PMICsetPage(page);
+  uint16_t status = smbus->readWord(PMIC_I2C_ADDRESS, PMIC_STATUS_WORD_BIN);
+  uint16_t vout = smbus->readWord(PMIC_I2C_ADDRESS, PMIC_READ_VOUT_BIN);
+  uint16_t iout = smbus->readWord(PMIC_I2C_ADDRESS, PMIC_READ_IOUT_BIN);
+  uint16_t temperature = smbus->readWord(PMIC_I2C_ADDRESS, PMIC_READ_TEMPERATURE_BIN);
+  uint32_t now = pmicTelemetryLast;
+
+  // Little endian, same layout as telemetry.PAYLOAD
+  uint8_t payload [13] = {page,
+                          (uint8_t)status, (uint8_t)(status >> 8),
+                          (uint8_t)vout, (uint8_t)(vout >> 8),
+                          (uint8_t)iout, (uint8_t)(iout >> 8),
+                          (uint8_t)temperature, (uint8_t)(temperature >> 8),
+                          (uint8_t)now, (uint8_t)(now >> 8), (uint8_t)(now >> 16), (uint8_t)(now >> 24)};
+  sendFrame(FRAME_TELEMETRY, payload, sizeof(payload));
+}
+
+// Set by the ALERT interrupt along with when it happened, and cleared once the fault frame is sent
+volatile bool pmicAlert = false;
+volatile uint32_t pmicAlertTime = 0;
+
+ISR(PCINT1_vect){
+  if (!pmicAlert && digitalRead(PMIC_ALERT_PIN) == LOW){
+    pmicAlertTime = micros();
+    pmicAlert = true;
+  }
+}
+
+// Sends a fault frame with every page's STATUS_WORD as soon as ALERT asserts, then releases ALERT by reading the
+//  alert response address. The frame also carries when ALERT asserted and when the frame went out (micros) so the
+//  host can work out the whole delay.
+void PMICfault(){
+  if (!pmicAlert){
+    return;
+  }
+
+  uint8_t payload [25];
+  uint8_t faultedPages = 0;
+  for (uint8_t page = 0; page < PMIC_PAGES; page++){
+    PMICsetPage(page);
+    uint16_t status = smbus->readWord(PMIC_I2C_ADDRESS, PMIC_STATUS_WORD_BIN);
+    if (status != 0){
+      faultedPages |= 1 << page;
+    }
+    payload[9 + 2 * page] = status;
+    payload[10 + 2 * page] = status >> 8;
+  }
+  smbus->readAlert();
+
+  uint32_t assertTime = pmicAlertTime;
+  uint32_t sendTime = micros();
+  for (uint8_t i = 0; i < 4; i++){
+    payload[i] = assertTime >> (8 * i);
+    payload[4 + i] = sendTime >> (8 * i);
+  }
+  payload[8] = faultedPages;
+
+  sendFrame(FRAME_FAULT, payload, sizeof(payload));
+  pmicAlert = false;
+}
+
+// Sends back the mask and then the VOUT_MODE of every page in it
+void PMICreadVoutModes(uint8_t pages){
+  uint8_t payload [1 + PMIC_PAGES];
+  uint8_t length = 1;
+  payload[0] = pages;
+
+  for (uint8_t page = 0; page < PMIC_PAGES; page++){
+    if (pages & (1 << page)){
+      PMICsetPage(page);
+      payload[length++] = smbus->readByte(PMIC_I2C_ADDRESS, PMIC_VOUT_MODE_BIN);
+    }
+  }
+
+  sendFrame(FRAME_VOUT_MODE, payload, length);
+}
+
+// Runs a batch of paged writes. The host already encoded the values (L11/L16) and sorted them by page.
 void PMICcommand(QueueArray <uint8_t> &command){
 
+  uint8_t front = command.pop();
+  if (front == PMIC_TELEMETRY){
+    PMICtelemetrySetup(command);
+    purge(command);
+    return;
+  }
+  if (front == PMIC_READ_VOUT_MODE){
+    PMICreadVoutModes(parseNumber(command));
+    purge(command);
+    return;
+  }
+  if (front == PMIC_STAGE){
+    PMICstage(command);
+    purge(command);
+    return;
+  }
+  if (front != PMIC_WRITE_WORD && front != PMIC_WRITE_BYTE){
+    purge(command);
+    return;
+  }
+
+  // Stops at the '!' (or anything else that isn't a number, so a bad command can't loop forever)
+  while (!command.isEmpty() && command.front() >= '0' && command.front() <= '9'){
+    uint8_t page = parseNumber(command);
+    uint8_t code = parseNumber(command);
+    uint16_t value = parseNumber(command);
+
+    PMICsetPage(page);
+    if (front == PMIC_WRITE_WORD){
+      smbus->writeWord(PMIC_I2C_ADDRESS, code, value);
+    }
+    else{
+      smbus->writeByte(PMIC_I2C_ADDRESS, code, value);
+    }
+  }
+
   purge(command);
   return;
 
 }
 
+// "q" followed by a write command, held instead of written
+void PMICstage(QueueArray <uint8_t> &command){
+  bool word = command.pop() == PMIC_WRITE_WORD;
+  while (!command.isEmpty() && command.front() >= '0' && command.front() <= '9'){
+    uint8_t page = parseNumber(command);
+    uint8_t code = parseNumber(command);
+    uint16_t value = parseNumber(command);
+    if (pmicStagedCount < PMIC_STAGE_MAX){
+      pmicStaged[pmicStagedCount++] = {page, code, value, word};
+    }
+    else if (pmicStagedDropped < 255){
+      pmicStagedDropped++;
+    }
+  }
+}
+
+// Writes everything staged, returns how many
+uint8_t PMICflushStaged(){
+  uint8_t written = pmicStagedCount;
+  for (uint8_t i = 0; i < pmicStagedCount; i++){
+    PMICsetPage(pmicStaged[i].page);
+    if (pmicStaged[i].word){
+      smbus->writeWord(PMIC_I2C_ADDRESS, pmicStaged[i].code, pmicStaged[i].value);
+    }
+    else{
+      smbus->writeByte(PMIC_I2C_ADDRESS, pmicStaged[i].code, pmicStaged[i].value);
+    }
+  }
+  pmicStagedCount = 0;
+  return written;
+}
+
 /////////// DAC ///////////
 
 //////////////////////////
@@ -826,7 +1656,46 @@ void DACcommand(QueueArray <uint8_t> &command){
     purge(command);
     return;
   }
-  else if (command.front() == DAC_READ)   {rw = DAC_READ_BIN;}
+  // Writes any one register: "g<register>,<channel>,<data>!"
+  else if (command.front() == DAC_REGISTER){
+    command.pop();
+    uint8_t dacRegister = parseNumber(command);
+    uint8_t channel = parseNumber(command);
+    uint16_t registerData = parseNumber(command);
+    DACsendData(DACheaderConstructor(DAC_WRITE_BIN, dacRegister, channel), registerData, DEFAULT_SETTINGS);
+    DACloadData();
+    purge(command);
+    return;
+  }
+  // Writes the data of any number of channels, then loads them together: "m<channel>,<data>,<channel>,<data>...!".
+  //  "n" is the same without the load, which a later "l" does for every DAC on the board at once.
+  else if (command.front() == DAC_SIMULTANEOUS || command.front() == DAC_STAGE){
+    bool load = command.pop() == DAC_SIMULTANEOUS;
+    while (!command.isEmpty() && command.front() >= '0' && command.front() <= '9'){
+      uint8_t channel = parseNumber(command);
+      uint16_t channelData = parseNumber(command);
+      DACsendData(DACheaderConstructor(DAC_WRITE_BIN, DAC_REGISTER_BIN, channel), channelData, DEFAULT_SETTINGS);
+    }
+    if (load){
+      DACpulseLoad();
+    }
+    purge(command);
+    return;
+  }
+  else if (command.front() == DAC_LDAC){
+    DACpulseLoad();
+    purge(command);
+    return;
+  }
+  // Reads registers back: "r<register>,<channel>,<register>,<channel>...!" or "r<address>!" for one output
+  else if (command.front() == DAC_READ){
+    command.pop();
+    if      (command.front() == DAC_A)  {DACreadOutput(DAC_A_BIN);}
+    else if (command.front() == DAC_B)  {DACreadOutput(DAC_B_BIN);}
+    else                                {DACreadRegisters(command);}
+    purge(command);
+    return;
+  }
   else if (command.front() == DAC_WRITE)  {rw = DAC_WRITE_BIN;}
   else{
     purge(command);
@@ -868,16 +1737,57 @@ void DACcommand(QueueArray <uint8_t> &command){
 // sends 24-bit sequence to the DAC
 void DACsendData(uint8_t header, uint16_t data, SPISettings settings){
   SPI.beginTransaction(settings);
-  digitalWrite(SS_DAC, LOW);
+  digitalWrite(dacSelect, LOW);
   SPI.transfer(header);
   SPI.transfer16(data);
-  digitalWrite(SS_DAC, HIGH);
+  digitalWrite(dacSelect, HIGH);
   SPI.endTransaction();
   
   delayMicroseconds(30);        // Mostly arbitrary, but it's a good amount of delay relative to everything
 }
 
 
+// Reads one register. It comes out on SDO while the next frame (a NOP) is clocked in.
+uint16_t DACreadRegister(uint8_t dacRegister, uint8_t channel, SPISettings settings){
+  DACsendData(DACheaderConstructor(DAC_READ_BIN, dacRegister, channel), 0, settings);
+
+  SPI.beginTransaction(settings);
+  digitalWrite(dacSelect, LOW);
+  SPI.transfer(DACheaderConstructor(DAC_WRITE_BIN, CONTROL_REGISTER_BIN, NOP_BIN));
+  uint16_t data = SPI.transfer16(0);
+  digitalWrite(dacSelect, HIGH);
+  SPI.endTransaction();
+
+  delayMicroseconds(30);
+  return data;
+}
+
+// Reads every register,channel pair in the command and sends them all back in one frame: for each one a byte with
+//  the register and channel (same bits as the header) followed by the 16 bit value, low byte first
+void DACreadRegisters(QueueArray <uint8_t> &command){
+  uint8_t payload [3 * DAC_READBACK_MAX];
+  uint8_t length = 0;
+
+  while (!command.isEmpty() && command.front() >= '0' && command.front() <= '9' && length < sizeof(payload)){
+    uint8_t dacRegister = parseNumber(command);
+    uint8_t channel = parseNumber(command);
+    uint16_t data = DACreadRegister(dacRegister, channel, DEFAULT_SETTINGS);
+
+    payload[length++] = (dacRegister << 3) | channel;
+    payload[length++] = data;
+    payload[length++] = data >> 8;
+  }
+
+  sendFrame(FRAME_DAC_READBACK, payload, length);
+}
+
+// Reads back the data register of one output, answered the same way
+void DACreadOutput(uint8_t channel){
+  uint16_t data = DACreadRegister(DAC_REGISTER_BIN, channel, DEFAULT_SETTINGS);
+  uint8_t payload [3] = {(uint8_t)((DAC_REGISTER_BIN << 3) | channel), (uint8_t)data, (uint8_t)(data >> 8)};
+  sendFrame(FRAME_DAC_READBACK, payload, sizeof(payload));
+}
+
 // returns an 8 bit header to send to the DAC before the data
 uint8_t DACheaderConstructor(uint8_t readWrite, uint8_t dacRegister, uint8_t channel){
   uint8_t header;
@@ -1002,6 +1912,13 @@ void DACloadData (){
   DACsendData(loadHeader, uint16_t(0), DEFAULT_SETTINGS);
 }
 
+// Moves every input register of every DAC on the LDAC line to its output on the same edge. LDAC has to be low for at
+//  least 20ns, which a digitalWrite takes care of on its own.
+void DACpulseLoad(){
+  digitalWrite(DAC_LDAC_PIN, LOW);
+  digitalWrite(DAC_LDAC_PIN, HIGH);
+}
+
 
 
 
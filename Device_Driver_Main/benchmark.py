@@ -0,0 +1,263 @@
+#########################################
+# Pyduino Benchmarks                    #
+# Thomas Kaunzinger                     #
+#                                       #
+# Timing for the command encoders and   #
+# the other hot paths in pyduino, so    #
+# they can all be measured and tuned in #
+# one place. Nothing here needs a board.#
+#########################################
+
+# Run with "python3 benchmark.py"
+
+###################################################
+
+###########
+# IMPORTS #
+###########
+
+import os
+import threading
+import time
+import timeit
+import numpy
+import pyduino
+from pyduino import *
+
+###################################################
+
+#############
+# FUNCTIONS #
+#############
+
+# Number of calls each benchmark is timed over
+RUNS = 100000
+
+
+# Number of times each benchmark is repeated, the best one is reported to keep noise out
+REPEATS = 5
+
+
+# Prints how long one call of a function takes on average
+def report(name: str, function, runs: int = RUNS):
+    seconds = min(timeit.repeat(function, number=runs, repeat=REPEATS))
+    print(str('  ' + name.ljust(40) + "%8.0f" % (seconds / runs * 1e9) + ' ns'))
+
+
+# Times every encoder generated by the device registry, filling every field with its largest value
+def benchmark_encoders():
+    print('Registry encoders:')
+    for device in DEVICES.values():
+        for command in device.commands.values():
+            values = [(1 << field.bits) - 1 if field.bits else 'a' for field in command.fields]
+            if command.repeat:
+                values = [[tuple(values)] * PMIC_BATCH_SIZE]
+            report(str(device.name + ' ' + command.name), lambda: command.encode(*values))
+
+
+# Times the DDS and DAC command builders, including the float to register word math
+def benchmark_commands():
+    print('Command builders:')
+    report('DDS single tone', lambda: DDS.create_single_tone_command(0.5, 1, 90, 1e6, 1e9))
+    report('DDS ramp setup', lambda: DDS.create_ramp_setup_command('f', 1e9, 1e9, 1e6, 2e6, 100, 200, 1e-6, 2e-6))
+    report('DAC voltage', lambda: DAC.create_voltage_command(DAC_A, 1.0, 2.024, 2.0, True))
+    report('DRG plan', lambda: DDS.plan_ramp('f', 1e9, 1e9, 1e6, 101e6, 10, 1e3), 1000)
+
+
+# The ramp setup command the way it used to be built, one concatenation at a time, as a baseline
+def legacy_ramp_setup_command(parameter, lower, upper, decrement, increment, rate_n, rate_p):
+    working_string = str(DDS_INDICATOR + DDS_OUTPUT + DDS_RAMP + DDS_RAMP_SETUP)
+    working_string = str(working_string + parameter)
+    for word in (lower, upper, decrement, increment, rate_n):
+        working_string = str(working_string + str(word))
+        working_string = str(working_string + ',')
+    working_string = str(working_string + str(rate_p))
+    working_string = str(working_string + DONE)
+    return working_string
+
+
+# A port that writes to the null device, so every write still costs a system call like a real port does
+class NullPort:
+
+    def __init__(self):
+        self.file = open(os.devnull, 'wb', buffering=0)
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+# Compares sending a bulk sequence of ramp setups one command at a time (str building + .encode() + a write each)
+#   against packing them all into the reusable FrameBuilder buffer and sending one frame
+def benchmark_frames(sequence_length: int = 100):
+    print(str('Bulk sequence of ' + str(sequence_length) + ' ramp setups:'))
+    pyduino.serial_port = NullPort()
+    words = [('f', i, i + 1000000, 100, 200, 250, 250) for i in range(sequence_length)]
+    ramp_setup = DDS_DEVICE.commands['ramp_setup']
+    runs = RUNS // sequence_length
+
+    def legacy():
+        for word in words:
+            pyduino.serial_port.write(legacy_ramp_setup_command(*word).encode())
+
+    def encoded():
+        for word in words:
+            pyduino.serial_port.write(ramp_setup.encode(*word).encode())
+
+    def framed():
+        builder = FRAME_BUILDER
+        builder.clear()
+        builder.add_many(ramp_setup, words)
+        send_frame(builder.frame())
+
+    report('Concatenated strings, one write each', legacy, runs)
+    report('Generated encoder, one write each', encoded, runs)
+    report('Frame builder, one write', framed, runs)
+    pyduino.serial_port.close()
+    pyduino.serial_port = "none"
+
+
+# Compares converting a whole set of PMIC values one at a time against the NumPy conversions
+def benchmark_pmic_codec(size: int = 1000):
+    print(str('PMIC codec (' + str(size) + ' values):'))
+    voltages = numpy.linspace(0.5, 5, size)
+    times = numpy.linspace(0, 500, size)
+    words = PMIC.float_to_l11_array(times)
+    runs = max(RUNS // size, 10)
+
+    report('L16 encode, one at a time', lambda: [PMIC.float_to_l16(voltage) for voltage in voltages.tolist()], runs)
+    report('L16 encode, array', lambda: PMIC.float_to_l16_array(voltages), runs)
+    report('L11 encode, one at a time', lambda: [PMIC.float_to_l11(time) for time in times.tolist()], runs)
+    report('L11 encode, array', lambda: PMIC.float_to_l11_array(times), runs)
+    report('L11 decode, one at a time', lambda: [PMIC.l11_to_float(word) for word in words.tolist()], runs)
+    report('L11 decode, array', lambda: PMIC.l11_to_float_array(words), runs)
+
+
+# Sends the same bulk sequence to every one of "boards" emulated boards on ptys, first from this process alone and
+#   then through a Farm, and prints the throughput of each
+def benchmark_farm(boards: int = 16, repeats: int = 200, sequence_length: int = 100):
+    import farm
+    import emulator
+
+    print(str('Board farm (' + str(boards) + ' emulated boards, ' + str(os.cpu_count()) + ' cores):'))
+    builder = FrameBuilder()
+    builder.add_many(DDS_DEVICE.commands['ramp_setup'],
+                     [('f', 1, 2, 3, 4, 5, 6 + index) for index in range(sequence_length)])
+    frame = bytes(builder.frame())
+    total = len(frame) * boards * repeats
+
+    devices = emulator.PtyDevices(boards)
+    ports = [serial.serial_for_url(name) for name in devices.names]
+    began = time.perf_counter()
+    for repeat in range(repeats):
+        for port in ports:
+            port.write(frame)
+    for port in ports:
+        port.flush()
+    single = time.perf_counter() - began
+    for port in ports:
+        port.close()
+    received, commands = devices.stop()
+    print(str('  One process'.ljust(42) + "%8.1f" % (total / single / 1e6) + ' MB/s  (' + str(sum(received)) +
+              ' bytes received)'))
+
+    for workers in sorted({1, 2, os.cpu_count() or 1}):
+        devices = emulator.PtyDevices(boards)
+        board_farm = farm.Farm(devices.names, workers)
+        began = time.perf_counter()
+        for repeat in range(repeats):
+            board_farm.broadcast(frame)
+        board_farm.flush()
+        elapsed = time.perf_counter() - began
+        board_farm.close()
+        received, commands = devices.stop()
+        print(str(str('  Farm, ' + str(workers) + ' workers').ljust(42) + "%8.1f" % (total / elapsed / 1e6) +
+                  ' MB/s  (' + str(sum(received)) + ' bytes received)'))
+
+
+# Round trips and pipelined frames through a bridge on a Unix socket, to an emulated board. The last one times a
+#   call from one client while another is streaming frames, which the fair queuing should keep short.
+def benchmark_bridge(frames: int = 10000):
+    import bridge
+    import emulator
+
+    print('Bridge (emulated board, Unix socket):')
+    address = '/tmp/pyduino-benchmark.sock'
+    board_bridge = bridge.Bridge({'board': emulator.EmulatedDAC()}, address)
+    client = bridge.BridgeClient(address)
+    other = bridge.BridgeClient(address)
+    frame = DAC_DEVICE.encode('write', DAC_A, 32768).encode()
+
+    report('Call round trip', lambda: client.call('board', 'invalidate'), 2000)
+    began = time.perf_counter()
+    requests = [client.send_frame('board', frame) for i in range(frames)]
+    requests[-1].wait()
+    print(str('  ' + 'Pipelined frame'.ljust(40) + "%8.0f" % ((time.perf_counter() - began) / frames * 1e9) + ' ns'))
+
+    requests = []
+    stream = threading.Thread(target=lambda: requests.extend(client.send_frame('board', frame) for i in range(frames)))
+    stream.start()
+    time.sleep(0.05)
+    began = time.perf_counter()
+    other.call('board', 'invalidate')
+    waited = time.perf_counter() - began
+    stream.join()
+    requests[-1].wait()
+    print(str('  ' + 'Call during a stream'.ljust(40) + "%8.0f" % (waited * 1e9) + ' ns'))
+
+    client.close()
+    other.close()
+    board_bridge.close()
+
+
+# Sends a stream of DAC writes with a DAC setup (100 ms with nothing read) every so often to an emulated board with
+#   a 64 byte receive buffer, without and with flow control, and prints how many commands made it through intact
+def benchmark_flow_control(commands: int = 2000, baudrate: int = 1000000, setup_every: int = 500, batch: int = 20):
+    import emulator
+
+    print(str('Flow control (' + str(commands) + ' commands at ' + str(baudrate) + ' baud, 64 byte receive buffer):'))
+    write = DAC_DEVICE.encode('write', DAC_A, 12345)
+    setup = DAC_DEVICE.encode('setup', DAC_BIPOLAR, DAC_GAIN_2)
+    stream = [setup if index % setup_every == 0 else write for index in range(commands)]
+    frames = [''.join(stream[index:index + batch]).encode() for index in range(0, commands, batch)]
+
+    for flow_control in (False, True):
+        board = emulator.BufferedBoard(baudrate)
+        pyduino.serial_port = board
+        if flow_control:
+            enable_flow_control(board, board.rx_buffer)
+            start_reader()
+
+        began = time.perf_counter()
+        for frame in frames:
+            send_frame(frame)
+        while not board.finished():
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - began
+
+        intact = board.commands[write[:-1].encode()] + board.commands[setup[:-1].encode()]
+        print(str(str('  ' + ('With' if flow_control else 'Without') + ' flow control').ljust(42) +
+                  "%8.0f" % (intact / elapsed) + ' commands/s  (' + str(intact) + '/' + str(commands) +
+                  ' intact, ' + str(board.dropped) + ' bytes dropped)'))
+
+        stop_reader()
+        FLOW.disable()
+    pyduino.serial_port = "none"
+
+
+###################################################
+
+#############
+# EXECUTION #
+#############
+
+if __name__ == '__main__':
+    benchmark_encoders()
+    benchmark_commands()
+    benchmark_frames()
+    benchmark_pmic_codec()
+    benchmark_farm()
+    benchmark_bridge()
+    benchmark_flow_control()
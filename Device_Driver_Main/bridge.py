@@ -0,0 +1,535 @@
+#########################################
+# Board Bridge                          #
+# Version: Beta 0.3                     #
+#                                       #
+# A daemon that keeps the boards open   #
+# and lets any process use them over a  #
+# local socket.                         #
+#########################################
+
+# HOW THIS WORKS
+#
+# Only the process holding pyduino.serial_port can talk to a board, and reopening a port is slow (and resets some
+# Arduinos). The bridge opens every board once and serves the controller functions to any number of clients over a
+# Unix socket (address is a path, only the user running the bridge can connect) or TCP on a loopback address (address
+# is a (host, port) tuple):
+#
+#   python bridge.py /tmp/pyduino.sock /dev/ttyACM0 /dev/ttyACM1
+#
+#   client = BridgeClient('/tmp/pyduino.sock')
+#   dac = client.controller('/dev/ttyACM0')
+#   dac.send_voltage(DAC_A, 1.0, 2.024, 2.0, True)
+#   dac.read_dac_registers()                        # the Request is waited on at the bridge, the result comes back
+#
+# Every message is a small binary header and a payload:
+#   request: payload length (4 bytes), request id (4), board index (1), operation (1), payload
+#   answer:  payload length (4 bytes), request id (4), status (1), payload
+# A call's payload is [function name, arguments] and its answer is the return value, both JSON with dicts sent as
+# {"items": [[key, value], ...]} so keys that aren't strings come through. Only the device functions in BRIDGE_CALLS
+# can be called, nothing that opens ports, reads or writes files or runs for long. A frame's payload is bytes to write
+# to the board as they are, e.g. a FrameBuilder.frame() built on the client.
+#
+# Clients don't have to wait for an answer before sending the next request. Every board has a worker thread of its own
+# and every client a queue for each board, and the worker takes one request from each client with work waiting in
+# turn, so one client streaming frames can't hold up the others and a slow call on one board doesn't hold up the rest.
+# Requests from one client to one board are run in the order they were sent.
+#
+# Each board keeps its own shadow registers, DAC calibrations, negotiated capabilities, reader, supervisor, flow
+# control and packets, swapped into pyduino while its requests run (and while it reconnects) under pyduino.BOARD_LOCK.
+# Whatever was in pyduino before is put back after, so the process's own default port carries on as it was.
+# Ports given by name are opened with pyduino.connect() as that board, so they get everything the default port would,
+# and reconnect on their own if they drop out. Frames go through the board's supervisor like any other write, so they
+# are paced, put in packets and held over a reconnect the same way. The PMIC VOUT_MODE cache is still shared by all of
+# them.
+#
+# FUNCTIONS
+# Bridge()
+#   (boards: dict, address) -> Bridge
+#   Serves {name: port} where port is a port name or anything that works as pyduino.serial_port (e.g. an emulator)
+#
+# BridgeClient.call() / BridgeClient.call_async()
+#   (board: str, name: str, *args) -> result / Request
+#   Runs a controller function on a board
+#
+# BridgeClient.send_frame()
+#   (board: str, frame) -> Request
+#   Writes bytes to a board without waiting
+#
+# BridgeClient.port() / BridgeClient.controller()
+#   (board: str) -> BridgePort / BridgeController
+#   Stand-ins for pyduino.serial_port and the controller module on one board
+
+###################################################
+
+###########
+# IMPORTS #
+###########
+
+import collections
+import ipaddress
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import numpy
+import pyduino
+import controller
+import serial
+from pyduino import *
+
+
+###################################################
+
+#############
+# CONSTANTS #
+#############
+
+BRIDGE_REQUEST = struct.Struct('<IIBB')
+BRIDGE_ANSWER = struct.Struct('<IIB')
+
+# Operations
+BRIDGE_CALL = ord('c')
+BRIDGE_FRAME = ord('f')
+BRIDGE_BOARDS = ord('b')
+
+# Answer statuses
+BRIDGE_OK = 0
+BRIDGE_ERROR = 1
+
+# How long a call may wait on an answer from the board
+BRIDGE_TIMEOUT = 2.0
+
+# Biggest request payload taken, a client sending more is cut off
+BRIDGE_MAX_PAYLOAD = 1 << 20
+
+# Controller functions clients may call. Only ones working on the board the bridge already has open, with arguments
+#   that come through as JSON. Not connect(), set_com() or discover() (they'd reopen the bridge's ports),
+#   save_state() and restore_state() (they take file paths) or sweep() (it can stream for minutes).
+BRIDGE_CALLS = {'send', 'send_batch', 'send_sequence', 'load', 'reset', 'disable_ramp', 'send_single_tone',
+                'update_single_tone', 'send_bulk_single_tones', 'send_ramp_parameters', 'send_ramp_setup', 'add_ramp',
+                'select_ramp', 'set_ramp_direction', 'send_voltage', 'send_voltages', 'send_bulk_voltages',
+                'send_voltage_sequence', 'invalidate_dac_data', 'send_initialization', 'read_dac_registers',
+                'verify_dac', 'invalidate', 'send_pmic_writes', 'configure_rails', 'set_rail_voltage', 'enable_rail',
+                'read_vout_modes', 'is_connected', 'reconnect_stats', 'link_stats', 'capabilities', 'current_com'}
+
+
+###################################################
+
+##########
+# SERVER #
+##########
+
+# Everything pyduino keeps about one board
+class Board:
+
+    def __init__(self, name: str, port, capabilities=HOST_CAPABILITIES):
+        self.name = name
+        self.com_port = name
+        self.serial_port = port
+        self.capabilities = capabilities
+        self.reader = None
+        self.shadows = [ShadowRegisters().__dict__ for shadow in SHADOWS]
+        self.calibrations = {}
+        self.ramp_slots = collections.OrderedDict()
+        self.supervisor = Supervisor()
+        self.flow = FlowControl()
+        self.packets = PacketLink()
+        self.supervisor.packets = self.packets
+        self.supervisor.board = self
+
+        # Whatever was in the globals before, put back when this board is done with them
+        self.previous = []
+
+    # Whatever's in the pyduino globals now, as a board that can be put back
+    @staticmethod
+    def current():
+        board = Board.__new__(Board)
+        board.deactivate()
+        return board
+
+    # Puts this board in the pyduino globals for as long as it's held, see pyduino.BOARD_LOCK
+    def __enter__(self):
+        BOARD_LOCK.acquire()
+        self.previous.append(Board.current())
+        self.activate()
+        return self
+
+    def __exit__(self, *exception):
+        self.deactivate()
+        self.previous.pop().activate()
+        BOARD_LOCK.release()
+
+    # Makes this the board pyduino talks to
+    def activate(self):
+        pyduino.com_port = self.com_port
+        pyduino.serial_port = self.serial_port
+        pyduino.CAPABILITIES = self.capabilities
+        pyduino.READER = self.reader
+        for shadow, state in zip(SHADOWS, self.shadows):
+            shadow.__dict__ = state
+        DAC_CALIBRATIONS.clear()
+        DAC_CALIBRATIONS.update(self.calibrations)
+        RAMP_LIBRARY.slots = self.ramp_slots
+        pyduino.SUPERVISOR = self.supervisor
+        pyduino.FLOW = self.flow
+        pyduino.PACKETS = self.packets
+
+    # Keeps whatever a call changed (e.g. a reconnect or a new calibration)
+    def deactivate(self):
+        self.com_port = pyduino.com_port
+        self.serial_port = pyduino.serial_port
+        self.capabilities = pyduino.CAPABILITIES
+        self.reader = pyduino.READER
+        self.shadows = [shadow.__dict__ for shadow in SHADOWS]
+        self.calibrations = dict(DAC_CALIBRATIONS)
+        self.ramp_slots = RAMP_LIBRARY.slots
+        self.supervisor = pyduino.SUPERVISOR
+        self.flow = pyduino.FLOW
+        self.packets = pyduino.PACKETS
+
+
+# One connected client and the requests it's waiting on, a queue for each board
+class Client:
+
+    def __init__(self, connection, boards: int):
+        self.connection = connection
+        self.queues = [collections.deque() for board in range(boards)]
+        self.send_lock = threading.Lock()
+        self.open = True
+
+    def answer(self, request_id: int, status: int, payload: bytes = b''):
+        with self.send_lock:
+            try:
+                self.connection.sendall(BRIDGE_ANSWER.pack(len(payload), request_id, status) + payload)
+            except OSError:
+                self.open = False
+
+
+class Bridge:
+
+    def __init__(self, boards: dict, address):
+        self.boards = []
+        for name, port in boards.items():
+            # Ports are opened the same way pyduino.connect() opens the default one, so they get negotiated, flow
+            #   control, packets, a reader and a supervisor that reconnects them
+            if isinstance(port, str):
+                board = Board(name, "none")
+                with board:
+                    if not pyduino.connect(port):
+                        raise serial.SerialException(str("Couldn't open " + port))
+                self.boards.append(board)
+            else:
+                self.boards.append(Board(name, port))
+        self.names = encode_value([board.name for board in self.boards])
+
+        self.address = address
+        self.clients = []
+        self.condition = threading.Condition()
+        self.running = True
+
+        # Anyone who can connect can drive the boards, so nothing outside this user on this machine gets to
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(address)
+            os.chmod(address, 0o600)
+        else:
+            if not ipaddress.ip_address(socket.gethostbyname(address[0])).is_loopback:
+                raise ValueError(str('The bridge only serves TCP on loopback addresses, not ' + str(address[0])))
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind(address)
+        self.listener.listen()
+
+        self.threads = [threading.Thread(target=self.accept, name='bridge listener', daemon=True)]
+        for index, board in enumerate(self.boards):
+            self.threads.append(threading.Thread(target=self.work, args=(index,), name=str('bridge ' + board.name),
+                                                 daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def accept(self):
+        while self.running:
+            try:
+                connection, address = self.listener.accept()
+            except OSError:
+                break
+            if connection.family == socket.AF_INET:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = Client(connection, len(self.boards))
+            with self.condition:
+                self.clients.append(client)
+            threading.Thread(target=self.receive, args=(client,), name='bridge client', daemon=True).start()
+
+    # Reads a client's requests into its queues, answering the ones that don't need a board right away
+    def receive(self, client: Client):
+        stream = client.connection.makefile('rb')
+        while self.running:
+            header = stream.read(BRIDGE_REQUEST.size)
+            if len(header) < BRIDGE_REQUEST.size:
+                break
+            length, request_id, board, operation = BRIDGE_REQUEST.unpack(header)
+            if length > BRIDGE_MAX_PAYLOAD:
+                break
+            payload = stream.read(length)
+            if len(payload) < length:
+                break
+            if operation == BRIDGE_BOARDS:
+                client.answer(request_id, BRIDGE_OK, self.names)
+            elif board >= len(self.boards):
+                client.answer(request_id, BRIDGE_ERROR, str('No such board: ' + str(board)).encode())
+            else:
+                with self.condition:
+                    client.queues[board].append((request_id, operation, payload))
+                    self.condition.notify_all()
+
+        stream.close()
+        with self.condition:
+            client.open = False
+            self.condition.notify_all()
+
+    # Runs one board's requests, one from each client with anything queued for it at a time
+    def work(self, index: int):
+        board = self.boards[index]
+        while self.running:
+            with self.condition:
+                while self.running and not any(client.queues[index] for client in self.clients):
+                    self.clients = [client for client in self.clients if client.open or any(client.queues)]
+                    self.condition.wait()
+                ready = [client for client in self.clients if client.queues[index]]
+                requests = [client.queues[index].popleft() for client in ready]
+
+            for client, request in zip(ready, requests):
+                self.run(client, board, *request)
+
+    def run(self, client: Client, board: Board, request_id: int, operation: int, payload: bytes):
+        try:
+            if operation == BRIDGE_FRAME:
+                self.send_frame(board, payload)
+                client.answer(request_id, BRIDGE_OK)
+            elif operation == BRIDGE_CALL:
+                name, args = decode_value(payload)
+                if not isinstance(name, str) or name not in BRIDGE_CALLS:
+                    raise ValueError(str('No such controller function: ' + str(name)))
+                if not isinstance(args, list):
+                    raise ValueError('Arguments have to be a list')
+                client.answer(request_id, BRIDGE_OK, encode_value(self.call(board, name, args)))
+            else:
+                raise ValueError(str('Unknown operation: ' + str(operation)))
+        except Exception as exception:
+            client.answer(request_id, BRIDGE_ERROR, str(type(exception).__name__ + ': ' + str(exception)).encode())
+
+    # Only the call itself holds the board, the answer is waited on after
+    def call(self, board: Board, name: str, args):
+        with board:
+            result = getattr(controller, name)(*args)
+        if isinstance(result, Request):
+            result = result.wait(BRIDGE_TIMEOUT)
+        return result
+
+    def send_frame(self, board: Board, frame: bytes):
+        with board:
+            pyduino.send_frame(frame)
+
+    def close(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        self.listener.close()
+        for client in self.clients:
+            client.connection.close()
+        for board in self.boards:
+            with board:
+                # Stops a reconnect that's still looking for it
+                with pyduino.SUPERVISOR.lock:
+                    pyduino.SUPERVISOR.down = False
+                stop_reader()
+                if pyduino.serial_port != "none":
+                    pyduino.serial_port.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+# Turns a value into something JSON can hold: NumPy values to lists and numbers, objects to dicts of their fields and
+#   dicts to {"items": [[key, value], ...]}
+def plain(value):
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {'items': [[plain(key), plain(item)] for key, item in value.items()]}
+    if isinstance(value, (numpy.ndarray, numpy.generic)):
+        return value.tolist()
+    if hasattr(value, '__dict__'):
+        return plain(vars(value))
+    return value
+
+
+def encode_value(value) -> bytes:
+    return json.dumps(plain(value)).encode()
+
+
+# Reads back what encode_value() made. Keys that were tuples come back as tuples, anything that isn't what
+#   encode_value() makes raises a ValueError.
+def decode_value(data: bytes):
+    return json.loads(data.decode(), object_hook=decode_dict)
+
+
+def decode_dict(value: dict) -> dict:
+    items = value.get('items')
+    if len(value) != 1 or not isinstance(items, list) or not all(isinstance(item, list) and len(item) == 2
+                                                                  for item in items):
+        raise ValueError('Dicts have to be sent as {"items": [[key, value], ...]}')
+    return {hashable(key): item for key, item in items}
+
+
+def hashable(value):
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    if isinstance(value, dict):
+        raise ValueError("Dicts can't be keys")
+    return value
+
+
+###################################################
+
+##########
+# CLIENT #
+##########
+
+class BridgeClient:
+
+    def __init__(self, address):
+        if isinstance(address, str):
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection.connect(address)
+
+        self.pending = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self.receive, name='bridge client reader', daemon=True)
+        self.reader.start()
+        self.boards = {name: index for index, name in enumerate(self.request(0, BRIDGE_BOARDS).wait())}
+
+    # Sends a request and returns the Request its answer goes to
+    def request(self, board: int, operation: int, payload: bytes = b'') -> Request:
+        request = Request(1, decode_answer)
+        with self.lock:
+            request_id = self.next_id
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+            self.pending[request_id] = request
+            self.connection.sendall(BRIDGE_REQUEST.pack(len(payload), request_id, board, operation) + payload)
+        return request
+
+    def receive(self):
+        stream = self.connection.makefile('rb')
+        while True:
+            header = stream.read(BRIDGE_ANSWER.size)
+            if len(header) < BRIDGE_ANSWER.size:
+                break
+            length, request_id, status = BRIDGE_ANSWER.unpack(header)
+            payload = stream.read(length)
+            with self.lock:
+                request = self.pending.pop(request_id, None)
+            if request is not None:
+                request.receive((status, payload))
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for request in pending.values():
+            request.receive((BRIDGE_ERROR, b'Bridge closed'))
+
+    def call_async(self, board: str, name: str, *args) -> Request:
+        return self.request(self.boards[board], BRIDGE_CALL, encode_value([name, args]))
+
+    # Runs a controller function on a board and returns what it returned. Errors at the bridge are raised here.
+    def call(self, board: str, name: str, *args):
+        return result_of(self.call_async(board, name, *args))
+
+    def send_frame(self, board: str, frame) -> Request:
+        return self.request(self.boards[board], BRIDGE_FRAME, bytes(frame))
+
+    def port(self, board: str):
+        return BridgePort(self, board)
+
+    def controller(self, board: str):
+        return BridgeController(self, board)
+
+    def close(self):
+        self.connection.shutdown(socket.SHUT_RDWR)
+        self.connection.close()
+        self.reader.join()
+
+
+# Unpacks an answer into its value, or a RuntimeError if the bridge couldn't do it
+def decode_answer(payloads: list):
+    status, payload = payloads[0]
+    if status == BRIDGE_OK:
+        return decode_value(payload) if payload else None
+    return RuntimeError(payload.decode())
+
+
+def result_of(request: Request):
+    result = request.wait()
+    if isinstance(result, RuntimeError):
+        raise result
+    return result
+
+
+# Stands in for a serial port on a board behind a bridge. Writes don't wait, and nothing is read back this way.
+class BridgePort:
+
+    def __init__(self, client: BridgeClient, board: str):
+        self.client = client
+        self.board = board
+        self.in_waiting = 0
+
+    def write(self, data):
+        self.client.send_frame(self.board, data)
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        return b''
+
+    def close(self):
+        pass
+
+
+# Stands in for the controller module on one board, e.g. client.controller(board).send_voltage(...)
+class BridgeController:
+
+    def __init__(self, client: BridgeClient, board: str):
+        self.client = client
+        self.board = board
+
+    def __getattr__(self, name: str):
+        if name not in BRIDGE_CALLS:
+            raise AttributeError(name)
+        return lambda *args: self.client.call(self.board, name, *args)
+
+
+###################################################
+
+#############
+# EXECUTION #
+#############
+
+# python bridge.py <socket path or host:port> <ports...>, every port found if none are given
+if __name__ == '__main__':
+    address = sys.argv[1] if len(sys.argv) > 1 else '/tmp/pyduino.sock'
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        address = (host, int(port))
+    ports = sys.argv[2:] or list_com_ports()
+
+    bridge = Bridge({port: port for port in ports}, address)
+    print(str('Serving ' + ', '.join(ports) + ' on ' + str(address)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        bridge.close()
@@ -15,13 +15,90 @@
 #   (address: chr, desired_voltage: float, reference_voltage: float, gain: float, bipolar: bool) -> void
 #   Send a desired voltage to write to a chosen output of the DAC
 #
+# send_voltages()
+#   (voltages: dict, reference_voltage: float, gain: float, bipolar: bool) -> void
+#   Sends {address: voltage} for several outputs in one command, and they all change together on one LDAC edge
+#
+# send_bulk_voltages() / send_bulk_single_tones()
+#   (voltages: dict, reference_voltage: float, gain: float, bipolar: bool) / (tones: dict, freq_sysclk: float) -> void
+#   Updates every DAC or DDS on the board ({instance: ...}) in one frame, loaded together at the end
+#
+# add_ramp() / select_ramp() / set_ramp_direction()
+#   (name, parameter, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p, store: bool = False) /
+#   (name, instance: int = 0) / (up: bool, hold: bool = False) -> void
+#   Keeps named DRG ramps encoded on the host (and on the board with store) so switching to one is a short command,
+#   and turns the running ramp around or holds it with the DRCTL/DRHOLD pins
+#
+# The DAC and DDS functions all take an instance too, for boards with more than one of them (0 is the first)
+#
 # send_initialization()
 #   (is_bipolar: bool, gain: str) -> void
 #   Sends a command to initialize the DAC given the desired settings
 #
+# send()
+#   (device: str, command: str, *values) -> void
+#   Sends any command declared in the pyduino device registry
+#
+# send_batch()
+#   (commands: list) -> void
+#   Sends a list of (device, command, values) registry commands as one frame
+#
+# send_sequence()
+#   (device: str, command: str, rows: list) -> void
+#   Sends one registry command for every tuple of values in rows as one frame
+#
+# connect()
+#   (port: str = None) -> bool
+#   Opens a COM port, the first board found by discover() if none is given. Nothing is opened until this is called.
+#
+# discover() / port_info()
+#   (refresh: bool = False) -> list / (port: str) -> PortInfo
+#   Identifies every board plugged in with one parallel probe, cached by USB serial number
+#
 # set_com()
 #   (port: str) -> void
 #   Changes the default COM port
+#
+# reconnect_stats()
+#   () -> dict
+#   If the board drops out, sends are held until it's found and reopened, then replayed. This says how that went.
+#
+# link_stats()
+#   () -> dict
+#   Packets sent, sent again and bad on either side, for firmware that checks everything with a CRC
+#
+# calibrate_dac()
+#   (address: chr, measure, reference_voltage: float, gain: float, bipolar: bool, points: int = 64) -> Calibration
+#   Sweeps an output against a meter (or emulator) and uses the fitted gain/offset/INL for it from then on.
+#   Save them for the board with save_calibrations() and get them back with load_calibrations().
+#
+# read_dac_registers()
+#   (registers: list = None, callback = None) -> Request
+#   Reads back DAC registers in one request/response without blocking
+#
+# verify_dac()
+#   (callback = None) -> Request
+#   Checks the DAC registers against what the host last wrote to them
+#
+# commit()
+#   (transaction: Transaction, callback = None) -> Request
+#   Sends DAC, DDS and PMIC changes in one frame that all take effect on one trigger, e.g.
+#   commit(Transaction().set_voltages({DAC_A: 1.0}, 2.024, 2.0, True).set_pmic_writes([(0, PMIC_VOUT_COMMAND, 1.2)]))
+#   The result (or callback) is a CommitResult with how long the board and the round trip took.
+#
+# save_state() / restore_state()
+#   (path: str) / (snapshot, force: bool = True) -> void
+#   Saves everything set up on a board and puts it back in one batch, e.g. after a USB reset
+#
+# configure_rails()
+#   (rails: dict) -> void
+#   Sets up the voltages, limits and sequencing of any number of PMIC rails, batched into as few commands as possible
+#
+# sweep()
+#   (parameter: chr, sysclk, reference, start, stop, duration, resolution, amplitude, ref_amplitude, phase, frequency)
+#       -> RampPlan
+#   Plans a sweep with DDS.plan_ramp() and runs it in the DRG when it fits, streams it one step at a time when it's
+#   too slow for the DRG and raises a ValueError when it's too fast
 
 ###################################################
 
@@ -29,6 +106,9 @@
 # IMPORTS #
 ###########
 
+import math
+import time
+import numpy
 import pyduino
 import serial
 from pyduino import *
@@ -40,38 +120,183 @@ from pyduino import *
 # FUNCTIONS #
 #############
 
+###########
+# GENERIC #
+###########
+
+# Sends any command declared in the pyduino device registry, e.g. send('dac', 'write', DAC_A, 32768)
+def send(device: str, command: str, *values):
+    send_command(DEVICES[device].commands[command].encode(*values))
+
+
+# Sends a list of (device, command, values) in one write, built in the shared frame buffer
+def send_batch(commands):
+    builder = pyduino.FRAME_BUILDER
+    builder.clear()
+    for device, command, values in commands:
+        builder.add(DEVICES[device].commands[command], *values)
+    send_frame(builder.frame())
+
+
+# Sends a list of finished commands in one write
+def send_frame_of(commands: list):
+    if not commands:
+        return
+    builder = pyduino.FRAME_BUILDER
+    builder.clear()
+    for command in commands:
+        builder.add_bytes(command.encode())
+    send_frame(builder.frame())
+
+
+# Sends the same registry command for every tuple of values in rows, in one write
+def send_sequence(device: str, command: str, rows):
+    builder = pyduino.FRAME_BUILDER
+    builder.clear()
+    builder.add_many(DEVICES[device].commands[command], rows)
+    send_frame(builder.frame())
+
+
 #######
 # DDS #
 #######
 
-# Sends a load command to the DDS
+# Sends each command in a list, used for what the shadow registers say still needs sending
+def send_commands(commands: list):
+    for command in commands:
+        send_command(command)
+
+
+# Sends a load command to the DDS (skipped if nothing was written since the last one). Every DDS on the board loads
+#   on the same IO_UPDATE.
 def load():
-    send_command(DDS.create_load_command())
+    send_commands(DDS.shadow_load_commands())
 
 
-# Resets the DDS to the defaults I'm using for this program
+# Resets the DDS to the defaults I'm using for this program. The reset line is shared, so this resets all of them.
 def reset():
     send_command(DDS.create_reset_command())
+    for shadow in DDS_SHADOWS:
+        shadow.invalidate()
 
 
 # Sends a disable ramp command to the DDS
-def disable_ramp():
-    send_command(DDS.create_disable_ramp_command())
+def disable_ramp(instance: int = 0):
+    pyduino.require_instance(instance, DDS_INSTANCES)
+    send_commands(DDS.shadow_disable_ramp_commands(instance))
 
 
 # Sends a single tone setup command to the DDS
-def send_single_tone(amplitude: float, ref_amplitude: float, phase: float, frequency: float, freq_sysclk: float):
-    send_command(DDS.create_single_tone_command(amplitude, ref_amplitude, phase, frequency, freq_sysclk))
+def send_single_tone(amplitude: float, ref_amplitude: float, phase: float, frequency: float, freq_sysclk: float,
+                     instance: int = 0):
+    pyduino.require_instance(instance, DDS_INSTANCES)
+    words = DDS.calculate_parameters_words(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
+    send_commands(DDS.shadow_profile_commands('single_tone', *words, instance=instance))
+
+
+# Sends a single tone and loads it right away, for live updates while a slider is being dragged
+def update_single_tone(amplitude: float, ref_amplitude: float, phase: float, frequency: float, freq_sysclk: float,
+                       instance: int = 0):
+    send_single_tone(amplitude, ref_amplitude, phase, frequency, freq_sysclk, instance)
+    load()
+
+
+# Sends single tones to several DDSs ({instance: (amplitude, ref_amplitude, phase, frequency)}) in one frame, with
+#   one load at the end so they all change together
+def send_bulk_single_tones(tones: dict, freq_sysclk: float):
+    commands = []
+    for instance, tone in tones.items():
+        pyduino.require_instance(instance, DDS_INSTANCES)
+        words = DDS.calculate_parameters_words(*tone, freq_sysclk)
+        commands += DDS.shadow_profile_commands('single_tone', *words, instance=instance)
+    send_frame_of(commands + DDS.shadow_load_commands())
 
 
 # Sends the other parameters while in DRG mode (not the ramp setup parameters) (functionally same as send_single_tone())
-def send_ramp_parameters(amplitude: float, ref_amplitude: float, phase: float, frequency: float, freq_sysclk: float):
-    send_command(DDS.create_ramp_parameters_command(amplitude, ref_amplitude, phase, frequency, freq_sysclk))
+def send_ramp_parameters(amplitude: float, ref_amplitude: float, phase: float, frequency: float, freq_sysclk: float,
+                         instance: int = 0):
+    pyduino.require_instance(instance, DDS_INSTANCES)
+    words = DDS.calculate_parameters_words(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
+    send_commands(DDS.shadow_profile_commands('ramp_parameters', *words, instance=instance))
 
 
 # Sends the command to set up the DRG for the desired parameter
-def send_ramp_setup(parameter: chr, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p):
-    send_command(DDS.create_ramp_setup_command(parameter, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p))
+def send_ramp_setup(parameter: chr, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p,
+                    instance: int = 0):
+    pyduino.require_instance(instance, DDS_INSTANCES)
+    words = DDS.calculate_ramp_setup_words(parameter, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p)
+    send_commands(DDS.shadow_ramp_setup_commands(parameter, *words, instance=instance))
+
+
+# Sends the DRG setup words picked by DDS.plan_ramp()
+def send_ramp_plan(plan, instance: int = 0):
+    pyduino.require_instance(instance, DDS_INSTANCES)
+    send_commands(DDS.shadow_ramp_setup_commands(plan.parameter, plan.lower_limit, plan.upper_limit,
+                                                 plan.decrement, plan.increment, plan.rate_n, plan.rate_p, instance))
+
+
+# Adds a named ramp to the library, store keeps it on the board too if the firmware can
+def add_ramp(name, parameter: chr, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p,
+             store: bool = False):
+    words = DDS.calculate_ramp_setup_words(parameter, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p)
+    RAMP_LIBRARY.add(name, parameter, *words)
+    if store and pyduino.CAPABILITIES.supports('ramps'):
+        send_commands(RAMP_LIBRARY.store_commands(name))
+
+
+# Adds the ramp picked by DDS.plan_ramp() to the library
+def add_ramp_plan(name, plan, store: bool = False):
+    RAMP_LIBRARY.add_plan(name, plan)
+    if store and pyduino.CAPABILITIES.supports('ramps'):
+        send_commands(RAMP_LIBRARY.store_commands(name))
+
+
+# Switches a DDS to a ramp from the library. Takes effect on the next load().
+def select_ramp(name, instance: int = 0):
+    pyduino.require_instance(instance, DDS_INSTANCES)
+    send_commands(RAMP_LIBRARY.select_commands(name, instance))
+
+
+# Sets which way the DRG ramps (up towards the upper limit or down towards the lower one) and whether it's held,
+#   right away and without sending the ramp again. The pins go to every DDS on the board.
+def set_ramp_direction(up: bool, hold: bool = False):
+    pyduino.require('ramps')
+    send_command(DDS_DEVICE.encode('ramp_pins', int(up), int(hold)))
+
+
+# Runs a sweep of one parameter from start to stop over "duration" seconds in steps no bigger than "resolution".
+#   Sweeps the DRG can handle are loaded into it in one go. Sweeps too slow for it get streamed as single tones over
+#   serial instead, sweeps too fast for it raise a ValueError since every streamed step costs a whole command.
+def sweep(parameter: chr, sysclk, reference, start, stop, duration, resolution,
+          amplitude: float, ref_amplitude: float, phase: float, frequency: float, instance: int = 0):
+    plan = DDS.plan_ramp(parameter, sysclk, reference, start, stop, duration, resolution)
+
+    if plan.in_hardware:
+        send_ramp_plan(plan, instance)
+        send_ramp_parameters(amplitude, ref_amplitude, phase, frequency, sysclk, instance)
+        load()
+        return plan
+
+    # Even the fastest ramp the DRG can do at this resolution takes too long, streaming it would be far slower still
+    if plan.actual_duration > duration:
+        raise ValueError('The sweep is too fast for the DRG at this resolution')
+
+    disable_ramp(instance)
+    step_count = max(math.ceil((stop - start) / resolution), 1)
+    step_time = duration / step_count
+    for i in range(step_count + 1):
+        value = start + (stop - start) * i / step_count
+        if parameter == DDS_FREQUENCY:
+            frequency = value
+        elif parameter == DDS_PHASE:
+            phase = value
+        else:
+            amplitude = value
+        send_single_tone(amplitude, ref_amplitude, phase, frequency, sysclk, instance)
+        load()
+        time.sleep(step_time)
+
+    return plan
 
 
 #######
@@ -79,23 +304,229 @@ def send_ramp_setup(parameter: chr, sysclk, reference, start, stop, decrement, i
 #######
 
 # Sends a voltage command
-def send_voltage(address: chr, desired_voltage: float, reference_voltage: float, gain: float, bipolar: bool):
-    send_command(DAC.create_voltage_command(address, desired_voltage, reference_voltage, gain, bipolar))
+def send_voltage(address: chr, desired_voltage: float, reference_voltage: float, gain: float, bipolar: bool,
+                 instance: int = 0):
+    pyduino.require_instance(instance, DAC_INSTANCES)
+    send_commands(DAC.shadow_voltage_commands(address, desired_voltage, reference_voltage, gain, bipolar, instance))
+
+
+# Sends voltages to several outputs ({address: voltage}) in one command, loaded onto the outputs at the same time
+def send_voltages(voltages: dict, reference_voltage: float, gain: float, bipolar: bool, instance: int = 0):
+    pyduino.require_instance(instance, DAC_INSTANCES)
+    send_commands(DAC.shadow_simultaneous_commands(voltages, reference_voltage, gain, bipolar, instance))
+
+
+# Sends voltages to the outputs of several DACs ({instance: {address: voltage}}) in one frame, every output on the
+#   board changing together on one LDAC edge
+def send_bulk_voltages(voltages: dict, reference_voltage: float, gain: float, bipolar: bool):
+    for instance in voltages:
+        pyduino.require_instance(instance, DAC_INSTANCES)
+    send_frame_of(DAC.shadow_bulk_commands(voltages, reference_voltage, gain, bipolar))
+
+
+# Sends a whole sequence of voltages to one output in one write, converted all at once
+def send_voltage_sequence(address: chr, voltages, reference_voltage: float, gain: float, bipolar: bool,
+                          instance: int = 0):
+    pyduino.require_instance(instance, DAC_INSTANCES)
+    data = DAC.calculate_bits_array(voltages, reference_voltage, gain, bipolar, DAC.output_name(address, instance))
+    builder = pyduino.FRAME_BUILDER
+    builder.clear()
+    builder.add_many(DAC_DEVICE.instance(instance).commands['write'], [(address, word) for word in data.tolist()])
+    send_frame(builder.frame())
+    invalidate_dac_data(instance)
+
+
+# Measures an output at "points" codes across its range and stores the calibration that fits, for every conversion
+#   to that output from then on. measure() returns the voltage on the output right now, from a meter or an emulator.
+def calibrate_dac(address: chr, measure, reference_voltage: float, gain: float, bipolar: bool,
+                  points: int = 64, settle: float = 0.01, inl: bool = True, instance: int = 0):
+    pyduino.require_instance(instance, DAC_INSTANCES)
+    codes = numpy.linspace(0, DAC_CODES - 1, points).round().astype(int)
+    measured = numpy.zeros(points)
+
+    for index, code in enumerate(codes.tolist()):
+        send_command(DAC_DEVICE.instance(instance).encode('write', address, code << (DAC_MAX_BITS - DAC_BITS)))
+        time.sleep(settle)
+        measured[index] = measure()
+    invalidate_dac_data(instance)
+
+    calibration = Calibration.fit(codes, measured, reference_voltage, gain, bipolar, inl)
+    DAC_CALIBRATIONS[DAC.output_name(address, instance)] = calibration
+    return calibration
+
+
+# Forgets what's in the DAC data registers after writes that skipped the shadow registers
+def invalidate_dac_data(instance: int = 0):
+    shadow = DAC_SHADOWS[instance]
+    for register in [register for register in shadow.registers if register[0] == DAC_DATA_REGISTER]:
+        del shadow.registers[register]
+
 
+# Sends a setup command. force skips the shadow registers and sets up the DAC again no matter what.
+def send_initialization(is_bipolar: bool, gain: str, force: bool = False, instance: int = 0):
+    pyduino.require_instance(instance, DAC_INSTANCES)
+    if force:
+        DAC_SHADOWS[instance].invalidate()
+    send_commands(DAC.shadow_initialization_commands(is_bipolar, gain, instance))
 
-# Sends a setup command
-def send_initialization(is_bipolar: bool, gain: str):
-    send_command(DAC.create_initialization_command(is_bipolar, gain))
+
+# Reads back DAC registers, all of them if none are given, in one request. Returns a Request right away whose result
+#   (or callback) is {(register, channel): value}.
+def read_dac_registers(registers: list = None, callback=None, instance: int = 0):
+    if registers is None:
+        registers = DAC.readback_registers()
+    return request_dac_readback(registers, DAC.parse_readback, callback, instance)
+
+
+# Reads back every DAC register the host thinks it knows and compares them. The result (or callback) is
+#   {(register, channel): (expected, read)} for the ones that don't match, empty if the hardware is as intended.
+def verify_dac(callback=None, instance: int = 0):
+    expected = dict(DAC_SHADOWS[instance].registers)
+    return request_dac_readback(list(expected),
+                                lambda payloads: DAC.readback_mismatches(DAC.parse_readback(payloads), expected),
+                                callback, instance)
+
+
+# Sends all the read commands for a list of registers in one write, after setting up the Request for the answers
+def request_dac_readback(registers: list, parse, callback, instance: int = 0):
+    pyduino.require('readback')
+    pyduino.require_instance(instance, DAC_INSTANCES)
+    commands = DAC.create_read_commands(registers, instance)
+    start_reader()
+    request = expect(FRAME_DAC_READBACK, len(commands), parse, callback)
+    send_frame_of(commands)
+    return request
+
+
+# Forgets what's known to be in the DDS and DAC registers so everything gets sent again
+def invalidate():
+    invalidate_shadows()
+
+
+########
+# PMIC #
+########
+
+# Sends a list of (page, code, value) PMBus writes, values in volts/ms, all in one write. Registers that already
+#   hold the value are skipped.
+def send_pmic_writes(writes: list):
+    pyduino.require('sequences')
+    send_frame_of(PMIC.shadow_write_commands(writes))
+
+
+# Sets up any number of rails at once from {page: {setting: value}}, e.g. {0: {'vout': 1.2, 'ton_delay': 5}}.
+#   Setting names are the keys of PMIC_RAIL_SETTINGS.
+def configure_rails(rails: dict):
+    writes = []
+    for page, settings in rails.items():
+        writes.extend(PMIC.rail_writes(page, **settings))
+    send_pmic_writes(writes)
+
+
+# Sets the output voltage of one rail
+def set_rail_voltage(page: int, voltage: float):
+    send_pmic_writes([(page, PMIC_VOUT_COMMAND, voltage)])
+
+
+# Turns a rail on or off
+def enable_rail(page: int, enabled: bool):
+    send_pmic_writes([(page, PMIC_OPERATION, PMIC_ON if enabled else PMIC_OFF)])
+
+
+# Asks the PMIC for every page's VOUT_MODE. The reader caches them in PMIC_VOUT_MODES when they come back, after
+#   which all the L16 values are worked out with them.
+def read_vout_modes():
+    pyduino.require('frames')
+    start_reader()
+    send_command(PMIC.create_read_vout_mode_command())
 
 
 #######
 # COM #
 #######
 
-# Use to set the COM Port being used
-def set_com(port: str):
-    pyduino.serial_port.close()
-    pyduino.serial_port = serial.Serial(port=port, baudrate=9600)
+# Opens the COM port (the first one available if none is given). Returns whether it worked.
+def connect(port: str = None) -> bool:
+    return pyduino.connect(port)
+
+
+# Whether a COM port has been opened
+def is_connected() -> bool:
+    return pyduino.serial_port != "none" and not pyduino.SUPERVISOR.down
+
+
+# Names of the COM ports that were found the last time one was opened
+def com_ports() -> list:
+    return list(pyduino.COM_PORTS_LIST)
+
+
+# Disconnects, how long reconnecting took and how many frames were held and sent again, see pyduino RECONNECT
+def reconnect_stats() -> dict:
+    return pyduino.reconnect_stats()
+
+
+# How the CRC checked packets are going, see pyduino PACKETS
+def link_stats() -> dict:
+    return pyduino.PACKETS.stats()
+
+
+# What discover() found on a port (board id, firmware and devices), None if it hasn't been asked
+def port_info(port: str):
+    return pyduino.PORT_INFOS.get(port)
+
+
+# Asks every COM port which board it is at once, see pyduino.discover(). refresh asks ports that were cached too.
+def discover(refresh: bool = False) -> list:
+    return pyduino.discover(refresh)
+
+
+# What the firmware on the board said it supports when it was connected, see pyduino NEGOTIATION
+def capabilities():
+    return pyduino.CAPABILITIES
+
+
+# Name of the COM port being used
+def current_com() -> str:
+    return pyduino.com_port
+
+
+# Use to set the COM Port being used. Whatever was set up on the old port gets set up on the new one too, unless
+#   restore is off.
+def set_com(port: str, restore: bool = True):
+    snapshot = take_snapshot()
+    if pyduino.connect(port) and restore:
+        restore_state(snapshot)
+
+
+################
+# TRANSACTIONS #
+################
+
+# Sends a Transaction and commits it. Returns a Request right away whose result (or callback) is a CommitResult.
+def commit(transaction, callback=None):
+    commands = transaction.commands()
+    start_reader()
+    sent = time.perf_counter()
+    request = expect(FRAME_COMMIT, 1, lambda payloads: CommitResult(payloads[0], sent), callback)
+    send_frame_of(commands)
+    return request
+
+
+#########
+# STATE #
+#########
+
+# Saves the state of every device on the board to a file
+def save_state(path: str):
+    save_snapshot(path)
+
+
+# Puts a board back into a saved state (a snapshot or a file saved with save_state()) in one write. force sends
+#   every register even if the host thinks the board already has it, which is what's needed after a reset.
+def restore_state(snapshot, force: bool = True):
+    if isinstance(snapshot, str):
+        snapshot = load_snapshot(snapshot)
+    send_frame_of(restore_commands(snapshot, force))
 
 
 ###################################################
@@ -108,5 +539,6 @@ def set_com(port: str):
 if __name__ == '__main__':
 
     # Test command because this wasn't working
+    connect()
     send_ramp_setup('f', 360, 1, 0, 360, 1, 1, 0.0000005, 0.0000005)
 
@@ -0,0 +1,691 @@
+#########################################
+# Board Emulator                        #
+# Version: Beta 0.3                     #
+#                                       #
+# Stand-ins for the Arduino and what's  #
+# hooked up to it, for trying things    #
+# out without a board.                  #
+#########################################
+
+# HOW THIS WORKS
+#
+# An emulator takes the place of pyduino.serial_port: everything pyduino writes goes to its write() and gets
+# interpreted the way the Arduino would. For calibration it also plays the part of the voltmeter on the DAC outputs.
+#
+#   board = EmulatedDAC(gain=1.001, offset=0.002)
+#   pyduino.serial_port = board
+#   controller.calibrate_dac(DAC_A, lambda: board.measure(DAC_A), 2.024, 2.0, True)
+#
+# BufferedBoard models the wire and the Arduino's serial receive buffer instead: bytes arrive at the baud rate, wait in
+# a buffer of the same size as the board's while a command runs, and get dropped once it's full. It speaks flow
+# control like the firmware, so pyduino can be run against it with and without:
+#
+#   board = BufferedBoard(baudrate=1000000)
+#   pyduino.serial_port = board
+#   pyduino.enable_flow_control(board, board.rx_buffer)
+#   pyduino.start_reader()
+#
+# PacketParser is the firmware's packet parser line for line, and PacketBoard is a board that speaks packets over a
+# noisy line. fuzz_parser() and fuzz_packets() throw random damage at them and check nothing bad gets through:
+#
+#   python emulator.py
+#
+# PtyDevices makes a bunch of pseudo terminals that can be opened like real boards and counts what gets written to
+# them from a process of its own (POSIX only), for benchmarking many boards without the hardware.
+#
+# PtyBoard puts a PacketBoard behind a pty under a fixed name that can be unplugged and plugged back in, for trying
+# out reconnects (POSIX only):
+#
+#   board = PtyBoard('/tmp/board')
+#   pyduino.connect('/tmp/board')
+#   board.drop()
+#   board.open()
+
+###################################################
+
+###########
+# IMPORTS #
+###########
+
+import collections
+import multiprocessing
+import os
+import re
+import selectors
+import math
+import threading
+import time
+import tty
+import numpy
+import pyduino
+from pyduino import *
+
+
+###################################################
+
+#######
+# DAC #
+#######
+
+# The kinds of DAC data writes: "Dw<address><data>!", "Dg0,<channel>,<data>!" and "Dm<channel>,<data>,...!", and
+#   "Dn<channel>,<data>,...!" which waits for an LDAC edge ("Dl!"). Only the first DAC on the board is emulated.
+DAC_WRITE_PATTERN = re.compile(rb'D' + DAC_WRITE.encode() + rb'([ab2])(\d+)!')
+DAC_DATA_REGISTER_PATTERN = re.compile(rb'D' + DAC_REGISTER.encode() + rb'0,(\d+),(\d+)!')
+DAC_SIMULTANEOUS_PATTERN = re.compile(rb'D' + DAC_SIMULTANEOUS.encode() + rb'([\d,]+)!')
+DAC_STAGE_PATTERN = re.compile(rb'D(?:' + DAC_STAGE.encode() + rb'([\d,]+)|' + DAC_LDAC.encode() + rb')!')
+
+
+# An AD5732 whose outputs are off from ideal by a gain, an offset and a bow shaped INL (in LSBs at mid scale), read by
+#   a meter with some noise on it
+class EmulatedDAC:
+
+    def __init__(self, reference_voltage: float = 2.024, gain: float = 2.0, bipolar: bool = True,
+                 gain_error: float = 1.0, offset: float = 0.0, inl: float = 0.0, noise: float = 0.0, seed: int = 0):
+        self.reference_voltage = reference_voltage
+        self.gain = gain
+        self.bipolar = bipolar
+        self.gain_error = gain_error
+        self.offset = offset
+        self.inl = inl
+        self.noise = noise
+        self.random = numpy.random.default_rng(seed)
+        self.codes = {DAC_A: 0, DAC_B: 0}
+        self.staged = []
+        self.buffer = bytearray()
+
+        # Enough of a serial port for pyduino
+        self.in_waiting = 0
+        self.baudrate = 9600
+
+    def write(self, data):
+        self.buffer += data
+        end = self.buffer.rfind(DONE.encode()) + 1
+        if not end:
+            return len(data)
+
+        for address, value in DAC_WRITE_PATTERN.findall(self.buffer, 0, end):
+            addresses = (DAC_A, DAC_B) if address.decode() == DAC_2 else (address.decode(),)
+            for output in addresses:
+                self.codes[output] = int(value) >> (DAC_MAX_BITS - DAC_BITS)
+        writes = DAC_DATA_REGISTER_PATTERN.findall(self.buffer, 0, end)
+        for fields in DAC_SIMULTANEOUS_PATTERN.findall(self.buffer, 0, end):
+            fields = fields.split(b',')
+            writes += zip(fields[0::2], fields[1::2])
+        for fields in DAC_STAGE_PATTERN.findall(self.buffer, 0, end):
+            if fields:
+                fields = fields.split(b',')
+                self.staged += zip(fields[0::2], fields[1::2])
+            else:
+                writes += self.staged
+                self.staged = []
+        for channel, value in writes:
+            for output, output_channel in DAC_CHANNELS.items():
+                if output_channel == int(channel):
+                    self.codes[output] = int(value) >> (DAC_MAX_BITS - DAC_BITS)
+
+        del self.buffer[:end]
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        return b''
+
+    def close(self):
+        pass
+
+    # Voltage on an output right now
+    def measure(self, address: chr) -> float:
+        code = self.codes[address]
+        bow = self.inl * (1 - ((2 * code / DAC_CODES) - 1) ** 2)
+        ideal = DAC.code_to_voltage(code + bow, self.reference_voltage, self.gain, self.bipolar)
+        return float(self.gain_error * ideal + self.offset + self.random.normal(0, self.noise) if self.noise else
+                     self.gain_error * ideal + self.offset)
+
+
+#########################
+# SERIAL RECEIVE BUFFER #
+#########################
+
+# Credit frames go out after this many bytes even if more are waiting, same as the firmware
+CREDIT_BATCH = 16
+
+
+# Everything runs on its own clock from the host's writes and reads, worked out up to "now" whenever either is
+#   called, so nothing needs a thread. Commands take command_time to run, or the time in slow_commands for the ones
+#   starting with those characters (the DAC setup has a delay(100) in it).
+class BufferedBoard:
+
+    def __init__(self, baudrate: int = 1000000, rx_buffer: int = 64, command_time: float = 0.0002,
+                 slow_commands: dict = None):
+        self.baudrate = baudrate
+        self.rx_buffer = rx_buffer
+        self.command_time = command_time
+        self.slow_commands = {b'Ds': 0.1} if slow_commands is None else slow_commands
+        self.timeout = READ_TIMEOUT
+        self.lock = threading.Lock()
+
+        # Bytes on the wire with the time each one arrives, and bytes in the receive buffer
+        self.wire = collections.deque()
+        self.wire_free = 0.0
+        self.buffer = collections.deque()
+
+        # When the command being run is done, and the one being received
+        self.busy_until = 0.0
+        self.command = bytearray()
+
+        # Frames going back to the host with the time each one has been sent by, and bytes that have been
+        self.output = collections.deque()
+        self.output_free = 0.0
+        self.ready = bytearray()
+
+        self.flow_control = False
+        self.bytes_read = 0
+        self.bytes_reported = 0
+
+        self.dropped = 0
+        self.commands = collections.Counter()
+
+    def write(self, data):
+        data = bytes(data)
+        with self.lock:
+            now = time.perf_counter()
+            self.advance(now)
+            start = max(now, self.wire_free)
+            byte_time = 10 / self.baudrate
+            for index in range(len(data)):
+                self.wire.append((start + (index + 1) * byte_time, data[index]))
+            self.wire_free = start + len(data) * byte_time
+        return len(data)
+
+    # Works out everything that happened on the board up to "now"
+    def advance(self, now: float):
+        while True:
+            arrival = self.wire[0][0] if self.wire else math.inf
+
+            # The firmware empties the receive buffer as soon as it's done with a command
+            if self.buffer and self.busy_until <= min(arrival, now):
+                self.receive(self.buffer.popleft(), self.busy_until)
+                continue
+            if arrival > now:
+                return
+
+            arrival, byte = self.wire.popleft()
+            if not self.buffer and self.busy_until <= arrival:
+                self.receive(byte, arrival)
+            elif len(self.buffer) < self.rx_buffer:
+                self.buffer.append(byte)
+            else:
+                self.dropped += 1
+
+    # The firmware taking one byte out of the receive buffer at time "when"
+    def receive(self, byte: int, when: float):
+        self.bytes_read = (self.bytes_read + 1) & 0xFFFF
+        self.command.append(byte)
+
+        if byte == ord(DONE):
+            command = bytes(self.command[:-1])
+            self.command.clear()
+            self.commands[command] += 1
+            duration = self.command_time
+            for prefix, slow_time in self.slow_commands.items():
+                if command.startswith(prefix):
+                    duration = slow_time
+            self.busy_until = when + duration
+
+            if command == BOARD_INDICATOR.encode() + BOARD_FLOW.encode() + b'1':
+                self.flow_control = True
+                self.bytes_read = 0
+                self.send_credit(when)
+            elif command == BOARD_INDICATOR.encode() + BOARD_FLOW.encode() + b'0':
+                self.flow_control = False
+            elif command == BOARD_INDICATOR.encode() + BOARD_CREDIT.encode():
+                self.send_credit(when)
+
+        if self.flow_control and ((self.bytes_read - self.bytes_reported) & 0xFFFF >= CREDIT_BATCH or
+                                  not self.buffer):
+            self.send_credit(when)
+
+    def send_credit(self, when: float):
+        payload = CREDIT_PAYLOAD.pack(self.bytes_read)
+        frame = bytes([FRAME_START, FRAME_CREDIT, len(payload)]) + payload
+        frame += bytes([sum(frame[1:]) & 0xFF])
+        self.output_free = max(when, self.output_free) + len(frame) * 10 / self.baudrate
+        self.output.append((self.output_free, frame))
+        self.bytes_reported = self.bytes_read
+
+    # Moves whatever has been sent by "now" to where the host can read it
+    def release(self, now: float):
+        self.advance(now)
+        while self.output and self.output[0][0] <= now:
+            self.ready += self.output.popleft()[1]
+
+    @property
+    def in_waiting(self) -> int:
+        with self.lock:
+            self.release(time.perf_counter())
+            return len(self.ready)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = time.perf_counter() + (self.timeout or 0)
+        while True:
+            with self.lock:
+                now = time.perf_counter()
+                self.release(now)
+                if self.ready or now >= deadline:
+                    data = bytes(self.ready[:size])
+                    del self.ready[:size]
+                    return data
+            time.sleep(0.0005)
+
+    def close(self):
+        pass
+
+    # Whether everything sent so far has been run
+    def finished(self) -> bool:
+        with self.lock:
+            now = time.perf_counter()
+            self.advance(now)
+            return not self.wire and not self.buffer and self.busy_until <= now
+
+
+###########
+# PACKETS #
+###########
+
+# What a PacketBoard says it supports
+PACKET_BOARD_FEATURES = ('frames', 'packets')
+
+# The firmware's packet parser (packetReceive() and the rest), kept the same so fuzzing this fuzzes that. feed() takes
+#   one byte and returns the (sequence, payload) of every packet it completed. escape is set when a plain "Bc!" came in
+#   between packets.
+class PacketParser:
+
+    ESCAPE = (BOARD_INDICATOR + BOARD_CAPABILITIES + DONE).encode()
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.escape_matched = 0
+        self.escape = False
+        self.crc_errors = 0
+
+    def feed(self, byte: int) -> list:
+        if not self.buffer:
+            if byte != PACKET_START:
+                self.match_escape(byte)
+                return []
+            self.escape_matched = 0
+
+        self.buffer.append(byte)
+        return self.check()
+
+    def match_escape(self, byte: int):
+        if byte == self.ESCAPE[self.escape_matched]:
+            self.escape_matched += 1
+        else:
+            self.escape_matched = int(byte == self.ESCAPE[0])
+
+        if self.escape_matched == len(self.ESCAPE):
+            self.escape_matched = 0
+            self.escape = True
+
+    def check(self) -> list:
+        buffer = self.buffer
+        packets = []
+        while buffer:
+            if len(buffer) >= PACKET_HEADER_SIZE and buffer[2] > PACKET_MAX_PAYLOAD:
+                self.skip(1)
+                continue
+            if len(buffer) < PACKET_HEADER_SIZE or len(buffer) < PACKET_HEADER_SIZE + buffer[2] + 2:
+                break
+
+            end = PACKET_HEADER_SIZE + buffer[2]
+            if crc16(buffer[1:end]) == buffer[end] | buffer[end + 1] << 8:
+                packets.append((buffer[1], bytes(buffer[PACKET_HEADER_SIZE:end])))
+                del buffer[:end + 2]
+                self.skip(0)
+                continue
+
+            self.crc_errors += 1
+            self.skip(1)
+        return packets
+
+    # Drops the bytes before the first start marker at or after "start"
+    def skip(self, start: int):
+        next_start = self.buffer.find(PACKET_START, start)
+        del self.buffer[:next_start if next_start >= 0 else len(self.buffer)]
+
+
+# A board that speaks packets like the firmware, on a line that damages each byte going either way with probability
+#   error_rate (a flipped bit, a lost byte, a doubled byte or a stray one). Everything the firmware would run ends up in
+#   received, in order. It answers the capabilities query with PACKET_BOARD_FEATURES, so connect() turns packets on.
+class PacketBoard:
+
+    def __init__(self, error_rate: float = 0.0, seed: int = 0):
+        self.error_rate = error_rate
+        self.random = numpy.random.default_rng(seed)
+        self.timeout = READ_TIMEOUT
+        self.baudrate = DEFAULT_BAUD
+        self.condition = threading.Condition()
+
+        self.packet_mode = False
+        self.parser = PacketParser()
+        self.expected = 0
+        self.nak_sent = False
+        self.crc_errors = 0
+        self.command = bytearray()
+        self.received = bytearray()
+        self.output = bytearray()
+
+    # The line between the host and the board
+    def damage(self, data: bytes) -> bytes:
+        if not self.error_rate:
+            return data
+        hits = numpy.flatnonzero(self.random.random(len(data)) < self.error_rate)
+        if not len(hits):
+            return data
+
+        damaged = bytearray()
+        start = 0
+        for index in hits:
+            damaged += data[start:index]
+            kind = self.random.integers(4)
+            if kind == 0:
+                damaged.append(data[index] ^ (1 << int(self.random.integers(8))))
+            elif kind == 2:
+                damaged += bytes([data[index]]) * 2
+            elif kind == 3:
+                damaged += bytes([data[index], int(self.random.integers(256))])
+            start = index + 1
+        return bytes(damaged + data[start:])
+
+    def write(self, data):
+        with self.condition:
+            for byte in self.damage(bytes(data)):
+                if self.packet_mode:
+                    self.receive_packet_byte(byte)
+                else:
+                    self.receive_byte(byte)
+            self.condition.notify_all()
+        return len(data)
+
+    def receive_packet_byte(self, byte: int):
+        packets = self.parser.feed(byte)
+        if self.parser.escape:
+            self.parser.escape = False
+            self.packet_mode = False
+            self.command.clear()
+            self.send_capabilities()
+            return
+
+        # A bad packet lets the next nak go out, same as the firmware
+        if self.parser.crc_errors != self.crc_errors:
+            self.crc_errors = self.parser.crc_errors
+            self.nak_sent = False
+        for sequence, payload in packets:
+            self.deliver(sequence, payload)
+
+    def deliver(self, sequence: int, payload: bytes):
+        if sequence == self.expected:
+            self.expected = (self.expected + 1) & 0xFF
+            self.nak_sent = False
+            self.send_frame(FRAME_ACK, bytes([sequence]))
+            for byte in payload:
+                self.receive_byte(byte)
+        # Same comparison as the firmware's packetDeliver(), already run if it's up to 127 behind
+        elif (self.expected - sequence) & 0xFF < 128:
+            self.send_frame(FRAME_ACK, bytes([(self.expected - 1) & 0xFF]))
+        elif not self.nak_sent:
+            self.send_frame(FRAME_NAK, NAK_PAYLOAD.pack(self.expected, self.parser.crc_errors & 0xFFFF))
+            self.nak_sent = True
+
+    # A byte of a command, outside of packets or out of a good one
+    def receive_byte(self, byte: int):
+        self.command.append(byte)
+        if byte != ord(DONE):
+            return
+
+        command = bytes(self.command)
+        self.command.clear()
+        if command == BOARD_DEVICE.encode('packets', 1).encode():
+            self.packet_mode = True
+            self.parser = PacketParser()
+            self.expected = 0
+            self.nak_sent = False
+            self.crc_errors = 0
+            self.send_frame(FRAME_ACK, bytes([0xFF]))
+        elif command == BOARD_DEVICE.encode('capabilities').encode():
+            self.send_capabilities()
+        elif self.packet_mode:
+            self.received += command
+
+    def send_capabilities(self):
+        self.send_frame(FRAME_CAPABILITIES, CAPABILITIES_PAYLOAD.pack(
+            PROTOCOL_VERSION, DEFAULT_BAUD, 64, sum(BOARD_DEVICES.values()),
+            sum(FEATURES[feature] for feature in PACKET_BOARD_FEATURES)))
+
+    def send_frame(self, frame_type: int, payload: bytes):
+        body = bytes([frame_type, len(payload)]) + payload
+        if self.packet_mode:
+            crc = crc16(body)
+            frame = bytes([FRAME_START]) + body + bytes([crc & 0xFF, crc >> 8])
+        else:
+            frame = bytes([FRAME_START]) + body + bytes([sum(body) & 0xFF])
+        self.output += self.damage(frame)
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.output)
+
+    def read(self, size: int = 1) -> bytes:
+        with self.condition:
+            self.condition.wait_for(lambda: self.output, self.timeout)
+            data = bytes(self.output[:size])
+            del self.output[:size]
+            return data
+
+    def close(self):
+        pass
+
+
+# Feeds the parser good packets with random junk and damage in between, and checks that every packet that came through
+#   undamaged was delivered in order, even when something damaged ahead of it claimed its bytes, and nothing else was.
+#   Returns counts of what happened.
+def fuzz_parser(packets: int = 20000, error_rate: float = 0.01, seed: int = 0) -> dict:
+    random = numpy.random.default_rng(seed)
+    parser = PacketParser()
+    line = PacketBoard(error_rate, seed + 1)
+    sent = {}
+    intact = []
+    delivered = []
+
+    stream = bytearray()
+    for sequence in range(packets):
+        # Starts with the whole count so no two are the same
+        payload = sequence.to_bytes(4, 'little') + random.integers(
+            256, size=int(random.integers(PACKET_MAX_PAYLOAD - 3)), dtype=numpy.uint8).tobytes()
+        packet = encode_packet(sequence & 0xFF, payload)
+        sent[(sequence & 0xFF, payload)] = sequence
+        damaged = line.damage(packet)
+        if damaged == packet:
+            intact.append(sequence)
+
+        # Junk in between, heavy on start markers and lengths that look real
+        junk = random.integers(256, size=int(random.integers(8)), dtype=numpy.uint8)
+        junk[random.random(len(junk)) < 0.3] = PACKET_START
+        stream += junk.tobytes() + damaged
+
+    # Enough at the end to finish anything still waiting on bytes
+    stream += bytes(2 * (PACKET_HEADER_SIZE + PACKET_MAX_PAYLOAD + 2))
+    for byte in stream:
+        for packet in parser.feed(byte):
+            delivered.append(sent.get(packet))
+
+    found = [sequence for sequence in delivered if sequence is not None]
+    return {'packets': packets, 'damaged': packets - len(intact), 'delivered': len(found),
+            'missed': len(set(intact) - set(found)), 'false': delivered.count(None),
+            'in_order': found == sorted(found), 'crc_errors': parser.crc_errors}
+
+
+# Runs pyduino's packets against a PacketBoard on a noisy line and checks the board ran exactly the commands that were
+#   sent, in order. Returns the packet stats for the run along with the time it took.
+def fuzz_packets(commands: int = 5000, error_rate: float = 0.001, seed: int = 0, batch: int = 10) -> dict:
+    random = numpy.random.default_rng(seed)
+    board = PacketBoard(error_rate, seed + 1)
+    old_port = pyduino.serial_port
+    old_capabilities = pyduino.CAPABILITIES
+
+    restart_reader = stop_reader()
+    pyduino.serial_port = board
+    pyduino.CAPABILITIES = HOST_CAPABILITIES
+    FLOW.disable()
+    start_reader()
+    try:
+        if not PACKETS.enable():
+            raise RuntimeError("The emulated board didn't turn packets on")
+
+        before = PACKETS.stats()
+        sent = bytearray()
+        began = time.perf_counter()
+        for start in range(0, commands, batch):
+            frame = b''.join(DAC_DEVICE.encode('write', DAC_A, int(value)).encode()
+                             for value in random.integers(DAC_CODES, size=min(batch, commands - start)))
+            sent += frame
+            send_frame(frame)
+        PACKETS.flush(10.0)
+        elapsed = time.perf_counter() - began
+
+        stats = PACKETS.stats()
+        for key in ('packets', 'retransmits', 'naks', 'timeouts'):
+            stats[key] -= before[key]
+        stats.update({'commands': commands, 'time': elapsed, 'commands_per_second': commands / elapsed,
+                      'intact': board.received == sent})
+        return stats
+    finally:
+        PACKETS.disable()
+        stop_reader()
+        pyduino.serial_port = old_port
+        pyduino.CAPABILITIES = old_capabilities
+        if restart_reader:
+            start_reader()
+
+
+########
+# PTYS #
+########
+
+# Runs in its own process: opens the ptys, sends back the names to open them by, then reads everything written to
+#   them until told to stop, and sends back how many bytes and commands each one got
+def drain_ptys(count: int, connection):
+    masters = []
+    names = []
+    for index in range(count):
+        master, slave = os.openpty()
+        masters.append(master)
+        names.append(os.ttyname(slave))
+        os.set_blocking(master, False)
+
+    selector = selectors.DefaultSelector()
+    for index, master in enumerate(masters):
+        selector.register(master, selectors.EVENT_READ, index)
+    connection.send(names)
+
+    received = [0] * count
+    commands = [0] * count
+    done = DONE.encode()
+    stopping = False
+    while True:
+        events = selector.select(0 if stopping else 0.05)
+        for key, mask in events:
+            try:
+                data = os.read(key.fd, 65536)
+            except OSError:
+                selector.unregister(key.fd)
+                continue
+            received[key.data] += len(data)
+            commands[key.data] += data.count(done)
+
+        # Once told to stop, keep going until everything still in the ptys has been read
+        if stopping and not events:
+            break
+        if not stopping and connection.poll():
+            connection.recv()
+            stopping = True
+
+    connection.send((received, commands))
+
+
+class PtyDevices:
+
+    def __init__(self, count: int):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=drain_ptys, args=(count, child_connection), daemon=True)
+        self.process.start()
+        self.names = self.connection.recv()
+
+    # Stops reading and returns (bytes, commands) received by each pty
+    def stop(self):
+        self.connection.send(None)
+        counts = self.connection.recv()
+        self.process.join()
+        return counts
+
+
+# A board behind a pty, reached through a link at name. Every open() plugs in a new board (like opening a port resets an
+#   Arduino) and drop() unplugs it, so the pty is gone until the next open(). Everything the boards ran is in received.
+class PtyBoard:
+
+    def __init__(self, name: str, make_board=PacketBoard):
+        self.name = name
+        self.make_board = make_board
+        self.boards = []
+        self.thread = None
+        self.running = False
+        self.open()
+
+    def open(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.symlink(os.ttyname(self.slave), self.name)
+        self.board = self.make_board()
+        self.board.timeout = 0
+        self.boards.append(self.board)
+        self.running = True
+        self.thread = threading.Thread(target=self.pump, name='pty board', daemon=True)
+        self.thread.start()
+
+    # Moves bytes between the pty and the board
+    def pump(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.master, selectors.EVENT_READ)
+        while self.running:
+            if selector.select(0.01):
+                try:
+                    self.board.write(os.read(self.master, 65536))
+                except OSError:
+                    pass
+            data = self.board.read(self.board.in_waiting)
+            if data:
+                os.write(self.master, data)
+        selector.close()
+
+    def drop(self):
+        self.running = False
+        self.thread.join()
+        os.remove(self.name)
+        os.close(self.master)
+        os.close(self.slave)
+
+    @property
+    def received(self) -> bytes:
+        return b''.join(bytes(board.received) for board in self.boards)
+
+
+###################################################
+
+#############
+# EXECUTION #
+#############
+
+if __name__ == '__main__':
+    print('parser', fuzz_parser())
+    for error_rate in (0.0, 0.0001, 0.001, 0.01):
+        print('packets at error rate', error_rate, fuzz_packets(error_rate=error_rate))
@@ -0,0 +1,248 @@
+#########################################
+# Board Farm                            #
+# Version: Beta 0.3                     #
+#                                       #
+# Spreads a lot of boards over worker   #
+# processes so one GIL isn't the limit  #
+# on how many can be kept busy.         #
+#########################################
+
+# HOW THIS WORKS
+#
+# Every worker process owns some of the serial links. The parent encodes frames as usual and copies them into a block
+# of shared memory that belongs to the worker, in fixed-size slots, then just tells the worker which slots to write to
+# which board. The worker hands the slots back once they're written, along with how it went.
+#
+# farm.port(board) gives an object that can stand in for pyduino.serial_port, so the controller works on a farmed
+# board exactly like it does on a local one:
+#
+#   farm = Farm(['/dev/ttyACM0', '/dev/ttyACM1', ...])
+#   pyduino.serial_port = farm.port('/dev/ttyACM1')
+#   controller.send_voltage(DAC_A, 1.0, 2.024, 2.0, True)
+#
+# Or send to many boards at once with farm.send_many({board: frame}), one message per worker.
+#
+# FUNCTIONS
+# Farm()
+#   (ports: list, workers: int = None, baudrate: int = 9600) -> Farm
+#   Starts the workers (one per core by default, never more than there are boards) and opens every port
+#
+# Farm.send() / Farm.send_many() / Farm.broadcast()
+#   Queue frames for one board, for many boards, or the same frame for every board
+#
+# Farm.flush() -> void
+#   Waits until everything sent so far has been written
+#
+# Farm.metrics() -> dict
+#   {board: {'frames', 'bytes', 'write_time', 'errors'}} from every worker
+#
+# Farm.close() -> void
+
+###################################################
+
+###########
+# IMPORTS #
+###########
+
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+import serial
+
+
+###################################################
+
+#############
+# CONSTANTS #
+#############
+
+# Shared memory for each worker, split into slots that each hold (up to) one frame
+FARM_SLOTS = 64
+FARM_SLOT_SIZE = 4096
+
+# Messages between the parent and the workers
+FARM_WRITE = 'w'
+FARM_FREE = 'f'
+FARM_METRICS = 'm'
+FARM_STOP = 's'
+
+
+###################################################
+
+##########
+# WORKER #
+##########
+
+# Runs in the worker process. Opens its ports, then writes whatever slots it's told to until it's stopped.
+def worker_main(ports: list, shared_name: str, connection, baudrate: int):
+    shared = shared_memory.SharedMemory(name=shared_name)
+    links = [serial.serial_for_url(port, baudrate=baudrate) for port in ports]
+    metrics = [{'frames': 0, 'bytes': 0, 'write_time': 0.0, 'errors': 0} for port in ports]
+
+    try:
+        while True:
+            message = connection.recv()
+
+            if message[0] == FARM_WRITE:
+                for board, slot, length in message[1]:
+                    start = slot * FARM_SLOT_SIZE
+                    board_metrics = metrics[board]
+                    began = time.perf_counter()
+                    try:
+                        links[board].write(shared.buf[start:start + length])
+                    except (serial.SerialException, OSError):
+                        board_metrics['errors'] += 1
+                    board_metrics['write_time'] += time.perf_counter() - began
+                    board_metrics['frames'] += 1
+                    board_metrics['bytes'] += length
+                connection.send((FARM_FREE, [slot for board, slot, length in message[1]]))
+
+            elif message[0] == FARM_METRICS:
+                connection.send((FARM_METRICS, dict(zip(ports, metrics))))
+
+            elif message[0] == FARM_STOP:
+                break
+    finally:
+        for link in links:
+            link.close()
+        shared.close()
+
+
+###################################################
+
+########
+# FARM #
+########
+
+class Farm:
+
+    def __init__(self, ports: list, workers: int = None, baudrate: int = 9600):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(min(workers, len(ports)), 1)
+
+        self.ports = list(ports)
+        self.owner = {}
+        self.shared = []
+        self.connections = []
+        self.processes = []
+        self.free = []
+
+        # Boards are dealt out round robin, and each is known to its worker by its index in that worker's list
+        assigned = [self.ports[worker::workers] for worker in range(workers)]
+        for worker, worker_ports in enumerate(assigned):
+            for index, port in enumerate(worker_ports):
+                self.owner[port] = (worker, index)
+
+            shared = shared_memory.SharedMemory(create=True, size=FARM_SLOTS * FARM_SLOT_SIZE)
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=worker_main, name=str('farm worker ' + str(worker)),
+                                              args=(worker_ports, shared.name, child_connection, baudrate),
+                                              daemon=True)
+            process.start()
+
+            self.shared.append(shared)
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+            self.free.append(list(range(FARM_SLOTS)))
+
+    # Something that can be used as pyduino.serial_port for one board
+    def port(self, board: str):
+        return FarmPort(self, board)
+
+    def send(self, board: str, frame):
+        self.send_many({board: frame})
+
+    # Sends a frame to each board in {board: frame}, split up so every worker gets one message
+    def send_many(self, frames: dict):
+        writes = [[] for connection in self.connections]
+
+        for board, frame in frames.items():
+            worker, index = self.owner[board]
+            frame = memoryview(frame).cast('B')
+            for start in range(0, len(frame), FARM_SLOT_SIZE):
+                piece = frame[start:start + FARM_SLOT_SIZE]
+                slot = self.take_slot(worker, writes)
+                offset = slot * FARM_SLOT_SIZE
+                self.shared[worker].buf[offset:offset + len(piece)] = piece
+                writes[worker].append((index, slot, len(piece)))
+
+        for worker, worker_writes in enumerate(writes):
+            if worker_writes:
+                self.connections[worker].send((FARM_WRITE, worker_writes))
+
+    def broadcast(self, frame):
+        self.send_many({board: frame for board in self.ports})
+
+    # A free slot of a worker's shared memory. If there are none, sends what's been put together so far and waits for
+    #   the worker to hand some back.
+    def take_slot(self, worker: int, writes: list) -> int:
+        free = self.free[worker]
+        if not free:
+            self.collect(worker, False)
+        if not free:
+            if writes[worker]:
+                self.connections[worker].send((FARM_WRITE, writes[worker]))
+                writes[worker] = []
+            self.collect(worker, True)
+        return free.pop()
+
+    # Takes back the slots a worker has finished with, waiting for at least one message if block is set
+    def collect(self, worker: int, block: bool):
+        connection = self.connections[worker]
+        while block or connection.poll():
+            message = connection.recv()
+            if message[0] == FARM_FREE:
+                self.free[worker].extend(message[1])
+                block = False
+            else:
+                return message
+        return None
+
+    # Waits until every worker has written everything it was sent
+    def flush(self):
+        for worker in range(len(self.connections)):
+            while len(self.free[worker]) < FARM_SLOTS:
+                self.collect(worker, True)
+
+    def metrics(self) -> dict:
+        self.flush()
+        metrics = {}
+        for worker, connection in enumerate(self.connections):
+            connection.send((FARM_METRICS,))
+            message = None
+            while message is None:
+                message = self.collect(worker, True)
+            metrics.update(message[1])
+        return metrics
+
+    def close(self):
+        self.flush()
+        for connection in self.connections:
+            connection.send((FARM_STOP,))
+        for process in self.processes:
+            process.join()
+        for shared in self.shared:
+            shared.close()
+            shared.unlink()
+        self.processes = []
+
+
+# Stands in for a serial port on one board of a farm. Nothing comes back from farmed boards.
+class FarmPort:
+
+    def __init__(self, farm: Farm, board: str):
+        self.farm = farm
+        self.board = board
+        self.in_waiting = 0
+
+    def write(self, data):
+        self.farm.send(self.board, data)
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        return b''
+
+    def close(self):
+        pass
@@ -14,6 +14,10 @@
 # IMPORTING LIBRARIES #
 #######################
 
+import time
+START_TIME = time.perf_counter()
+
+import os
 import sys
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
@@ -22,6 +26,99 @@ from PyQt5.QtCore import *
 from pyduino import *
 import controller
 
+# Set PYDUINO_STARTUP_TIMING to have startup timing printed, the built executable has no console to print it to
+STARTUP_TIMING = bool(os.environ.get('PYDUINO_STARTUP_TIMING'))
+
+
+###################################################
+
+###############
+# HARDWARE IO #
+###############
+
+# How many times a second dragged sliders are allowed to push updates to the hardware
+HARDWARE_UPDATE_RATE = 30
+
+
+# Lives on its own thread and makes all of the calls that touch the serial port, so a slow write never holds up
+#   painting. Only one call is run at a time and done is emitted after each one.
+class HardwareWorker(QObject):
+
+    done = pyqtSignal()
+    failed = pyqtSignal(str)
+    connected = pyqtSignal(bool)
+
+    # Holds BOARD_LOCK so a reconnect can't swap the port out from under a call
+    @pyqtSlot(object, object)
+    def run(self, function, args):
+        try:
+            with BOARD_LOCK:
+                function(*args)
+        except Exception as error:
+            self.failed.emit(str(error))
+        self.done.emit()
+
+    # Opens the serial port (the first one found if port is None). Run through the queue like any other call.
+    def connect(self, port):
+        self.connected.emit(controller.connect(port))
+
+
+# Bridge from the GUI thread to the HardwareWorker. Calls are handed over one at a time in the order they came in.
+#   Keyed calls are rate limited to the update rate and a newer call with the same key replaces an older one that
+#   hasn't gone out yet, so a dragged slider only ever sends its latest position and the worker never falls behind.
+class HardwareThrottle(QObject):
+
+    request = pyqtSignal(object, object)
+
+    def __init__(self, worker: HardwareWorker, rate: float):
+        super().__init__()
+
+        self.pending = {}
+        self.busy = False
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+        self.set_rate(rate)
+
+        self.request.connect(worker.run)
+        worker.done.connect(self.worker_done)
+
+    # Changes the rate (Hz) that keyed calls are let through at
+    def set_rate(self, rate: float):
+        self.timer.setInterval(int(1000 / rate))
+
+    # Queues a call. Unkeyed calls (key = None) always go out, in order, as soon as the worker is free.
+    def submit(self, key, function, *args):
+        if key is None:
+            key = object()
+            self.pending[key] = (function, args, False)
+        else:
+            # Moved to the back so it can't jump ahead of calls queued after the value it replaces
+            self.pending.pop(key, None)
+            self.pending[key] = (function, args, True)
+        self.flush()
+
+    # Hands the oldest call to the worker if it's free and the rate limit allows it
+    def flush(self):
+        if self.busy or not self.pending:
+            return
+
+        key = next(iter(self.pending))
+        function, args, limited = self.pending[key]
+        if limited and self.timer.isActive():
+            return
+
+        del self.pending[key]
+        self.busy = True
+        if limited:
+            self.timer.start()
+        self.request.emit(function, args)
+
+    def worker_done(self):
+        self.busy = False
+        self.flush()
+
 
 ###################################################
 
@@ -35,6 +132,23 @@ class Application(QWidget):
     def __init__(self):
         super().__init__()
 
+        self.startup_times = []
+        self.startup_mark('Qt started')
+
+        ###############
+        # HARDWARE IO #
+        ###############
+
+        # All serial traffic goes through the worker thread
+        self.update_rate = HARDWARE_UPDATE_RATE
+        self.hardware_worker = HardwareWorker()
+        self.hardware_thread = QThread()
+        self.hardware_worker.moveToThread(self.hardware_thread)
+        self.hardware_worker.failed.connect(self.hardware_failed)
+        self.hardware_worker.connected.connect(self.hardware_connected)
+        self.hardware_throttle = HardwareThrottle(self.hardware_worker, self.update_rate)
+        self.hardware_thread.start()
+
         ############
         # DAC SIDE #
         ############
@@ -80,17 +194,9 @@ class Application(QWidget):
         self.gain_select.addItems(self.gain_modes)
         self.gain_select.activated[str].connect(self.update_ranges)
 
-        # COM port select
+        # COM port select (filled in once the hardware is connected)
         self.com_select = QComboBox()
-        self.com_ports = list(controller.COM_PORTS_LIST)
-        self.com_select.addItems(self.com_ports)
-
-        initial_select = 0
-        for i in range(0, len(self.com_ports)):
-            if controller.com_port == self.com_ports[i]:
-                initial_select = i
-
-        self.com_select.setCurrentIndex(initial_select)
+        self.com_ports = []
         self.com_select.activated[str].connect(self.change_com)
 
         # Voltage sliders
@@ -137,9 +243,118 @@ class Application(QWidget):
         self.is_bipolar = True
         self.is_tied = False
 
-        ############
-        # DDS SIDE #
-        ############
+        #############
+        # EXECUTION #
+        #############
+
+        # Window dimensions
+        # self.WINDOW_SIZE = (900, 300)
+        # self.setFixedSize(self.WINDOW_SIZE[0], self.WINDOW_SIZE[1])
+        self.setWindowTitle('Device Controller')
+
+        self.main_window()
+
+        # Everything slow happens after the first paint. The port gets opened on the worker thread and the DDS
+        #   panel gets built while that's going on.
+        self.hardware(self.hardware_worker.connect, None)
+        QTimer.singleShot(0, self.build_dds_panel)
+
+    # Records how long startup took to reach a step, printed once the hardware is connected (see STARTUP_TIMING)
+    def startup_mark(self, step: str):
+        self.startup_times.append((step, time.perf_counter() - START_TIME))
+
+    def startup_report(self):
+        if not STARTUP_TIMING:
+            return
+        print('Startup timing:')
+        for step, seconds in self.startup_times:
+            print(str('  ' + step + ': ' + "%.1f" % (seconds * 1000) + ' ms'))
+
+    # Runs once the worker has tried to open the port
+    def hardware_connected(self, connected: bool):
+        self.startup_mark('Hardware connected')
+
+        if not connected:
+            box = QMessageBox()
+            box.setIcon(QMessageBox.Warning)
+            box.setText('No COM Ports Available')
+            box.setInformativeText('Plug in your device and try again.')
+            box.setStandardButtons(QMessageBox.Ok)
+            box.exec_()
+
+            self.close()
+            return
+
+        # Ports are listed boards first, with what they said they are
+        self.com_ports = list(controller.com_ports())
+        for port in self.com_ports:
+            info = controller.port_info(port)
+            self.com_select.addItem(str(info) if info is not None else port, port)
+        if controller.current_com() in self.com_ports:
+            self.com_select.setCurrentIndex(self.com_ports.index(controller.current_com()))
+
+        self.hardware(controller.send_initialization, self.is_bipolar, self.gain)
+        self.hardware(controller.send_voltage, controller.DAC_2, 0, self.reference_voltage, self.gain, self.is_bipolar)
+
+        self.startup_report()
+
+    # Main window execution and layout
+    def main_window(self):
+        # Layout
+        layout = QGridLayout()
+        self.setLayout(layout)
+
+        # Creates the DAC controller frame part of the GUI
+        dac_frame = QFrame()
+        dac_layout = QGridLayout()
+        dac_frame.setLayout(dac_layout)
+
+        # dac_frame.setFixedSize(300, 275)
+
+        dac_layout.addWidget(self.com_select, 0, 0, 1, 3)
+        dac_layout.addWidget(self.status_text, 0, 3, 1, 1)
+
+        dac_layout.addWidget(self.dac_title, 1, 0, 1, 3)
+
+        dac_layout.addWidget(self.bipolar_checkbox, 2, 0, 1, 2)
+        dac_layout.addWidget(self.connect_sliders_checkbox, 2, 3, 1, 2)
+
+        dac_layout.addWidget(self.reference_label, 3, 0, 1, 1)
+        dac_layout.addWidget(self.reference_textbox, 3, 1, 1, 1)
+        dac_layout.addWidget(self.gain_label, 3, 2, 1, 1)
+        dac_layout.addWidget(self.gain_select, 3, 3, 1, 1)
+
+        dac_layout.addWidget(self.setup_button, 4, 0, 1, 4)
+
+        dac_layout.addWidget(self.voltage_label_a, 5, 0, 1, 3)
+
+        dac_layout.addWidget(self.voltage_textbox_a, 6, 3, 1, 1)
+
+        dac_layout.addWidget(self.voltage_slider_a, 7, 0, 1, 4)
+
+        dac_layout.addWidget(self.voltage_label_b, 8, 0, 1, 3)
+
+        dac_layout.addWidget(self.voltage_textbox_b, 9, 3, 1, 1)
+
+        dac_layout.addWidget(self.voltage_slider_b, 10, 0, 1, 4)
+
+        dac_layout.addWidget(self.readback_label, 11, 0, 1, 4)
+
+        dac_layout.addWidget(self.readback_a, 12, 0, 1, 2)
+        dac_layout.addWidget(self.readback_b, 12, 3, 1, 2)
+
+        # Adds the frames to the main window. The DDS side gets filled in by build_dds_panel() once this is up.
+        self.dds_frame = QFrame()
+        self.dds_frame.setMinimumWidth(dac_frame.sizeHint().width())
+        layout.addWidget(self.dds_frame, 0, 0, 1, 1)
+        layout.addWidget(dac_frame, 0, 1, 1, 1)
+
+        self.show()
+        self.startup_mark('Window shown')
+
+    # Builds the DDS single tone and DRG panels. This is most of the widgets in the window, so it's left until after
+    #   the window is showing.
+    def build_dds_panel(self):
 
         # Label for the DDS controller
         self.dds_title = QLabel()
@@ -165,6 +380,10 @@ class Application(QWidget):
         self.drg_select_checkbox.stateChanged.connect(self.drg_toggle)
         self.drg_enabled = False
 
+        # Sends single tone changes to the DDS while the sliders are being dragged
+        self.dds_live_checkbox = QCheckBox('Live Update')
+        self.dds_live_checkbox.setToolTip('Update the single tone output while dragging the sliders')
+
         # Single Tone Sliders
         self.dds_max_frequency = 1 << 30   # kind of arbitrary here so it means the slider wont be as precise; program
         self.dds_frequency_iterator = 0.01     # is way too slow if I give the proper slider precision (textbox is fine)
@@ -174,6 +393,7 @@ class Application(QWidget):
         self.dds_frequency_label.setText('Frequency (Hz)')
         self.dds_frequency_slider = QSlider(Qt.Horizontal)
         self.dds_frequency_slider.setRange(min(self.dds_frequency_range), max(self.dds_frequency_range))
+        self.dds_frequency_slider.sliderMoved[int].connect(self.update_frequency_slider)
         self.dds_frequency_slider.sliderReleased.connect(self.update_frequency_slider)
         self.dds_desire_freq_label = QLabel()
         self.dds_desire_freq_label.setText('Desired:')
@@ -195,6 +415,7 @@ class Application(QWidget):
         self.dds_phase_label.setText('Phase (Degrees)')
         self.dds_phase_slider = QSlider(Qt.Horizontal)
         self.dds_phase_slider.setRange(min(self.dds_phase_range), max(self.dds_phase_range))
+        self.dds_phase_slider.sliderMoved[int].connect(self.update_phase_slider)
         self.dds_phase_slider.sliderReleased.connect(self.update_phase_slider)
         self.dds_desire_phase_label = QLabel()
         self.dds_desire_phase_label.setText('Desired:')
@@ -210,6 +431,7 @@ class Application(QWidget):
         self.dds_amplitude_label.setText('Amplitude')
         self.dds_amplitude_slider = QSlider(Qt.Horizontal)
         self.dds_amplitude_slider.setRange(min(self.dds_amplitude_range), max(self.dds_amplitude_range))
+        self.dds_amplitude_slider.sliderMoved[int].connect(self.update_amplitude_slider)
         self.dds_amplitude_slider.sliderReleased.connect(self.update_amplitude_slider)
         self.dds_desire_amp_label = QLabel()
         self.dds_desire_amp_label.setText('Desired:')
@@ -306,6 +528,28 @@ class Application(QWidget):
         self.dds_drg_rate_p_slider.setValue(min(self.dds_drg_rate_range))
         self.dds_drg_rate_p_slider.sliderReleased.connect(self.update_rate_p_slider)
 
+        # Automatic DRG planning, picks the steps and rates from how long the sweep should take
+        self.drg_plan = None
+        self.dds_drg_auto_checkbox = QCheckBox('Auto Plan')
+        self.dds_drg_auto_checkbox.setToolTip('Pick the step sizes and rates from a desired duration and resolution')
+        self.dds_drg_auto_checkbox.stateChanged.connect(self.drg_auto_toggle)
+
+        self.dds_drg_duration_label = QLabel()
+        self.dds_drg_duration_label.setText('Duration (ms)')
+        self.dds_drg_duration_textbox = QLineEdit()
+        self.dds_drg_duration_textbox.setText("%.5f" % 1.0)
+        self.dds_drg_duration_textbox.returnPressed.connect(self.plan_drg)
+
+        self.dds_drg_resolution_label = QLabel()
+        self.dds_drg_resolution_label.setText('Max Step')
+        self.dds_drg_resolution_textbox = QLineEdit()
+        self.dds_drg_resolution_textbox.setToolTip('Largest step allowed, in the units of the ramped parameter')
+        self.dds_drg_resolution_textbox.setText("%.5f" % 1.0)
+        self.dds_drg_resolution_textbox.returnPressed.connect(self.plan_drg)
+
+        self.dds_drg_plan_label = QLabel()
+        self.dds_drg_plan_label.setText('')
+
         # Initialization disables for DRG stuff
         self.dds_drg_parameter_select.setDisabled(True)
 
@@ -324,6 +568,10 @@ class Application(QWidget):
         self.dds_drg_rate_n_slider.setDisabled(True)
         self.dds_drg_rate_p_slider.setDisabled(True)
 
+        self.dds_drg_auto_checkbox.setDisabled(True)
+        self.dds_drg_duration_textbox.setDisabled(True)
+        self.dds_drg_resolution_textbox.setDisabled(True)
+
         # Textbox validators
         self.dds_freq_sysclk_textbox.setValidator(self.only_double)
         self.dds_frequency_textbox.setValidator(self.only_double)
@@ -337,81 +585,12 @@ class Application(QWidget):
         self.dds_drg_increment_textbox.setValidator(self.only_double)
         self.dds_drg_rate_n_textbox.setValidator(self.only_double)
         self.dds_drg_rate_p_textbox.setValidator(self.only_double)
-
-        #############
-        # EXECUTION #
-        #############
-
-        # Window dimensions
-        # self.WINDOW_SIZE = (900, 300)
-        # self.setFixedSize(self.WINDOW_SIZE[0], self.WINDOW_SIZE[1])
-        self.setWindowTitle('Device Controller')
-
-        if controller.serial_port == "none":
-            box = QMessageBox()
-            box.setIcon(QMessageBox.Warning)
-            box.setText('No COM Ports Available')
-            box.setInformativeText('Plug in your device and try again.')
-            box.setStandardButtons(QMessageBox.Ok)
-            box.exec_()
-
-            sys.exit()
-
-        else:
-            controller.send_initialization(self.is_bipolar, self.gain)
-            controller.send_voltage(controller.DAC_2, 0, self.reference_voltage, self.gain, self.is_bipolar)
-
-            self.main_window()
-
-    # Main window execution and layout
-    def main_window(self):
-        # Layout
-        layout = QGridLayout()
-        self.setLayout(layout)
-
-        # Creates the DAC controller frame part of the GUI
-        dac_frame = QFrame()
-        dac_layout = QGridLayout()
-        dac_frame.setLayout(dac_layout)
-
-        # dac_frame.setFixedSize(300, 275)
-
-        dac_layout.addWidget(self.com_select, 0, 0, 1, 3)
-        dac_layout.addWidget(self.status_text, 0, 3, 1, 1)
-
-        dac_layout.addWidget(self.dac_title, 1, 0, 1, 3)
-
-        dac_layout.addWidget(self.bipolar_checkbox, 2, 0, 1, 2)
-        dac_layout.addWidget(self.connect_sliders_checkbox, 2, 3, 1, 2)
-
-        dac_layout.addWidget(self.reference_label, 3, 0, 1, 1)
-        dac_layout.addWidget(self.reference_textbox, 3, 1, 1, 1)
-        dac_layout.addWidget(self.gain_label, 3, 2, 1, 1)
-        dac_layout.addWidget(self.gain_select, 3, 3, 1, 1)
-
-        dac_layout.addWidget(self.setup_button, 4, 0, 1, 4)
-
-        dac_layout.addWidget(self.voltage_label_a, 5, 0, 1, 3)
-
-        dac_layout.addWidget(self.voltage_textbox_a, 6, 3, 1, 1)
-
-        dac_layout.addWidget(self.voltage_slider_a, 7, 0, 1, 4)
-
-        dac_layout.addWidget(self.voltage_label_b, 8, 0, 1, 3)
-
-        dac_layout.addWidget(self.voltage_textbox_b, 9, 3, 1, 1)
-
-        dac_layout.addWidget(self.voltage_slider_b, 10, 0, 1, 4)
-
-        dac_layout.addWidget(self.readback_label, 11, 0, 1, 4)
-
-        dac_layout.addWidget(self.readback_a, 12, 0, 1, 2)
-        dac_layout.addWidget(self.readback_b, 12, 3, 1, 2)
+        self.dds_drg_duration_textbox.setValidator(self.only_double)
+        self.dds_drg_resolution_textbox.setValidator(self.only_double)
 
         # Creates the DDS controller frame part of the GUI
-        dds_frame = QFrame()
         dds_layout = QGridLayout()
-        dds_frame.setLayout(dds_layout)
+        self.dds_frame.setLayout(dds_layout)
 
         # Single Tone half of frame
         dds_single_frame = QFrame()
@@ -449,7 +628,8 @@ class Application(QWidget):
 
         dds_single_layout.addWidget(self.dds_reset_button, 10, 0, 1, 4)
 
-        dds_single_layout.addWidget(self.dds_load_button, 11, 0, 1, 4)
+        dds_single_layout.addWidget(self.dds_load_button, 11, 0, 1, 3)
+        dds_single_layout.addWidget(self.dds_live_checkbox, 11, 3, 1, 1)
 
         # Single Tone half of frame
         dds_ramp_frame = QFrame()
@@ -486,48 +666,43 @@ class Application(QWidget):
 
         dds_ramp_layout.addWidget(self.dds_drg_rate_n_slider, 12, 0, 1, 3)
 
+        dds_ramp_layout.addWidget(self.dds_drg_auto_checkbox, 13, 0, 1, 1)
+        dds_ramp_layout.addWidget(self.dds_drg_plan_label, 13, 1, 1, 2)
+
+        dds_ramp_layout.addWidget(self.dds_drg_duration_label, 14, 0, 1, 1)
+        dds_ramp_layout.addWidget(self.dds_drg_duration_textbox, 14, 2, 1, 1)
+
+        dds_ramp_layout.addWidget(self.dds_drg_resolution_label, 15, 0, 1, 1)
+        dds_ramp_layout.addWidget(self.dds_drg_resolution_textbox, 15, 2, 1, 1)
+
         # Adds the DDS sub-frames to the main frame
         dds_layout.addWidget(self.dds_title, 0, 0, 1, 1)
         dds_layout.addWidget(self.dds_drg_title, 0, 1, 1, 1)
         dds_layout.addWidget(dds_single_frame, 1, 0, 1, 1)
         dds_layout.addWidget(dds_ramp_frame, 1, 1, 1, 1)
 
-        # Adds the frames to the main window
-        layout.addWidget(dds_frame, 0, 0, 1, 1)
-        layout.addWidget(dac_frame, 0, 1, 1, 1)
-
-        self.show()
+        self.startup_mark('DDS panel built')
 
     def dds_load(self):
         if self.drg_enabled:
 
             index = self.dds_drg_parameter_select.currentIndex()
-
-            parameter = 'f'
+            parameter, reference = self.drg_parameter_reference()
 
             frequency = 0
             phase = 0
             amplitude = 0
 
             if index == 0:
-                parameter = 'f'
                 phase = float(self.dds_phase_textbox.text())
                 amplitude = float(self.dds_amplitude_textbox.text())
-
-                reference = float(self.dds_freq_sysclk_textbox.text())
             elif index == 1:
-                parameter = 'p'
                 frequency = float(self.dds_frequency_textbox.text())
                 amplitude = float(self.dds_amplitude_textbox.text())
-
-                reference = 360
             elif index == 2:
-                parameter = 'a'
                 phase = float(self.dds_phase_textbox.text())
                 frequency = float(self.dds_frequency_textbox.text())
 
-                reference = float(self.dds_amplitude_ref_textbox.text())
-
             start = float(self.dds_drg_start_textbox.text())
             stop = float(self.dds_drg_stop_textbox.text())
             decrement = float(self.dds_drg_decrement_textbox.text())
@@ -546,15 +721,31 @@ class Application(QWidget):
                 box.setStandardButtons(QMessageBox.Ok)
                 box.exec_()
                 return
-            elif (stop - start) < increment or (stop - start) < decrement:
+            elif self.drg_plan is None and ((stop - start) < increment or (stop - start) < decrement):
                 box.setInformativeText('Step increment sizes can not exceed difference between start and stop')
                 box.setStandardButtons(QMessageBox.Ok)
                 box.exec_()
                 return
+            # The plan's words got clamped to what the DRG can do, so loading them would run the wrong ramp
+            elif self.drg_plan is not None and not self.drg_plan.in_hardware:
+                box.setInformativeText('The sweep is out of the DRG range, change the duration or resolution')
+                box.setStandardButtons(QMessageBox.Ok)
+                box.exec_()
+                return
 
-            controller.send_ramp_setup(parameter, freq_sysclk, reference, start, stop, decrement, increment, rate_n, rate_p)
-            controller.send_ramp_parameters(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
-            controller.load()
+            # Ramps are kept in the library by their settings, so going back to one already used is just a select
+            if self.drg_plan is not None:
+                plan = self.drg_plan
+                name = (plan.parameter, plan.lower_limit, plan.upper_limit, plan.increment, plan.rate_p)
+                if name not in RAMP_LIBRARY:
+                    self.hardware(controller.add_ramp_plan, name, plan, True)
+            else:
+                name = (parameter, freq_sysclk, reference, start, stop, decrement, increment, rate_n, rate_p)
+                if name not in RAMP_LIBRARY:
+                    self.hardware(controller.add_ramp, name, parameter, freq_sysclk, reference, start, stop, decrement, increment, rate_n, rate_p, True)
+            self.hardware(controller.select_ramp, name)
+            self.hardware(controller.send_ramp_parameters, amplitude, ref_amplitude, phase, frequency, freq_sysclk)
+            self.hardware(controller.load)
         else:
             amplitude = float(self.dds_amplitude_textbox.text())
             amplitude_ref = float(self.dds_amplitude_ref_textbox.text())
@@ -562,13 +753,13 @@ class Application(QWidget):
             frequency = float(self.dds_frequency_textbox.text())
             freq_sysclk = float(self.dds_freq_sysclk_textbox.text())
 
-            controller.disable_ramp()
-            controller.send_single_tone(amplitude, amplitude_ref, phase, frequency, freq_sysclk)
-            controller.load()
+            self.hardware(controller.disable_ramp)
+            self.hardware(controller.send_single_tone, amplitude, amplitude_ref, phase, frequency, freq_sysclk)
+            self.hardware(controller.load)
 
     # Resets the DDS to the defaults that I like
     def dds_reset(self):
-        controller.reset()
+        self.hardware(controller.reset)
         box = QMessageBox()
         box.setIcon(QMessageBox.Information)
         box.setText('Information:')
@@ -611,6 +802,9 @@ class Application(QWidget):
             self.dds_drg_rate_n_slider.setDisabled(False)
             self.dds_drg_rate_p_slider.setDisabled(False)
 
+            self.dds_drg_auto_checkbox.setDisabled(False)
+            self.drg_auto_toggle()
+
         else:
             self.dds_frequency_slider.setDisabled(False)
             self.dds_frequency_textbox.setDisabled(False)
@@ -638,6 +832,75 @@ class Application(QWidget):
             self.dds_drg_rate_n_slider.setDisabled(True)
             self.dds_drg_rate_p_slider.setDisabled(True)
 
+            self.dds_drg_auto_checkbox.setDisabled(True)
+            self.dds_drg_duration_textbox.setDisabled(True)
+            self.dds_drg_resolution_textbox.setDisabled(True)
+
+    # Switches between hand-tuned steps and rates and ones picked by the planner
+    def drg_auto_toggle(self):
+        auto = self.dds_drg_auto_checkbox.isChecked()
+
+        self.dds_drg_duration_textbox.setDisabled(not auto)
+        self.dds_drg_resolution_textbox.setDisabled(not auto)
+
+        self.dds_drg_decrement_textbox.setDisabled(auto)
+        self.dds_drg_increment_textbox.setDisabled(auto)
+        self.dds_drg_decrement_slider.setDisabled(auto)
+        self.dds_drg_increment_slider.setDisabled(auto)
+        self.dds_drg_rate_n_textbox.setDisabled(auto)
+        self.dds_drg_rate_p_textbox.setDisabled(auto)
+        self.dds_drg_rate_n_slider.setDisabled(auto)
+        self.dds_drg_rate_p_slider.setDisabled(auto)
+
+        if auto:
+            self.plan_drg()
+        else:
+            self.drg_plan = None
+            self.dds_drg_plan_label.setText('')
+
+    # Returns the DRG destination character and the full scale reference for the selected ramp parameter
+    def drg_parameter_reference(self):
+        index = self.dds_drg_parameter_select.currentIndex()
+        if index == 1:
+            return 'p', 360
+        elif index == 2:
+            return 'a', float(self.dds_amplitude_ref_textbox.text())
+        return 'f', float(self.dds_freq_sysclk_textbox.text())
+
+    # Reruns the DRG planner and fills the step and rate boxes with what it picked. Cheap enough to run on every change.
+    def plan_drg(self):
+        if not self.dds_drg_auto_checkbox.isChecked():
+            return
+
+        parameter, reference = self.drg_parameter_reference()
+        freq_sysclk = float(self.dds_freq_sysclk_textbox.text())
+        start = float(self.dds_drg_start_textbox.text())
+        stop = float(self.dds_drg_stop_textbox.text())
+        duration = float(self.dds_drg_duration_textbox.text()) / 1000
+        resolution = float(self.dds_drg_resolution_textbox.text())
+
+        try:
+            self.drg_plan = DDS.plan_ramp(parameter, freq_sysclk, reference, start, stop, duration, resolution)
+        except ValueError as error:
+            self.drg_plan = None
+            self.dds_drg_plan_label.setText(str(error))
+            return
+
+        plan = self.drg_plan
+        self.dds_drg_increment_textbox.setText("%.5f" % plan.actual_step)
+        self.dds_drg_decrement_textbox.setText("%.5f" % plan.actual_step)
+        self.dds_drg_increment_slider.setValue(int(plan.actual_step * self.dds_drg_decrement_increment_iterator))
+        self.dds_drg_decrement_slider.setValue(int(plan.actual_step * self.dds_drg_decrement_increment_iterator))
+        self.dds_drg_rate_p_textbox.setText(str(float(plan.actual_step_time * self.dds_drg_microseconds)))
+        self.dds_drg_rate_n_textbox.setText(str(float(plan.actual_step_time * self.dds_drg_microseconds)))
+        self.dds_drg_rate_p_slider.setValue(plan.rate_p)
+        self.dds_drg_rate_n_slider.setValue(plan.rate_n)
+
+        if plan.in_hardware:
+            self.dds_drg_plan_label.setText("Error: %.3g / %.3g ms" % (plan.stop_error, plan.duration_error * 1000))
+        else:
+            self.dds_drg_plan_label.setText('Out of DRG range')
+
     def update_drg_parameter(self):
         index = self.dds_drg_parameter_select.currentIndex()
         if index == 0:
@@ -703,6 +966,8 @@ class Application(QWidget):
         self.dds_drg_increment_slider.setValue(0)
         self.dds_drg_increment_textbox.setText("%.5f" % 0.0)
 
+        self.plan_drg()
+
     def update_decrement_textbox(self):
         new_step = float(self.dds_drg_decrement_textbox.text())
         reference = self.dds_drg_decrement_increment_max
@@ -800,9 +1065,11 @@ class Application(QWidget):
             return
 
         self.dds_drg_start_slider.setValue(int(new_limit * self.dds_drg_start_stop_iterator))
+        self.plan_drg()
 
     def update_start_slider(self):
         self.dds_drg_start_textbox.setText(str(float(self.dds_drg_start_slider.value() / self.dds_drg_start_stop_iterator)))
+        self.plan_drg()
 
     def update_stop_textbox(self):
         new_limit = float(self.dds_drg_stop_textbox.text())
@@ -820,12 +1087,15 @@ class Application(QWidget):
             return
 
         self.dds_drg_stop_slider.setValue(int(new_limit * self.dds_drg_start_stop_iterator))
+        self.plan_drg()
 
     def update_stop_slider(self):
         self.dds_drg_stop_textbox.setText(str(float(self.dds_drg_stop_slider.value() / self.dds_drg_start_stop_iterator)))
+        self.plan_drg()
 
     def update_frequency_slider(self):
         self.dds_frequency_textbox.setText("%.3f" % (self.dds_frequency_slider.value() / self.dds_frequency_iterator))
+        self.dds_live_update()
 
     def update_frequency_textbox(self):
         new_frequency = float(self.dds_frequency_textbox.text())
@@ -886,6 +1156,7 @@ class Application(QWidget):
 
     def update_phase_slider(self):
         self.dds_phase_textbox.setText("%.5f" % (self.dds_phase_slider.value() / self.dds_phase_iterator))
+        self.dds_live_update()
 
     def update_phase_textbox(self):
         new_phase = float(self.dds_phase_textbox.text())
@@ -905,6 +1176,20 @@ class Application(QWidget):
 
     def update_amplitude_slider(self):
         self.dds_amplitude_textbox.setText("%.5f" % (self.dds_amplitude_slider.value() / self.dds_amplitude_iterator))
+        self.dds_live_update()
+
+    # Pushes the single tone to the DDS at the throttled rate while a slider is being dragged
+    def dds_live_update(self):
+        if not self.dds_live_checkbox.isChecked() or self.drg_enabled:
+            return
+
+        amplitude = float(self.dds_amplitude_textbox.text())
+        amplitude_ref = float(self.dds_amplitude_ref_textbox.text())
+        phase = float(self.dds_phase_textbox.text())
+        frequency = float(self.dds_frequency_textbox.text())
+        freq_sysclk = float(self.dds_freq_sysclk_textbox.text())
+
+        self.hardware_live('dds', controller.update_single_tone, amplitude, amplitude_ref, phase, frequency, freq_sysclk)
 
     def update_amplitude_textbox(self):
         new_amplitude = float(self.dds_amplitude_textbox.text())
@@ -992,12 +1277,12 @@ class Application(QWidget):
         self.voltage_slider_b.setSliderPosition(0)
 
         # Resets the outputs and initializes the DACs for the new settings
-        controller.send_initialization(self.is_bipolar, self.gain)
-        controller.send_voltage(controller.DAC_2, 0.0, self.reference_voltage, self.gain, self.is_bipolar)
+        self.hardware(controller.send_initialization, self.is_bipolar, self.gain)
+        self.hardware(controller.send_voltage, controller.DAC_2, 0.0, self.reference_voltage, self.gain, self.is_bipolar)
 
         self.status_text.setText('Welcome!')
 
-    # Handler for when the slider is changed (Doesn't update DAC until release because that would suck)
+    # Handler for when the slider is changed. Drags get sent at the throttled rate and the release sends the final value.
     def change_voltage(self):
 
         new_voltage_a = self.voltage_slider_a.value() / self.iterator
@@ -1006,6 +1291,14 @@ class Application(QWidget):
         self.voltage_textbox_a.setText("%.5f" % new_voltage_a)
         self.voltage_textbox_b.setText("%.5f" % new_voltage_b)
 
+        if self.voltage_slider_a.isSliderDown():
+            address = controller.DAC_2 if self.is_tied else controller.DAC_A
+            self.hardware_live(address, controller.send_voltage, address, new_voltage_a,
+                               self.reference_voltage, self.gain, self.is_bipolar)
+        elif self.voltage_slider_b.isSliderDown():
+            self.hardware_live(controller.DAC_B, controller.send_voltage, controller.DAC_B, new_voltage_b,
+                               self.reference_voltage, self.gain, self.is_bipolar)
+
         self.status_text.setText('Welcome!')
 
     # Handler for when the text is changed and the sliders need to be updated
@@ -1054,16 +1347,14 @@ class Application(QWidget):
 
         # Sends the voltages to the DAC
         if self.is_tied:
-            controller.send_voltage(controller.DAC_2,
-                                    self.voltage_slider_a.value() / self.iterator,
-                                    self.reference_voltage, self.gain, self.is_bipolar)
+            self.hardware(controller.send_voltage, controller.DAC_2,
+                          self.voltage_slider_a.value() / self.iterator,
+                          self.reference_voltage, self.gain, self.is_bipolar)
         else:
-            controller.send_voltage(controller.DAC_A,
-                                    self.voltage_slider_a.value() / self.iterator,
-                                    self.reference_voltage, self.gain, self.is_bipolar)
-            controller.send_voltage(controller.DAC_B,
-                                    self.voltage_slider_b.value() / self.iterator,
-                                    self.reference_voltage, self.gain, self.is_bipolar)
+            self.hardware(controller.send_voltages,
+                          {controller.DAC_A: self.voltage_slider_a.value() / self.iterator,
+                           controller.DAC_B: self.voltage_slider_b.value() / self.iterator},
+                          self.reference_voltage, self.gain, self.is_bipolar)
 
         self.status_text.setText('Welcome!')
 
@@ -1106,35 +1397,56 @@ class Application(QWidget):
         self.status_text.setText('Welcome!')
 
         # Resets the DAC
-        controller.send_initialization(self.is_bipolar, self.gain)
-        controller.send_voltage(controller.DAC_2, 0, self.reference_voltage, self.gain, self.is_bipolar)
+        self.hardware(controller.send_initialization, self.is_bipolar, self.gain)
+        self.hardware(controller.send_voltage, controller.DAC_2, 0, self.reference_voltage, self.gain, self.is_bipolar)
 
     # Sends the setup command to the DAC
     def setup(self):
-        controller.send_initialization(self.is_bipolar, self.gain)
-        controller.send_voltage(controller.DAC_2, 0, self.reference_voltage, self.gain, self.is_bipolar)
+        self.hardware(controller.send_initialization, self.is_bipolar, self.gain, True)
+        self.hardware(controller.send_voltage, controller.DAC_2, 0, self.reference_voltage, self.gain, self.is_bipolar)
         self.status_text.setText('Welcome!')
 
     # Sends update commands to the DAC upon releasing the slider
     def send_slider(self):
         if self.is_tied:
-            controller.send_voltage(controller.DAC_2,
-                                    self.voltage_slider_a.value() / self.iterator,
-                                    self.reference_voltage, self.gain, self.is_bipolar)
+            self.hardware(controller.send_voltage, controller.DAC_2,
+                          self.voltage_slider_a.value() / self.iterator,
+                          self.reference_voltage, self.gain, self.is_bipolar)
         else:
-            controller.send_voltage(controller.DAC_A,
-                                    self.voltage_slider_a.value() / self.iterator,
-                                    self.reference_voltage, self.gain, self.is_bipolar)
-            controller.send_voltage(controller.DAC_B,
-                                    self.voltage_slider_b.value() / self.iterator,
-                                    self.reference_voltage, self.gain, self.is_bipolar)
+            self.hardware(controller.send_voltages,
+                          {controller.DAC_A: self.voltage_slider_a.value() / self.iterator,
+                           controller.DAC_B: self.voltage_slider_b.value() / self.iterator},
+                          self.reference_voltage, self.gain, self.is_bipolar)
         self.status_text.setText('Welcome!')
 
     # Changes the COM port so you can find the one your Arduino is on
     def change_com(self):
-        controller.set_com(self.com_select.currentText())
+        self.hardware(controller.set_com, self.com_select.currentData())
         self.status_text.setText('Welcome!')
 
+    # Queues a call for the hardware worker thread. These go out in order and are never dropped.
+    def hardware(self, function, *args):
+        self.hardware_throttle.submit(None, function, *args)
+
+    # Queues a call that only needs its latest version sent, at no more than the update rate
+    def hardware_live(self, key, function, *args):
+        self.hardware_throttle.submit(key, function, *args)
+
+    # Changes how many times a second live slider updates get sent
+    def set_update_rate(self, rate: float):
+        self.update_rate = rate
+        self.hardware_throttle.set_rate(rate)
+
+    # Shows errors from the worker thread since they can't be raised into the GUI
+    def hardware_failed(self, message: str):
+        self.status_text.setText(str('Error: ' + message))
+
+    # Stops the worker thread so the port is free for the shutdown commands
+    def closeEvent(self, event):
+        self.hardware_thread.quit()
+        self.hardware_thread.wait()
+        super().closeEvent(event)
+
 
 ###################################################
 
@@ -1150,11 +1462,12 @@ if __name__ == '__main__':
 
     app.exec_()
 
-    # Resets the DAC outputs to 0 upon closing
-    controller.send_voltage(controller.DAC_2, 0, nice.reference_voltage, nice.gain, nice.is_bipolar)
+    if controller.is_connected():
+        # Resets the DAC outputs to 0 upon closing
+        controller.send_voltage(controller.DAC_2, 0, nice.reference_voltage, nice.gain, nice.is_bipolar)
 
-    # Resets the DDS to the default settings
-    controller.reset()
+        # Resets the DDS to the default settings
+        controller.reset()
 
     sys.exit()
 
@@ -47,10 +47,11 @@
 #   e.g. - "Dwb12832!"
 #
 # "r": Read command
-#   Afterwards send a DAC register you wish to read from: A = "a", B = "b", Both = "2"
+#   Afterwards send a DAC output you wish to read from: A = "a", B = "b"
+#   Or any number of register,channel pairs to read them all at once
 #   Finish with a "!"
-#   e.g. - "Dra!"
-#   NOTE: Not implemented yet!!!! Requires processing and reading back functions that are not implemented yet!
+#   e.g. - "Dra!" or "Dr0,0,0,2,1,0!"
+#   The values come back in a DAC readback frame (see INCOMING FRAMES), read with expect()
 #
 #
 # FUNCTIONS
@@ -69,6 +70,52 @@
 # send_command()
 #   (command: str) -> void
 #   Sends the command through the serial COM port
+#
+# register_device()
+#   (name: str, indicator: str) -> Device
+#   Adds a device to the registry. Declare its commands with Device.command() and build them with Device.encode()
+#
+# send_frame()
+#   (frame: bytes) -> void
+#   Sends a batch of commands built with FrameBuilder in a single write
+#
+# connect()
+#   (port: str = None) -> bool
+#   Opens the COM port used by send_command(). Importing this library no longer opens one on its own.
+#   If the board drops out later it gets found again by its USB identity and reopened, see RECONNECT.
+#
+# reconnect_stats()
+#   () -> dict
+#   Disconnects, reconnect times and frames held/replayed while the board was gone
+#
+# negotiate() / require()
+#   On connect the firmware says which protocol version, baud rates, buffers, devices and features it has, and the
+#   fastest of everything both sides support is used (see NEGOTIATION). Old firmware falls back to plain ASCII at 9600.
+#
+# FLOW.stats()
+#   () -> dict
+#   With firmware that supports it, writes are paced by credits from the board so its receive buffer never overflows
+#
+# PACKETS.stats()
+#   () -> dict
+#   With firmware that supports it, everything goes out in CRC checked packets that are sent again until the board
+#   acks them, see PACKETS. Counts bad packets on both sides and how many were sent again.
+#
+# discover()
+#   (refresh: bool = False) -> list
+#   Asks every serial port at once which board it is (id, firmware version, devices), caching the answers by USB
+#   serial number so known ports aren't asked again. connect() uses it to find a board when no port is given.
+#
+# take_snapshot() / save_snapshot() / load_snapshot() / restore_commands()
+#   Copies the state of every device on a board, stores it in a few bytes per register and puts it back
+#
+# subscribe()
+#   (frame_type: int, callback) -> void
+#   Calls callback(payload) for each frame of that type the Arduino sends back. Frames are read by start_reader().
+#
+# expect()
+#   (frame_type: int, frames: int = 1, parse = None, callback = None) -> Request
+#   Waits on the answer to something about to be asked for without blocking, see Request
 
 ###################################################
 
@@ -76,6 +123,20 @@
 # IMPORTS #
 ###########
 
+import binascii
+import collections
+import concurrent.futures
+import decimal
+import functools
+import json
+import math
+import numbers
+import operator
+import os
+import struct
+import threading
+import time
+import numpy
 import serial.tools.list_ports
 
 ###################################################
@@ -93,6 +154,14 @@ PMIC_INDICATOR = 'P'
 # AD9910 DDS
 DDS_INDICATOR = 'd'
 
+# The board itself (identification)
+BOARD_INDICATOR = 'B'
+
+# How many DACs and DDSs a board can have, each on its own chip select. Commands pick one with its number right after
+#   the indicator ("D1wa32768!"), no number is the first one, see Device.instance().
+DAC_INSTANCES = 2
+DDS_INSTANCES = 2
+
 ############
 # EXECUTOR #
 ############
@@ -136,6 +205,40 @@ DDS_PROFILES = ['0', '1', '2', '3', '4', '5', '6', '7']
 # Resetboi
 DDS_RESET = 'r'
 
+# Sets the DRCTL and DRHOLD pins: "dp<direction>,<hold>!", turning a ramp around or holding it without sending it again
+DDS_RAMP_PINS = 'p'
+
+# Ramps kept on the board, see RampLibrary: "dk<slot>,<register>,<high>,<low>...!" keeps one, "dj<slot>!" writes it
+DDS_RAMP_STORE = 'k'
+DDS_RAMP_SELECT = 'j'
+DDS_RAMP_SLOTS = 4
+
+# Register map (the addresses the Arduino writes to over SPI), for writing single registers with DDS_WRITE
+DDS_CFR2_REGISTER = 0x01
+DDS_CFR3_REGISTER = 0x02
+DDS_RAMP_LIMIT_REGISTER = 0x0B
+DDS_RAMP_STEP_SIZE_REGISTER = 0x0C
+DDS_RAMP_RATE_REGISTER = 0x0D
+DDS_PROFILE_0_REGISTER = 0x0E
+
+# What the Arduino puts in CFR2 to disable the DRG, and the bytes around the destination bits when enabling it
+DDS_CFR2_DEFAULT = 0x00C00820
+DDS_CFR2_RAMP_ENABLE = 0x00080820
+DDS_RAMP_DESTINATIONS = {'f': 0, 'p': 1, 'a': 2}
+
+# DRG register sizes. The ramp timer counts SYNC_CLK cycles, which run at sysclk / 4
+DDS_DRG_WORD_BITS = 32
+DDS_DRG_RATE_BITS = 16
+DDS_DRG_RATE_MAX = (1 << DDS_DRG_RATE_BITS) - 1
+DDS_DRG_SYNC_DIVIDER = 4
+
+# How a value gets rounded to a register word. Floor is what the Arduino side has always been sent.
+DDS_ROUND_FLOOR = 'floor'
+DDS_ROUND_NEAREST = 'nearest'
+
+# Most ramp rates the planner will try before settling on the best one found (keeps it fast enough for sliders)
+DDS_DRG_PLAN_SEARCH = 512
+
 
 #################
 # PMIC COMMANDS #
@@ -146,6 +249,85 @@ PMIC_OUTPUT = 'o'
 PMIC_SENSE = 's'
 PMIC_ENABLE = 'e'
 
+# Paged PMBus writes, any number of page,code,value entries in one command
+PMIC_WRITE_WORD = 'w'
+PMIC_WRITE_BYTE = 'b'
+
+# Asks for the VOUT_MODE of every page in a bit mask: "m<bit mask of pages>!", answered with a FRAME_VOUT_MODE
+PMIC_READ_VOUT_MODE = 'm'
+
+# Streams telemetry frames: "t<least ms between samples>,<bit mask of pages>!". No pages stops it.
+PMIC_TELEMETRY = 't'
+
+# Holds writes on the board until a commit, "q" then a write command: "qw<page>,<code>,<word>,...!". The board only
+#   has room for PMIC_STAGE_MAX of them, see TRANSACTIONS.
+PMIC_STAGE = 'q'
+PMIC_STAGE_MAX = 16
+
+# PMBus command codes used on the LTC2977 (see the datasheet's command summary)
+PMIC_PAGE = 0x00
+PMIC_OPERATION = 0x01
+PMIC_VOUT_MODE = 0x20
+PMIC_VOUT_COMMAND = 0x21
+PMIC_VOUT_MAX = 0x24
+PMIC_VOUT_MARGIN_HIGH = 0x25
+PMIC_VOUT_MARGIN_LOW = 0x26
+PMIC_VIN_ON = 0x35
+PMIC_VIN_OFF = 0x36
+PMIC_VOUT_OV_FAULT_LIMIT = 0x40
+PMIC_VOUT_OV_FAULT_RESPONSE = 0x41
+PMIC_VOUT_OV_WARN_LIMIT = 0x42
+PMIC_VOUT_UV_WARN_LIMIT = 0x43
+PMIC_VOUT_UV_FAULT_LIMIT = 0x44
+PMIC_VOUT_UV_FAULT_RESPONSE = 0x45
+PMIC_POWER_GOOD_ON = 0x5E
+PMIC_POWER_GOOD_OFF = 0x5F
+PMIC_TON_DELAY = 0x60
+PMIC_TON_RISE = 0x61
+PMIC_TON_MAX_FAULT_LIMIT = 0x62
+PMIC_TOFF_DELAY = 0x64
+PMIC_STATUS_BYTE = 0x78
+PMIC_STATUS_WORD = 0x79
+PMIC_STATUS_VOUT = 0x7A
+PMIC_READ_VOUT = 0x8B
+PMIC_READ_IOUT = 0x8C
+PMIC_READ_TEMPERATURE_1 = 0x8D
+PMIC_MFR_CONFIG = 0xD0
+
+# How each register's value gets encoded. Voltages on the output side are L16 (scaled by VOUT_MODE), everything
+#   else with units is L11, and the rest are raw bytes.
+PMIC_L11 = 'l11'
+PMIC_L16 = 'l16'
+PMIC_BYTE = 'byte'
+PMIC_FORMATS = {PMIC_OPERATION: PMIC_BYTE, PMIC_VOUT_COMMAND: PMIC_L16, PMIC_VOUT_MAX: PMIC_L16,
+                PMIC_VOUT_MARGIN_HIGH: PMIC_L16, PMIC_VOUT_MARGIN_LOW: PMIC_L16,
+                PMIC_VIN_ON: PMIC_L11, PMIC_VIN_OFF: PMIC_L11,
+                PMIC_VOUT_OV_FAULT_LIMIT: PMIC_L16, PMIC_VOUT_OV_FAULT_RESPONSE: PMIC_BYTE,
+                PMIC_VOUT_OV_WARN_LIMIT: PMIC_L16, PMIC_VOUT_UV_WARN_LIMIT: PMIC_L16,
+                PMIC_VOUT_UV_FAULT_LIMIT: PMIC_L16, PMIC_VOUT_UV_FAULT_RESPONSE: PMIC_BYTE,
+                PMIC_POWER_GOOD_ON: PMIC_L16, PMIC_POWER_GOOD_OFF: PMIC_L16,
+                PMIC_TON_DELAY: PMIC_L11, PMIC_TON_RISE: PMIC_L11, PMIC_TON_MAX_FAULT_LIMIT: PMIC_L11,
+                PMIC_TOFF_DELAY: PMIC_L11}
+
+# Names for the rail settings that PMIC.rail_writes() takes
+PMIC_RAIL_SETTINGS = {'vout': PMIC_VOUT_COMMAND, 'vout_max': PMIC_VOUT_MAX,
+                      'ov_fault': PMIC_VOUT_OV_FAULT_LIMIT, 'ov_warn': PMIC_VOUT_OV_WARN_LIMIT,
+                      'uv_warn': PMIC_VOUT_UV_WARN_LIMIT, 'uv_fault': PMIC_VOUT_UV_FAULT_LIMIT,
+                      'power_good_on': PMIC_POWER_GOOD_ON, 'power_good_off': PMIC_POWER_GOOD_OFF,
+                      'ton_delay': PMIC_TON_DELAY, 'ton_rise': PMIC_TON_RISE,
+                      'ton_max_fault': PMIC_TON_MAX_FAULT_LIMIT, 'toff_delay': PMIC_TOFF_DELAY}
+
+# OPERATION values
+PMIC_ON = 0x80
+PMIC_OFF = 0x00
+
+# The LTC2977 has 8 channels (pages), and its VOUT_MODE is fixed at an exponent of -13
+PMIC_PAGES = 8
+PMIC_VOUT_MODE_DEFAULT = 0x13
+
+# Most entries in one write command, so a command stays well inside the Arduino's RAM while it's queued
+PMIC_BATCH_SIZE = 16
+
 ################
 # DAC COMMANDS #
 ################
@@ -164,30 +346,1571 @@ DAC_UNIPOLAR = 'u'
 DAC_GAIN_2 = '1'
 DAC_GAIN_4 = '2'
 DAC_GAIN_432 = '3'
+# Writes any one register (range, power, control or data)
+DAC_REGISTER = 'g'
+# Writes the data registers of several channels and loads them all on one LDAC edge: "Dm<channel>,<data>,...!"
+DAC_SIMULTANEOUS = 'm'
+# The same without the load, so more DACs can be written first, then one LDAC edge loads every DAC on the board
+DAC_STAGE = 'n'
+DAC_LDAC = 'l'
+
+# Register and channel numbers for DAC_REGISTER, same as in the datasheet
+DAC_DATA_REGISTER = 0
+DAC_RANGE_REGISTER = 1
+DAC_POWER_REGISTER = 2
+DAC_CONTROL_REGISTER = 3
+DAC_CHANNELS = {'a': 0, 'b': 2}
+DAC_CONTROL_TOGGLES = 1
+
+# What the Arduino's setup puts in the control toggles and power registers
+DAC_TOGGLES_DEFAULT = 4
+DAC_POWER_DEFAULT = 5
+
+# Bits of each register that read back what was written (the power register also reads back status bits)
+DAC_READBACK_MASKS = {DAC_DATA_REGISTER: 0xFFFF, DAC_RANGE_REGISTER: 0x7, DAC_POWER_REGISTER: 0xF,
+                      DAC_CONTROL_REGISTER: 0xF}
+
+# Most registers the Arduino reads back in one frame
+DAC_READBACK_BATCH = 20
+
+# Output range codes for each polarity and gain
+DAC_RANGES = {(DAC_UNIPOLAR, DAC_GAIN_2): 0, (DAC_UNIPOLAR, DAC_GAIN_4): 1, (DAC_UNIPOLAR, DAC_GAIN_432): 2,
+              (DAC_BIPOLAR, DAC_GAIN_2): 3, (DAC_BIPOLAR, DAC_GAIN_4): 4, (DAC_BIPOLAR, DAC_GAIN_432): 5}
 
 # OTHER CONSTANTS #
 # Bit precision of the DAC
 DAC_BITS = 14
 DAC_MAX_BITS = 16
+DAC_CODES = 1 << DAC_BITS
+
+##################
+# BOARD COMMANDS #
+##################
+
+# Asks the board who it is, answered with an identify frame
+BOARD_IDENTIFY = 'i'
+
+# Sets the board id, kept in the Arduino's EEPROM
+BOARD_SET_ID = 's'
+
+# Asks what the firmware supports, answered with a capabilities frame
+BOARD_CAPABILITIES = 'c'
+
+# Switches the baud rate, see NEGOTIATION
+BOARD_BAUD = 'b'
+
+# Turns flow control on or off, and asks for a credit frame right away, see FLOW CONTROL
+BOARD_FLOW = 'f'
+BOARD_CREDIT = 'k'
+
+# Turns CRC checked packets on or off, see PACKETS
+BOARD_PACKETS = 'p'
+
+# Makes everything staged on the board take effect together, answered with a commit frame, see TRANSACTIONS
+BOARD_COMMIT = 'x'
+
+# Bits of the devices mask in an identify frame
+BOARD_DEVICES = {'dac': 1, 'dds': 2, 'pmic': 4}
+
+###################################################
+
+###################
+# DEVICE REGISTRY #
+###################
+# Every device declares its commands once: the characters that pick the command and the fields that follow them.
+#   An encoder is generated for each command from that declaration, so supporting a new IC is a few register_device()
+#   and Device.command() calls instead of more string building code.
+#
+# Fields are either single characters (bits = 0), which are written straight after the previous field, or integers
+#   with a bit width, which are written in decimal and separated from the previous integer by a ",".
+#   e.g. the DDS ramp setup: 'd' + 'ors' + parameter + lower,upper,decrement,increment,rate_n,rate_p + '!'
+#
+# Devices that can be on a board more than once get their instance number after the indicator, see Device.instance().
+
+
+# One field of a command
+class Field:
+
+    def __init__(self, name: str, bits: int = 0):
+        if not name.isidentifier():
+            raise ValueError(str('Invalid field name: ' + name))
+        self.name = name
+        self.bits = bits
+
+
+# One command of a device. encode(*values) returns the finished command string.
+#   A repeated command takes a list of rows instead, each row filling every field once, all comma separated.
+#   e.g. 'P' + 'w' + page,code,value,page,code,value + '!'
+class Command:
+
+    def __init__(self, device, name: str, opcode: str, fields: list, repeat: bool = False):
+        if repeat and not all(field.bits for field in fields):
+            raise ValueError('Repeated commands can only have integer fields')
+
+        self.device = device
+        self.name = name
+        self.opcode = opcode
+        self.fields = fields
+        self.repeat = repeat
+        self.prefix = str(device.indicator + opcode)
+        self.encode = self.generate_encoder()
+        self.pack = self.generate_packer()
+
+    # Builds the encoder as a single f-string so a command costs one formatting call and no intermediate strings
+    def generate_encoder(self):
+        names = [field.name for field in self.fields]
+        prefix = self.prefix.replace('{', '{{').replace('}', '}}')
+
+        if self.repeat:
+            row = ','.join('{' + name + '}' for name in names)
+            source = str('def encode(rows):\n    return ' + repr(self.prefix) + " + ','.join([f" + repr(row) +
+                         ' for ' + ', '.join(names) + ' in rows]) + ' + repr(DONE) + '\n')
+        else:
+            template = prefix
+            previous_int = False
+            for field in self.fields:
+                if field.bits and previous_int:
+                    template = str(template + ',')
+                template = str(template + '{' + field.name + '}')
+                previous_int = bool(field.bits)
+            template = str(template + DONE)
+            source = str('def encode(' + ', '.join(names) + '):\n    return f' + repr(template) + '\n')
+
+        namespace = {}
+        exec(source, namespace)
+        encode = namespace['encode']
+        encode.__name__ = str(self.device.name + '_' + self.name)
+        return encode
+
+    # Same as the encoder but makes the finished command as bytes in one go for FrameBuilder, skipping the str and the
+    #   .encode() copy. Character fields go in with %c so they never have to be encoded on their own either.
+    def generate_packer(self):
+        names = [field.name for field in self.fields]
+        prefix = self.prefix.replace('%', '%%')
+
+        if self.repeat:
+            row = ','.join('%d' for name in names)
+            source = str('def pack(rows):\n    return ' + repr(self.prefix.encode()) + " + b','.join([" +
+                         repr(row.encode()) + ' % (' + ', '.join(names) + ',) for ' + ', '.join(names) +
+                         ' in rows]) + ' + repr(DONE.encode()) + '\n')
+        else:
+            template = prefix
+            values = []
+            previous_int = False
+            for field in self.fields:
+                if field.bits:
+                    if previous_int:
+                        template = str(template + ',')
+                    template = str(template + '%d')
+                    values.append(field.name)
+                else:
+                    template = str(template + '%c')
+                    values.append(str('ord(' + field.name + ')'))
+                previous_int = bool(field.bits)
+            template = str(template + DONE)
+
+            if values:
+                body = str(repr(template.encode()) + ' % (' + ', '.join(values) + ',)')
+            else:
+                body = repr(template.encode())
+            source = str('def pack(' + ', '.join(names) + '):\n    return ' + body + '\n')
+
+        namespace = {}
+        exec(source, namespace)
+        pack = namespace['pack']
+        pack.__name__ = str(self.device.name + '_' + self.name + '_pack')
+        return pack
+
+    # Checks that every value fits its field. Kept out of encode() so the fast path doesn't pay for it.
+    def validate(self, *values):
+        if self.repeat:
+            for row in values[0]:
+                self.validate_row(row)
+        else:
+            self.validate_row(values)
+
+    def validate_row(self, values):
+        if len(values) != len(self.fields):
+            raise ValueError(str(self.device.name + ' ' + self.name + ' takes ' + str(len(self.fields)) + ' fields'))
+        for field, value in zip(self.fields, values):
+            if field.bits:
+                if not 0 <= value < (1 << field.bits):
+                    raise ValueError(str(field.name + ' does not fit in ' + str(field.bits) + ' bits'))
+            elif len(str(value)) != 1:
+                raise ValueError(str(field.name + ' must be a single character'))
+
+
+# A device that can be talked to through the Arduino
+class Device:
+
+    def __init__(self, name: str, indicator: str):
+        self.name = name
+        self.indicator = indicator
+        self.commands = {}
+        self.instances = {0: self}
+
+    # Declares a command and returns it
+    def command(self, name: str, opcode: str, fields: list = (), repeat: bool = False):
+        new_command = Command(self, name, opcode, list(fields), repeat)
+        self.commands[name] = new_command
+        for device in self.instances.values():
+            if device is not self:
+                device.command(name, opcode, fields, repeat)
+        return new_command
+
+    # The same device on another chip select, its commands starting with the instance number after the indicator:
+    #   DAC_DEVICE.instance(1).encode('write', DAC_A, 32768) is 'D1wa32768!'. Instance 0 is the device itself, so
+    #   commands without a number still go to the first chip.
+    def instance(self, number: int):
+        device = self.instances.get(number)
+        if device is None:
+            device = Device(self.name, str(self.indicator + str(number)))
+            for command in self.commands.values():
+                device.command(command.name, command.opcode, command.fields, command.repeat)
+            self.instances[number] = device
+        return device
+
+    # Shortcut for building a command by name
+    def encode(self, name: str, *values) -> str:
+        return self.commands[name].encode(*values)
+
+
+DEVICES = {}
+
+
+# Adds a device to the registry and returns it so its commands can be declared
+def register_device(name: str, indicator: str) -> Device:
+    if name in DEVICES:
+        raise ValueError(str('Device already registered: ' + name))
+    for device in DEVICES.values():
+        if device.indicator == indicator:
+            raise ValueError(str('Indicator already used by ' + device.name))
+
+    device = Device(name, indicator)
+    DEVICES[name] = device
+    return device
+
+
+#################
+# FRAME BUILDER #
+#################
+
+# Starting size of the frame buffer, grows if a batch ever needs more
+FRAME_BUFFER_SIZE = 4096
+
+
+# Builds a batch of commands straight into one reusable bytearray so it can go out in a single serial write.
+#   Each command is packed to bytes once and copied into the buffer, there are no intermediate strings and the
+#   buffer itself is only ever reallocated if a batch outgrows it.
+class FrameBuilder:
+
+    def __init__(self, size: int = FRAME_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+
+    # Empties the builder without giving the buffer back
+    def clear(self):
+        self.length = 0
+
+    # Adds a registry command, e.g. builder.add(DAC_DEVICE.commands['write'], DAC_A, 32768)
+    def add(self, command, *values):
+        data = command.pack(*values)
+        end = self.length + len(data)
+        if end > len(self.buffer):
+            self.grow(end)
+        self.view[self.length:end] = data
+        self.length = end
+
+    # Adds the same registry command once for every tuple of values, the fast path for long sequences
+    def add_many(self, command, rows):
+        pack = command.pack
+        for values in rows:
+            data = pack(*values)
+            end = self.length + len(data)
+            if end > len(self.buffer):
+                self.grow(end)
+            self.view[self.length:end] = data
+            self.length = end
+
+    # Adds bytes that are already a finished command
+    def add_bytes(self, data):
+        end = self.length + len(data)
+        if end > len(self.buffer):
+            self.grow(end)
+        self.view[self.length:end] = data
+        self.length = end
+
+    # Doubles the buffer until it holds at least "size" bytes
+    def grow(self, size: int):
+        new_size = len(self.buffer)
+        while new_size < size:
+            new_size *= 2
+        new_buffer = bytearray(new_size)
+        new_buffer[:self.length] = self.view[:self.length]
+        self.view.release()
+        self.buffer = new_buffer
+        self.view = memoryview(self.buffer)
+
+    # The finished frame. This is a view into the buffer, so send it before adding anything else.
+    def frame(self) -> memoryview:
+        return self.view[:self.length]
+
+
+# Builder shared by the bulk sending functions
+FRAME_BUILDER = FrameBuilder()
+
+
+####################
+# SHADOW REGISTERS #
+####################
+
+# Host side copy of what's in a device's registers, so commands that wouldn't change anything never get sent.
+#   Registers that have never been written (or were invalidated by a reset or reconnect) are unknown and always sent.
+class ShadowRegisters:
+
+    def __init__(self):
+        self.registers = {}
+
+        # Set when registers have been written since the last load
+        self.staged = False
+
+    # Forgets everything, use whenever the device may have been reset behind our back
+    def invalidate(self):
+        self.registers.clear()
+        self.staged = False
+
+    # The registers out of "registers" (register -> value) that differ from what the device has
+    def diff(self, registers: dict) -> dict:
+        changed = {}
+        for register, value in registers.items():
+            if self.registers.get(register) != value:
+                changed[register] = value
+        return changed
+
+    # Works out the commands for a write of "registers" and records them as written. Returns no commands if
+    #   nothing changed, full_command if everything did, otherwise one register_command(register, value) per change.
+    def write(self, registers: dict, full_command: str, register_command) -> list:
+        changed = self.diff(registers)
+        if not changed:
+            return []
+
+        self.registers.update(changed)
+        self.staged = True
+
+        # Legacy firmware can't write single registers
+        if len(changed) == len(registers) or not CAPABILITIES.supports('registers'):
+            return [full_command]
+        return [register_command(register, value) for register, value in changed.items()]
+
+
+DDS_SHADOW = ShadowRegisters()
+DAC_SHADOW = ShadowRegisters()
+PMIC_SHADOW = ShadowRegisters()
+
+# One for every instance of a device, the ones above being instance 0
+DDS_SHADOWS = [DDS_SHADOW] + [ShadowRegisters() for instance in range(1, DDS_INSTANCES)]
+DAC_SHADOWS = [DAC_SHADOW] + [ShadowRegisters() for instance in range(1, DAC_INSTANCES)]
+SHADOWS = DDS_SHADOWS + DAC_SHADOWS + [PMIC_SHADOW]
+
+
+# Forgets the state of every device, done on reconnect since the board may have rebooted
+def invalidate_shadows():
+    for shadow in SHADOWS:
+        shadow.invalidate()
+
+
+#######################
+# DEVICE DECLARATIONS #
+#######################
+
+# AD9910 DDS
+DDS_DEVICE = register_device('dds', DDS_INDICATOR)
+DDS_DEVICE.command('reset', DDS_RESET)
+DDS_DEVICE.command('load', DDS_LOAD)
+DDS_DEVICE.command('disable_ramp', DDS_OUTPUT + DDS_RAMP + DDS_RAMP_DISABLE)
+DDS_DEVICE.command('ramp_setup', DDS_OUTPUT + DDS_RAMP + DDS_RAMP_SETUP,
+                   [Field('parameter'),
+                    Field('lower_limit', DDS_DRG_WORD_BITS), Field('upper_limit', DDS_DRG_WORD_BITS),
+                    Field('decrement', DDS_DRG_WORD_BITS), Field('increment', DDS_DRG_WORD_BITS),
+                    Field('rate_n', DDS_DRG_RATE_BITS), Field('rate_p', DDS_DRG_RATE_BITS)])
+DDS_DEVICE.command('ramp_parameters', DDS_OUTPUT + DDS_RAMP + DDS_RAMP_PARAMETERS,
+                   [Field('amplitude', 14), Field('phase', 16), Field('frequency', 32)])
+DDS_DEVICE.command('single_tone', DDS_OUTPUT + DDS_SINGLE_TONE,
+                   [Field('amplitude', 14), Field('phase', 16), Field('frequency', 32)])
+DDS_DEVICE.command('register', DDS_WRITE, [Field('register', 8), Field('high', 32), Field('low', 32)])
+DDS_DEVICE.command('ramp_pins', DDS_RAMP_PINS, [Field('direction', 1), Field('hold', 1)])
+DDS_DEVICE.command('store_ramp', DDS_RAMP_STORE,
+                   [Field('slot', 8), Field('register', 8), Field('high', 32), Field('low', 32)], repeat=True)
+DDS_DEVICE.command('select_ramp', DDS_RAMP_SELECT, [Field('slot', 8)])
+
+# AD5732 DAC
+DAC_DEVICE = register_device('dac', DAC_INDICATOR)
+DAC_DEVICE.command('setup', DAC_START, [Field('polarity'), Field('gain')])
+DAC_DEVICE.command('write', DAC_WRITE, [Field('address'), Field('data', DAC_MAX_BITS)])
+DAC_DEVICE.command('read', DAC_READ, [Field('address')])
+DAC_DEVICE.command('register', DAC_REGISTER, [Field('register', 3), Field('channel', 3), Field('data', 16)])
+DAC_DEVICE.command('read_registers', DAC_READ, [Field('register', 3), Field('channel', 3)], repeat=True)
+DAC_DEVICE.command('write_together', DAC_SIMULTANEOUS, [Field('channel', 3), Field('data', DAC_MAX_BITS)], repeat=True)
+DAC_DEVICE.command('stage', DAC_STAGE, [Field('channel', 3), Field('data', DAC_MAX_BITS)], repeat=True)
+DAC_DEVICE.command('ldac', DAC_LDAC)
+
+# LTC2977 PMIC
+PMIC_DEVICE = register_device('pmic', PMIC_INDICATOR)
+PMIC_DEVICE.command('write_words', PMIC_WRITE_WORD, [Field('page', 8), Field('code', 8), Field('value', 16)],
+                    repeat=True)
+PMIC_DEVICE.command('write_bytes', PMIC_WRITE_BYTE, [Field('page', 8), Field('code', 8), Field('value', 8)],
+                    repeat=True)
+PMIC_DEVICE.command('stage_words', PMIC_STAGE + PMIC_WRITE_WORD,
+                    [Field('page', 8), Field('code', 8), Field('value', 16)], repeat=True)
+PMIC_DEVICE.command('stage_bytes', PMIC_STAGE + PMIC_WRITE_BYTE,
+                    [Field('page', 8), Field('code', 8), Field('value', 8)], repeat=True)
+PMIC_DEVICE.command('telemetry', PMIC_TELEMETRY, [Field('period', 16), Field('pages', 8)])
+PMIC_DEVICE.command('read_vout_mode', PMIC_READ_VOUT_MODE, [Field('pages', 8)])
+
+# The Arduino itself
+BOARD_DEVICE = register_device('board', BOARD_INDICATOR)
+BOARD_DEVICE.command('identify', BOARD_IDENTIFY)
+BOARD_DEVICE.command('set_id', BOARD_SET_ID, [Field('board', 16)])
+BOARD_DEVICE.command('capabilities', BOARD_CAPABILITIES)
+BOARD_DEVICE.command('baud', BOARD_BAUD, [Field('baud', 32)])
+BOARD_DEVICE.command('flow', BOARD_FLOW, [Field('enabled', 1)])
+BOARD_DEVICE.command('credit', BOARD_CREDIT)
+BOARD_DEVICE.command('packets', BOARD_PACKETS, [Field('enabled', 1)])
+BOARD_DEVICE.command('commit', BOARD_COMMIT)
 
 ###################################################
 
 ################
 # SERIAL SETUP #
 ################
-# Finds the list of COM Ports available and sets one as the default
-ports = list(serial.tools.list_ports.comports())
-
+# Nothing gets opened at import time since scanning and opening ports is slow (and resets some Arduinos).
+#   Call connect() to open the default port.
 COM_PORTS_LIST = []
-for p in ports:
-    COM_PORTS_LIST.append(p.device)
+com_port = "none"
+serial_port = "none"
+
+
+# Finds the list of COM Ports available
+def list_com_ports() -> list:
+    global COM_PORTS_LIST
+
+    COM_PORTS_LIST = []
+    for p in serial.tools.list_ports.comports():
+        COM_PORTS_LIST.append(p.device)
+
+    return COM_PORTS_LIST
+
+
+# USB (vid, pid, serial number) of a port, for finding the same board again if it comes back under another name.
+#   (None, None, port) for ports that aren't USB, which can only be found again under the same name.
+def port_identity(port: str):
+    for p in serial.tools.list_ports.comports():
+        if p.device == port and p.vid is not None:
+            return p.vid, p.pid, p.serial_number
+    return None, None, port
+
+
+# Name of the port a board with that identity is on now, None if it isn't plugged in
+def find_port(identity: tuple):
+    if identity[0] is None:
+        name = identity[2]
+        if os.path.exists(name) or name in list_com_ports():
+            return name
+        return None
+    for p in serial.tools.list_ports.comports():
+        if (p.vid, p.pid, p.serial_number) == identity:
+            return p.device
+    return None
+
+
+# Opens a COM port as the default. If none is given it's the first board that answers discover(), or the first
+#   port there is if none do (firmware too old to identify itself). Returns whether it worked.
+#   The firmware's capabilities are negotiated (see NEGOTIATION) unless negotiation is off.
+#   Anything sent while there was no port gets sent now, unless resume is off.
+def connect(port: str = None, resume: bool = True, negotiation: bool = True) -> bool:
+    global com_port, serial_port, CAPABILITIES
+
+    try:
+        if port is None:
+            boards = [info for info in discover() if info.is_board()]
+            port = boards[0].port if boards else list_com_ports()[0]
+        new_port = PROBED_PORTS.pop(port, None)
+        if new_port is None:
+            new_port = serial.Serial(port=port, baudrate=DEFAULT_BAUD, timeout=READ_TIMEOUT)
+        new_port.timeout = READ_TIMEOUT
+    except (serial.SerialException, IndexError) as exception:
+        return False
+    capabilities = negotiate(new_port) if negotiation else HOST_CAPABILITIES
+
+    restart_reader = stop_reader()
+    if serial_port != "none":
+        try:
+            serial_port.close()
+        except (serial.SerialException, OSError):
+            pass
+
+    com_port = port
+    serial_port = new_port
+    CAPABILITIES = capabilities
+    SUPERVISOR.identity = port_identity(port)
+    invalidate_shadows()
+    RAMP_LIBRARY.forget_slots()
+
+    # The reader has to run for credit frames to come back, and for acks
+    PACKETS.disable()
+    if capabilities.supports('credits') and enable_flow_control(new_port, capabilities.rx_buffer):
+        restart_reader = True
+    else:
+        FLOW.disable()
+    if capabilities.supports('packets'):
+        restart_reader = True
+    if restart_reader:
+        start_reader()
+    if capabilities.supports('packets'):
+        PACKETS.enable()
+    if resume:
+        SUPERVISOR.resume()
+    return True
+
+
+###################
+# INCOMING FRAMES #
+###################
+# Anything the Arduino sends back comes as a binary frame so it can share the line with whatever else is being sent:
+#   FRAME_START, type, payload length, payload, checksum (low byte of the sum of the type, length and payload)
+# While packets are on (see PACKETS) the checksum is a CRC-16 of the type, length and payload instead, low byte first.
+# A reader thread pulls frames off the serial port and hands each payload to whoever subscribed to its type.
+
+FRAME_START = 0xA5
+FRAME_HEADER_SIZE = 3
+FRAME_TELEMETRY = ord('T')
+FRAME_FAULT = ord('F')
+FRAME_VOUT_MODE = ord('M')
+FRAME_DAC_READBACK = ord('R')
+FRAME_IDENTIFY = ord('I')
+FRAME_CAPABILITIES = ord('C')
+FRAME_BAUD = ord('S')
+FRAME_CREDIT = ord('K')
+FRAME_ACK = ord('A')
+FRAME_NAK = ord('N')
+FRAME_COMMIT = ord('X')
+
+# Frame types handed out before anything else that came in with them
+PRIORITY_FRAMES = (FRAME_FAULT,)
+
+# How long a read waits before the reader checks whether it was stopped (seconds)
+READ_TIMEOUT = 0.1
+
+
+# CRC-16/CCITT starting from 0xFFFF, the same as the firmware's _crc_xmodem_update
+def crc16(data) -> int:
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+# Splits a byte stream into frames. Bytes before a start marker and frames with a bad checksum get dropped.
+#   Set crc for frames from a board with packets on.
+class FrameParser:
+
+    def __init__(self, crc: bool = False):
+        self.buffer = bytearray()
+        self.crc = crc
+        self.dropped = 0
+        self.bad_frames = 0
+
+    # Adds received bytes and returns every (type, payload) that is now complete
+    def feed(self, data) -> list:
+        buffer = self.buffer
+        buffer += data
+        frames = []
+
+        while True:
+            start = buffer.find(FRAME_START)
+            if start < 0:
+                self.dropped += len(buffer)
+                buffer.clear()
+                break
+            if start:
+                self.dropped += start
+                del buffer[:start]
+            if len(buffer) < FRAME_HEADER_SIZE:
+                break
+
+            trailer = 2 if self.crc else 1
+            end = FRAME_HEADER_SIZE + buffer[2] + trailer
+            if len(buffer) < end:
+                break
+
+            if self.crc:
+                good = crc16(buffer[1:end - 2]) == buffer[end - 2] | buffer[end - 1] << 8
+            else:
+                good = sum(buffer[1:end - 1]) & 0xFF == buffer[end - 1]
+            if good:
+                frames.append((buffer[1], bytes(buffer[FRAME_HEADER_SIZE:end - trailer])))
+                del buffer[:end]
+            else:
+                # Probably not a real start marker, look for the next one
+                self.dropped += 1
+                self.bad_frames += 1
+                del buffer[:1]
+
+        return frames
+
+
+# Callbacks for each frame type, kept outside the reader so they stay subscribed across reconnects
+FRAME_HANDLERS = {}
+
+
+# Calls callback(payload) for every frame of frame_type that gets received
+def subscribe(frame_type: int, callback):
+    FRAME_HANDLERS.setdefault(frame_type, []).append(callback)
+
+
+def unsubscribe(frame_type: int, callback):
+    FRAME_HANDLERS.get(frame_type, []).remove(callback)
+
+
+# Reads frames off a serial port on its own thread until stop() is called
+class SerialReader(threading.Thread):
+
+    def __init__(self, port):
+        super().__init__(name='pyduino reader', daemon=True)
+        self.port = port
+        self.parser = FrameParser()
+        self.running = True
+        self.received = time.perf_counter()
+
+        # The supervisor, flow control and packets of the board it was started for, so its frames reach them even
+        #   while the bridge has another board's in the globals
+        self.supervisor = SUPERVISOR
+        self.links = {FRAME_CREDIT: FLOW.grant, FRAME_ACK: PACKETS.ack, FRAME_NAK: PACKETS.nak}
+
+        # Requests waiting on frames from this port, {frame_type: deque of Request}, see expect()
+        self.pending = {}
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.port.read(max(1, self.port.in_waiting))
+            except (serial.SerialException, OSError):
+                self.supervisor.lost()
+                break
+            if not data:
+                continue
+            self.received = time.perf_counter()
+
+            frames = self.parser.feed(data)
+            if len(frames) > 1:
+                frames.sort(key=lambda frame: frame[0] not in PRIORITY_FRAMES)
+            for frame_type, payload in frames:
+                link = self.links.get(frame_type)
+                if link is not None:
+                    link(payload)
+                queue = self.pending.get(frame_type)
+                if queue:
+                    answer(queue, payload)
+                for callback in tuple(FRAME_HANDLERS.get(frame_type, ())):
+                    callback(payload)
+
+    def stop(self):
+        self.running = False
+        if self is not threading.current_thread():
+            self.join()
+
+
+# Something the host asked the Arduino for. Answers of one type come back in the order they were asked for, so every
+#   frame type keeps a queue of the requests still waiting on the reader of the port they were asked on. Check done()
+#   or pass a callback instead of waiting on it.
+class Request:
+
+    def __init__(self, frames: int = 1, parse=None, callback=None):
+        self.frames = frames
+        self.payloads = []
+        self.parse = parse
+        self.callback = callback
+        self.result = None
+        self.event = threading.Event()
+
+        # The queue it's waiting in, set by expect()
+        self.queue = None
+
+    def done(self) -> bool:
+        return self.event.is_set()
+
+    # Waits for the answer, returns None if it didn't come in time. One that times out is cancelled, so a lost frame
+    #   doesn't hand every later answer to the request before it.
+    def wait(self, timeout: float = None):
+        if not self.event.wait(timeout):
+            self.cancel()
+        return self.result
+
+    # Stops waiting for the answer, the frames that come next go to the requests after it
+    def cancel(self):
+        with PENDING_LOCK:
+            if self.queue is not None and self in self.queue:
+                self.queue.remove(self)
+
+    def receive(self, payload: bytes):
+        self.payloads.append(payload)
+        if len(self.payloads) < self.frames:
+            return False
+
+        if self.parse is None:
+            self.result = self.payloads
+        else:
+            self.result = self.parse(self.payloads)
+        self.event.set()
+        if self.callback is not None:
+            self.callback(self.result)
+        return True
+
+
+# Held while the queues of waiting requests change, reentrant since a callback can expect() the next answer
+PENDING_LOCK = threading.RLock()
+
+
+# Hands the payload to the oldest request waiting in the queue
+def answer(queue, payload: bytes):
+    with PENDING_LOCK:
+        if queue and queue[0].receive(payload):
+            queue.popleft()
+
+
+# Sets up a request for the next "frames" frames of a type from the open port. Call it after start_reader() and before
+#   sending whatever asks for them. Requests still waiting when the port is reopened never get their answer.
+def expect(frame_type: int, frames: int = 1, parse=None, callback=None) -> Request:
+    request = Request(frames, parse, callback)
+    with PENDING_LOCK:
+        request.queue = READER.pending.setdefault(frame_type, collections.deque())
+        request.queue.append(request)
+    return request
+
+
+READER = None
 
-try:
-    com_port = COM_PORTS_LIST[0]
-    serial_port = serial.Serial(port=com_port, baudrate=9600)
-except (serial.SerialException, IndexError) as exception:
-    COMP_PORTS_LIST = ["No Device Available"]
-    serial_port = "none"
+
+# Starts reading frames from the open COM port
+def start_reader():
+    global READER
+
+    if READER is None:
+        READER = SerialReader(serial_port)
+        READER.start()
+
+
+# Stops the reader. Returns whether one was running.
+def stop_reader() -> bool:
+    global READER
+
+    if READER is None:
+        return False
+    READER.stop()
+    READER = None
+    return True
+
+
+#############
+# RECONNECT #
+#############
+# When the port drops out (a write or the reader fails) nothing gets lost: frames sent from then on are held, a
+#   thread looks for the board by its USB identity (by its name if it isn't USB) until it shows up again, reopens it,
+#   puts back the state it had (opening the port resets most Arduinos) and then sends everything held, the frame that
+#   failed first. With packets on only what the board hadn't acked yet gets held, so nothing it already ran is run
+#   twice.
+# The reconnect reads and replaces the board's module globals (serial_port, CAPABILITIES, READER, the shadows...) from
+#   its own thread, so it holds BOARD_LOCK while it does. Anything else working with them off the main thread (the GUI
+#   worker, the bridge swapping boards in and out) holds it too.
+
+# Held while a thread works with the board in the module globals
+BOARD_LOCK = threading.RLock()
+
+# Seconds between scans for a board that dropped out
+RECONNECT_INTERVAL = 0.25
+
+# Most frames held while disconnected, the oldest are dropped past this
+RECONNECT_QUEUE_SIZE = 4096
+
+# Reconnect times kept for reconnect_stats()
+RECONNECT_HISTORY = 64
+
+
+class Supervisor:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.queue = collections.deque()
+
+        # Held while a frame is being written so frames don't get mixed up, separate from the lock so a write waiting
+        #   on flow control or acks doesn't hold up the reader reporting the port lost
+        self.writing = threading.Lock()
+        self.identity = None
+        self.down = False
+        self.lost_at = 0.0
+        self.thread = None
+
+        # Held around the reconnect, anything that puts this board in the globals while it's held will do (the bridge's
+        #   boards do)
+        self.board = BOARD_LOCK
+
+        # The PacketLink of the same board, for taking back what it didn't get acked
+        self.packets = None
+
+        # Whether to put the board's state back after reconnecting
+        self.restore = True
+
+        self.times = collections.deque(maxlen=RECONNECT_HISTORY)
+        self.disconnects = 0
+        self.replayed_frames = 0
+        self.replayed_bytes = 0
+        self.dropped_frames = 0
+
+    # Holds a frame until the port is back
+    def hold(self, data):
+        with self.lock:
+            if len(self.queue) >= RECONNECT_QUEUE_SIZE:
+                self.queue.popleft()
+                self.dropped_frames += 1
+            self.queue.append(bytes(data))
+
+    # Called when the port fails, with the frame being written if there was one
+    def lost(self, data=None):
+        with self.lock:
+            unsent = self.packets.take_unsent()
+            if unsent is not None:
+                data = unsent
+            if data:
+                self.hold(data)
+            if self.down:
+                return
+            self.down = True
+            self.lost_at = time.perf_counter()
+            self.disconnects += 1
+
+            if self.identity is not None and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self.reconnect, name='pyduino reconnect', daemon=True)
+                self.thread.start()
+
+    # Runs on its own thread until the board is back
+    def reconnect(self):
+        while self.down:
+            port = find_port(self.identity)
+            if port is not None:
+                with self.board:
+                    # Whatever stopped it looking (e.g. the bridge closing) went first
+                    if not self.down:
+                        return
+                    snapshot = take_snapshot()
+                    if connect(port, False):
+                        self.resume(restore_commands(snapshot) if self.restore else ())
+                        if not self.down:
+                            return
+            time.sleep(RECONNECT_INTERVAL)
+
+    # Sends the restore commands and then everything held, and carries on as normal
+    def resume(self, commands=()):
+        with self.writing:
+            with self.lock:
+                was_down = self.down
+                frames = list(self.queue)
+                self.queue.clear()
+                self.down = False
+
+            data = b''.join([command.encode() for command in commands] + frames)
+            if data:
+                try:
+                    port_write(data)
+                except (serial.SerialException, OSError):
+                    with self.lock:
+                        # With packets on, lost() holds whatever of it didn't get acked
+                        if not self.packets.enabled:
+                            self.queue.extendleft(reversed(frames))
+                        self.lost()
+                    return
+
+            with self.lock:
+                self.replayed_frames += len(frames)
+                self.replayed_bytes += sum(len(frame) for frame in frames)
+                if was_down:
+                    self.times.append(time.perf_counter() - self.lost_at)
+
+    def write(self, data):
+        with self.writing:
+            with self.lock:
+                if self.down or serial_port == "none":
+                    self.hold(data)
+                    return
+            try:
+                port_write(data)
+            except (serial.SerialException, OSError):
+                self.lost(data)
+
+    def stats(self) -> dict:
+        times = list(self.times)
+        return {'connected': serial_port != "none" and not self.down, 'disconnects': self.disconnects,
+                'reconnects': len(times), 'held_frames': len(self.queue), 'replayed_frames': self.replayed_frames,
+                'replayed_bytes': self.replayed_bytes, 'dropped_frames': self.dropped_frames,
+                'last_reconnect_time': times[-1] if times else None,
+                'max_reconnect_time': max(times) if times else None,
+                'mean_reconnect_time': sum(times) / len(times) if times else None}
+
+
+SUPERVISOR = Supervisor()
+
+
+# Counts of disconnects and frames replayed, and how long the reconnects took in seconds
+def reconnect_stats() -> dict:
+    return SUPERVISOR.stats()
+
+
+#############
+# DISCOVERY #
+#############
+# Every candidate port is asked to identify itself at the same time, so a station full of USB serial devices costs
+#   one timeout instead of one each. Boards that answered are cached on disk by USB serial number and aren't probed
+#   again. Ports that didn't answer aren't cached, since a board that was busy or still in its bootloader would never
+#   be asked again, so they're probed every time. Boards that answered are left open for connect(), since opening a
+#   port again resets the Arduino.
+
+# Opening a port resets most Arduinos, this covers the bootloader plus an answer (seconds)
+IDENTIFY_TIMEOUT = 2.0
+
+# How often the identify command is sent again while waiting (seconds)
+IDENTIFY_RETRY = 0.1
+
+IDENTIFY_PAYLOAD = struct.Struct('<HBBB')
+
+# Roles of ports in the cache. Boards can be given any other role (e.g. the bench they're on) with set_role().
+ROLE_BOARD = 'board'
+ROLE_OTHER = 'other'
+
+# Per user, so it's the same file wherever the program is run from
+DISCOVERY_CACHE = os.path.join(os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or
+                               os.path.join(os.path.expanduser('~'), '.cache'), 'pyduino', 'ports.json')
+
+# Ports left open by the last discover(), {port name: serial.Serial}
+PROBED_PORTS = {}
+
+# What the last discover() found on each port, {port name: PortInfo}
+PORT_INFOS = {}
+
+
+# What's on a port: a board's id, firmware version and devices, or nothing for something that isn't a board
+class PortInfo:
+
+    def __init__(self, port: str, serial_number: str = None, role: str = ROLE_OTHER, board: int = None,
+                 firmware: tuple = None, devices: list = ()):
+        self.port = port
+        self.serial_number = serial_number
+        self.role = role
+        self.board = board
+        self.firmware = firmware
+        self.devices = list(devices)
+
+    def is_board(self) -> bool:
+        return self.role != ROLE_OTHER
+
+    def __repr__(self):
+        if not self.is_board():
+            return str(self.port + ' (not a board)')
+        return str(self.port + ' (' + self.role + ' ' + str(self.board) + ', firmware ' +
+                   '.'.join(str(part) for part in self.firmware) + ', ' + ' '.join(self.devices) + ')')
+
+    def cache_entry(self) -> dict:
+        return {'role': self.role, 'board': self.board, 'firmware': self.firmware, 'devices': self.devices}
+
+
+def parse_identify(payload: bytes):
+    board, major, minor, mask = IDENTIFY_PAYLOAD.unpack(payload)
+    return board, (major, minor), [name for name, bit in BOARD_DEVICES.items() if mask & bit]
+
+
+# Sends a command straight down an open port (no reader running on it) until a frame of the given type comes back
+#   or the time is up. Returns the payload, None if it never came. Without retry the command is only sent once.
+def query(link, command: str, frame_type: int, timeout: float, retry: bool = True):
+    parser = FrameParser()
+    data = command.encode()
+    timeout_before = link.timeout
+    link.timeout = IDENTIFY_RETRY
+    deadline = time.perf_counter() + timeout
+    try:
+        link.write(data)
+        while time.perf_counter() < deadline:
+            for received_type, payload in parser.feed(link.read(max(1, link.in_waiting))):
+                if received_type == frame_type:
+                    return payload
+            if retry:
+                link.write(data)
+    except (serial.SerialException, OSError):
+        pass
+    finally:
+        link.timeout = timeout_before
+    return None
+
+
+# Opens a port and asks it to identify itself until it answers or the time is up. Returns the open port and the
+#   identify payload, or None for the port if it never answered (it gets closed).
+def probe_port(port: str, timeout: float = IDENTIFY_TIMEOUT):
+    try:
+        link = serial.Serial(port=port, baudrate=DEFAULT_BAUD, timeout=IDENTIFY_RETRY)
+    except (serial.SerialException, OSError):
+        return None, None
+
+    payload = query(link, BOARD_DEVICE.encode('identify'), FRAME_IDENTIFY, timeout)
+    if payload is not None:
+        return link, payload
+
+    link.close()
+    return None, None
+
+
+# Probes a list of ports all at once. Returns {port: identify payload or None}, and leaves the boards open in
+#   PROBED_PORTS.
+def identify_ports(ports: list, timeout: float = IDENTIFY_TIMEOUT) -> dict:
+    if not ports:
+        return {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        results = dict(zip(ports, executor.map(lambda port: probe_port(port, timeout), ports)))
+
+    answers = {}
+    for port, (link, payload) in results.items():
+        if link is not None:
+            PROBED_PORTS[port] = link
+        answers[port] = payload
+    return answers
+
+
+def load_discovery_cache(path: str = DISCOVERY_CACHE) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_discovery_cache(cache: dict, path: str = DISCOVERY_CACHE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(cache, file, indent=1, sort_keys=True)
+
+
+# Works out what's on every serial port, boards first. Boards with a USB serial number already in the cache are
+#   taken from it, the rest are probed together. refresh probes everything again.
+def discover(refresh: bool = False, timeout: float = IDENTIFY_TIMEOUT, path: str = DISCOVERY_CACHE) -> list:
+    global COM_PORTS_LIST
+
+    for link in PROBED_PORTS.values():
+        link.close()
+    PROBED_PORTS.clear()
+
+    cache = load_discovery_cache(path)
+    infos = []
+    unknown = {}
+    for p in serial.tools.list_ports.comports():
+        entry = cache.get(p.serial_number) if p.serial_number and not refresh else None
+
+        # Only boards that answered have firmware, anything else (e.g. just given a role) gets asked
+        if entry is None or not entry['firmware']:
+            unknown[p.device] = p.serial_number
+            continue
+        firmware = tuple(entry['firmware']) if entry['firmware'] else None
+        infos.append(PortInfo(p.device, p.serial_number, entry['role'], entry['board'], firmware, entry['devices']))
+
+    changed = False
+    for port, payload in identify_ports(list(unknown), timeout).items():
+        info = PortInfo(port, unknown[port])
+        role = cache.get(info.serial_number, {}).get('role', ROLE_OTHER)
+        if payload is not None:
+            info.board, info.firmware, info.devices = parse_identify(payload)
+            info.role = role if role != ROLE_OTHER else ROLE_BOARD
+        infos.append(info)
+        if not info.serial_number:
+            continue
+
+        # A role given with set_role() is kept for when it does answer, anything else it had is forgotten
+        if info.is_board():
+            cache[info.serial_number] = info.cache_entry()
+        elif role not in (ROLE_BOARD, ROLE_OTHER):
+            entry = PortInfo(port, role=role).cache_entry()
+            if cache.get(info.serial_number) == entry:
+                continue
+            cache[info.serial_number] = entry
+        elif cache.pop(info.serial_number, None) is None:
+            continue
+        changed = True
+
+    if changed:
+        save_discovery_cache(cache, path)
+
+    infos.sort(key=lambda info: (not info.is_board(), info.port))
+    COM_PORTS_LIST = [info.port for info in infos]
+    PORT_INFOS.clear()
+    PORT_INFOS.update((info.port, info) for info in infos)
+    return infos
+
+
+# Gives the board with a USB serial number a role of its own in the cache, e.g. set_role('5563...', 'dac bench')
+def set_role(serial_number: str, role: str, path: str = DISCOVERY_CACHE):
+    cache = load_discovery_cache(path)
+    cache.setdefault(serial_number, PortInfo(None).cache_entry())['role'] = role
+    save_discovery_cache(cache, path)
+
+
+###############
+# NEGOTIATION #
+###############
+# On connect the firmware is asked what it supports and the fastest settings both sides can do get used. Firmware
+#   from before this doesn't answer and gets the legacy protocol: 9600 baud and whole commands only.
+
+# Bumped whenever the command grammar changes in a way the firmware has to know about. Has to match the firmware.
+PROTOCOL_VERSION = 1
+
+DEFAULT_BAUD = 9600
+
+# Baud rates tried, fastest first that both sides can do. All of them are exact on a 16MHz AVR except 57600/115200.
+BAUD_RATES = (1000000, 500000, 250000, 115200, 57600, DEFAULT_BAUD)
+
+# Fastest the host will go, lower it for long or noisy cables
+MAX_BAUD = 1000000
+
+# How long to wait for the answer at the new baud before going back (the firmware goes back on its own after 1 s)
+BAUD_CONFIRM_TIMEOUT = 0.5
+BAUD_REVERT_TIME = 1.0
+
+# Bits of the features mask in a capabilities frame
+FEATURES = {'frames': 1, 'sequences': 2, 'registers': 4, 'readback': 8, 'telemetry': 16, 'baud': 32, 'credits': 64,
+            'packets': 128, 'simultaneous': 256, 'instances': 512,
+            'transactions': 1024, 'ramps': 2048}
+
+# Protocol version, max baud, serial receive buffer size, devices mask, features mask
+CAPABILITIES_PAYLOAD = struct.Struct('<BIHBH')
+
+
+class Capabilities:
+
+    def __init__(self, version: int, max_baud: int, rx_buffer: int, devices: list, features: list, baud: int = None):
+        self.version = version
+        self.max_baud = max_baud
+        self.rx_buffer = rx_buffer
+        self.devices = list(devices)
+        self.features = list(features)
+
+        # Baud actually in use
+        self.baud = DEFAULT_BAUD if baud is None else baud
+
+    @staticmethod
+    def unpack(payload: bytes):
+        version, max_baud, rx_buffer, devices, features = CAPABILITIES_PAYLOAD.unpack(payload)
+        return Capabilities(version, max_baud, rx_buffer, [name for name, bit in BOARD_DEVICES.items() if devices & bit],
+                            [name for name, bit in FEATURES.items() if features & bit])
+
+    def supports(self, feature: str) -> bool:
+        return feature in self.features
+
+    def legacy(self) -> bool:
+        return self.version == 0
+
+    def __repr__(self):
+        return str('Capabilities(version=' + str(self.version) + ', baud=' + str(self.baud) + '/' +
+                   str(self.max_baud) + ', rx_buffer=' + str(self.rx_buffer) + ', devices=' + str(self.devices) +
+                   ', features=' + str(self.features) + ')')
+
+
+# What the host can do, assumed until something's been negotiated (e.g. for emulators assigned to serial_port)
+HOST_CAPABILITIES = Capabilities(PROTOCOL_VERSION, MAX_BAUD, 64, list(BOARD_DEVICES), list(FEATURES))
+
+# Firmware that doesn't answer the capabilities query
+LEGACY_CAPABILITIES = Capabilities(0, DEFAULT_BAUD, 64, ['dac', 'dds'], [])
+
+# What the board on serial_port supports
+CAPABILITIES = HOST_CAPABILITIES
+
+
+# Asks the firmware on a freshly opened port what it supports and switches to the fastest baud both sides can do.
+#   Returns the Capabilities in use. The port is left at whatever baud that ended up being.
+def negotiate(link, timeout: float = IDENTIFY_TIMEOUT) -> Capabilities:
+    payload = query(link, BOARD_DEVICE.encode('capabilities'), FRAME_CAPABILITIES, timeout)
+    if payload is None:
+        return LEGACY_CAPABILITIES
+
+    capabilities = Capabilities.unpack(payload)
+    capabilities.version = min(capabilities.version, PROTOCOL_VERSION)
+    capabilities.features = [feature for feature in capabilities.features if feature in FEATURES]
+    if not capabilities.supports('baud'):
+        return capabilities
+
+    for baud in BAUD_RATES:
+        if baud <= min(capabilities.max_baud, MAX_BAUD):
+            break
+    if baud == link.baudrate:
+        capabilities.baud = baud
+        return capabilities
+
+    # Sent once, a retry could arrive after the firmware switched
+    answer = query(link, BOARD_DEVICE.encode('baud', baud), FRAME_BAUD, timeout, False)
+    if answer is None or struct.unpack('<I', answer)[0] != baud:
+        return capabilities
+
+    old_baud = link.baudrate
+    link.baudrate = baud
+    if query(link, BOARD_DEVICE.encode('capabilities'), FRAME_CAPABILITIES, BAUD_CONFIRM_TIMEOUT) is None:
+        link.baudrate = old_baud
+        time.sleep(BAUD_REVERT_TIME)
+        return capabilities
+
+    capabilities.baud = baud
+    return capabilities
+
+
+# Raises if the board doesn't support a feature something is about to use
+def require(feature: str):
+    if not CAPABILITIES.supports(feature):
+        raise RuntimeError(str('The firmware on ' + str(com_port) + " doesn't support " + feature))
+
+
+# Raises if a DAC or DDS instance can't be addressed
+def require_instance(instance: int, instances: int):
+    if not 0 <= instance < instances:
+        raise ValueError(str('No instance ' + str(instance) + ', a board has ' + str(instances)))
+    if instance:
+        require('instances')
+
+
+################
+# FLOW CONTROL #
+################
+# The Arduino only has a small serial receive buffer (64 bytes on an Uno) and stops reading it while a slow command
+#   runs (the DAC setup waits 100 ms), so anything sent past that is lost without a word. With flow control on, the
+#   board keeps sending back a running count of the bytes it has read (credit frames) and writes are paced so there
+#   are never more bytes in flight than the buffer holds. Counts wrap at 16 bits on both sides.
+
+CREDIT_PAYLOAD = struct.Struct('<H')
+
+# How long a write waits for credit before asking for it, in case a credit frame got lost (seconds)
+FLOW_POLL_TIMEOUT = 0.5
+
+# How long it waits before asking even if the buffer may be full, which risks a few bytes
+FLOW_STALL_TIMEOUT = 2.0
+
+
+class FlowControl:
+
+    def __init__(self):
+        self.enabled = False
+        self.window = 64
+        self.sent = 0
+        self.consumed = 0
+        self.condition = threading.Condition()
+
+        self.stalls = 0
+        self.stalled_time = 0.0
+        self.polls = 0
+
+    # Starts counting from nothing in flight, with the board's receive buffer size as the window
+    def reset(self, window: int):
+        with self.condition:
+            self.enabled = True
+            self.window = window
+            self.sent = 0
+            self.consumed = 0
+            self.condition.notify_all()
+
+    def disable(self):
+        with self.condition:
+            self.enabled = False
+            self.condition.notify_all()
+
+    # Credit frame handler, runs on the reader thread
+    def grant(self, payload: bytes):
+        with self.condition:
+            self.consumed = CREDIT_PAYLOAD.unpack(payload)[0]
+            self.condition.notify_all()
+
+    # Bytes that can be sent right now
+    def available(self) -> int:
+        return self.window - ((self.sent - self.consumed) & 0xFFFF)
+
+    # Writes data to the port in pieces no bigger than the credit there is, waiting for more as needed
+    def write(self, port, data):
+        view = memoryview(data).cast('B')
+        poll = BOARD_DEVICE.encode('credit').encode()
+        offset = 0
+
+        while offset < len(view):
+            with self.condition:
+                if self.enabled and self.available() <= 0:
+                    self.stalls += 1
+                    began = time.perf_counter()
+                    while self.enabled and self.available() <= 0:
+                        waited = time.perf_counter() - began
+                        if not self.condition.wait(FLOW_POLL_TIMEOUT) and (
+                                self.available() + len(poll) <= self.window or waited > FLOW_STALL_TIMEOUT):
+                            self.polls += 1
+                            self.sent = (self.sent + len(poll)) & 0xFFFF
+                            port.write(poll)
+                    self.stalled_time += time.perf_counter() - began
+
+                size = len(view) - offset
+                if self.enabled:
+                    size = min(size, self.available())
+                    self.sent = (self.sent + size) & 0xFFFF
+            port.write(view[offset:offset + size])
+            offset += size
+
+    def stats(self) -> dict:
+        return {'enabled': self.enabled, 'window': self.window, 'in_flight': (self.sent - self.consumed) & 0xFFFF,
+                'stalls': self.stalls, 'stalled_time': self.stalled_time, 'polls': self.polls}
+
+
+FLOW = FlowControl()
+
+
+# Turns flow control on for a freshly opened port (before the reader is started on it). Returns whether it worked.
+def enable_flow_control(link, window: int, timeout: float = IDENTIFY_TIMEOUT) -> bool:
+    FLOW.disable()
+    if query(link, BOARD_DEVICE.encode('flow', 1), FRAME_CREDIT, timeout, False) is None:
+        return False
+    FLOW.reset(window)
+    return True
+
+
+# Writes to the open port, in packets when they're on and paced by flow control when it's on
+def port_write(data):
+    if PACKETS.enabled:
+        PACKETS.write(data)
+    else:
+        link_write(data)
+
+
+# Writes straight to the open port, only paced by flow control
+def link_write(data):
+    if FLOW.enabled:
+        FLOW.write(serial_port, data)
+    else:
+        serial_port.write(data)
+
+
+###########
+# PACKETS #
+###########
+# A byte lost or mangled on the way merges two commands or changes a number, and nothing notices. With packets on,
+#   everything written goes out in packets the firmware checks before running anything in them:
+#   PACKET_START, sequence number, payload length, payload, CRC-16 of everything after PACKET_START (low byte first)
+# Commands can be split across packets, the firmware just runs the bytes of each good packet in order. It acks every
+#   packet, skips to the next start marker after a bad one, and naks when a packet turns up after one it never got.
+#   Unacked packets are sent again on a nak, or once the oldest has waited PACKET_ACK_TIMEOUT, and anything it has
+#   already run is only acked again. Frames coming back get a CRC as well (see FrameParser).
+#   emulator.PacketParser is the firmware's parser in Python, emulator.fuzz_packets() throws noise at both sides.
+
+PACKET_START = 0x5A
+PACKET_HEADER_SIZE = 3
+PACKET_MAX_PAYLOAD = 128
+
+# Most packets waiting on an ack. Has to stay under half of the 256 sequence numbers.
+PACKET_WINDOW = 64
+
+# How long the oldest unacked packet waits before everything unacked is sent again (seconds). Commands run before the
+#   packets behind them are read, so this has to cover the slowest one (the DAC setup takes 100 ms).
+PACKET_ACK_TIMEOUT = 0.5
+
+# Board number of bad packets and the sequence number it wants next, in a nak frame
+NAK_PAYLOAD = struct.Struct('<BH')
+
+
+def encode_packet(sequence: int, payload) -> bytes:
+    body = bytes([sequence, len(payload)]) + bytes(payload)
+    crc = crc16(body)
+    return bytes([PACKET_START]) + body + bytes([crc & 0xFF, crc >> 8])
+
+
+# Whether sequence number "first" comes at or before "last", for numbers that wrap at 256
+def sequence_before(first: int, last: int) -> bool:
+    return (last - first) & 0xFF < 128
+
+
+class PacketLink:
+
+    def __init__(self):
+        self.enabled = False
+        self.enabling = False
+        self.started = threading.Event()
+        self.next_sequence = 0
+        self.condition = threading.Condition()
+
+        # Packets written in order, so nothing gets between a packet and the ones sent again ahead of it
+        self.sending = threading.Lock()
+
+        # {sequence: (packet, time sent)} in the order they were sent
+        self.unacked = collections.OrderedDict()
+        self.resend = False
+
+        # What was left of writes that failed before it could be put in packets
+        self.unwritten = []
+        self.thread = None
+
+        # The port, flow control and supervisor it was turned on with, the retransmit thread keeps to them whichever
+        #   board the bridge has in the globals
+        self.port = None
+        self.flow = None
+        self.supervisor = None
+
+        self.packets = 0
+        self.retransmits = 0
+        self.naks = 0
+        self.timeouts = 0
+        self.board_crc_errors = 0
+
+    # Turns packets on for the open port once the reader is running on it. Returns whether the board agreed.
+    def enable(self, timeout: float = IDENTIFY_TIMEOUT) -> bool:
+        with self.condition:
+            self.enabled = False
+            self.enabling = True
+            self.unacked.clear()
+            self.resend = False
+            self.next_sequence = 0
+            self.started.clear()
+            self.port = serial_port
+            self.flow = FLOW
+            self.supervisor = SUPERVISOR
+
+        # The board's answer already comes with a CRC
+        if READER is not None:
+            READER.parser.crc = True
+        self.link_write(BOARD_DEVICE.encode('packets', 1).encode())
+        if not self.started.wait(timeout):
+            self.disable()
+            return False
+
+        with self.condition:
+            self.enabled = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='pyduino retransmit', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return True
+
+    def disable(self):
+        with self.condition:
+            self.enabled = False
+            self.enabling = False
+            self.unacked.clear()
+            self.condition.notify_all()
+        if READER is not None:
+            READER.parser.crc = False
+
+    # Splits data into packets and writes them, waiting while the window is full
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        for offset in range(0, len(view), PACKET_MAX_PAYLOAD):
+            with self.condition:
+                while self.enabled and len(self.unacked) >= PACKET_WINDOW:
+                    self.condition.wait(PACKET_ACK_TIMEOUT)
+
+            with self.sending:
+                with self.condition:
+                    sequence = self.next_sequence
+                    self.next_sequence = (sequence + 1) & 0xFF
+                    packet = encode_packet(sequence, view[offset:offset + PACKET_MAX_PAYLOAD])
+                    self.unacked[sequence] = (packet, time.perf_counter())
+                    self.packets += 1
+                try:
+                    self.link_write(packet)
+                except (serial.SerialException, OSError):
+                    with self.condition:
+                        self.unwritten.append(bytes(view[offset + PACKET_MAX_PAYLOAD:]))
+                    raise
+
+    # Writes to the port it was turned on with, only paced by flow control
+    def link_write(self, data):
+        if self.flow.enabled:
+            self.flow.write(self.port, data)
+        else:
+            self.port.write(data)
+
+    # Everything written that the board hasn't acked, in order, for holding until the port is back. None when packets
+    #   are off, since then there's no telling what got through.
+    def take_unsent(self):
+        with self.condition:
+            if not self.enabled and not self.unwritten:
+                return None
+            unsent = b''.join([packet[PACKET_HEADER_SIZE:-2] for packet, sent in self.unacked.values()] +
+                              self.unwritten)
+            self.unacked.clear()
+            self.unwritten.clear()
+            self.condition.notify_all()
+            return unsent
+
+    # Ack frame handler, runs on the reader thread. Acks count for every packet up to the one acked.
+    def ack(self, payload: bytes):
+        with self.condition:
+            if self.enabling:
+                self.enabling = False
+                self.started.set()
+                return
+            self.acknowledge(payload[0])
+
+    # Nak frame handler, runs on the reader thread
+    def nak(self, payload: bytes):
+        expected, crc_errors = NAK_PAYLOAD.unpack(payload)
+        with self.condition:
+            self.naks += 1
+            self.board_crc_errors = crc_errors
+            self.acknowledge((expected - 1) & 0xFF)
+            self.resend = True
+            self.condition.notify_all()
+
+    def acknowledge(self, sequence: int):
+        while self.unacked and sequence_before(next(iter(self.unacked)), sequence):
+            self.unacked.popitem(False)
+        self.condition.notify_all()
+
+    # Sends unacked packets again when a nak comes or the oldest one has waited too long. Runs on its own thread for as
+    #   long as the program does.
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.enabled and self.unacked:
+                        if self.resend:
+                            break
+                        waited = time.perf_counter() - next(iter(self.unacked.values()))[1]
+                        if waited >= PACKET_ACK_TIMEOUT:
+                            self.timeouts += 1
+                            break
+                        self.condition.wait(PACKET_ACK_TIMEOUT - waited)
+                    else:
+                        self.resend = False
+                        self.condition.wait()
+
+            with self.sending:
+                with self.condition:
+                    now = time.perf_counter()
+                    packets = [packet for packet, sent in self.unacked.values()]
+                    for sequence in self.unacked:
+                        self.unacked[sequence] = (self.unacked[sequence][0], now)
+                    self.resend = False
+                    self.retransmits += len(packets)
+                try:
+                    for packet in packets:
+                        self.link_write(packet)
+                except (serial.SerialException, OSError):
+                    self.supervisor.lost()
+                    self.disable()
+
+    # Waits until everything written so far has been acked. Returns whether it was.
+    def flush(self, timeout: float = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.enabled or not self.unacked, timeout)
+
+    def stats(self) -> dict:
+        return {'enabled': self.enabled, 'packets': self.packets, 'unacked': len(self.unacked),
+                'retransmits': self.retransmits, 'naks': self.naks, 'timeouts': self.timeouts,
+                'board_crc_errors': self.board_crc_errors,
+                'host_crc_errors': READER.parser.bad_frames if READER is not None else 0}
+
+
+PACKETS = PacketLink()
+SUPERVISOR.packets = PACKETS
 
 
 ###################################################
@@ -210,37 +1933,37 @@ class DDS:
     # Resets the dds to its initial software state (except for the default settings that I'm using, specifically
     #   turning off the sysclk divide by 2 because for whatever reason that's a software default)
     def create_reset_command():
-        reset_command = str(DDS_INDICATOR + DDS_RESET + DONE)
-        return reset_command
+        return DDS_DEVICE.commands['reset'].encode()
 
     @staticmethod
     # Sends the command to signify that the data in the registers needs to be loaded
     def create_load_command():
-        load_command = str(DDS_INDICATOR + DDS_LOAD + DONE)
-        return load_command
+        return DDS_DEVICE.commands['load'].encode()
 
     @staticmethod
     # Creates a command to disable the ramp functionality
     def create_disable_ramp_command():
-        disable_command = str(DDS_INDICATOR + DDS_OUTPUT + DDS_RAMP + DDS_RAMP_DISABLE + DONE)
-        return disable_command
+        return DDS_DEVICE.commands['disable_ramp'].encode()
 
     @staticmethod
     def create_ramp_setup_command(parameter: chr, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p):
-        working_string = str(DDS_INDICATOR + DDS_OUTPUT + DDS_RAMP + DDS_RAMP_SETUP)
-        ramp_setup = DDS.create_ramp_setup_string(parameter, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p)
-        working_string = str(working_string + ramp_setup)
-        working_string = str(working_string + DONE)
-        return working_string
+        words = DDS.calculate_ramp_setup_words(parameter, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p)
+        return DDS_DEVICE.commands['ramp_setup'].encode(parameter, *words)
+
+    @staticmethod
+    # Creates the ramp setup command from the register words of a RampPlan made by plan_ramp()
+    def create_ramp_plan_command(plan):
+        return DDS_DEVICE.commands['ramp_setup'].encode(plan.parameter, plan.lower_limit, plan.upper_limit,
+                                                        plan.decrement, plan.increment, plan.rate_n, plan.rate_p)
 
     @staticmethod
-    # Creates a string for the parameters of the DRG setup
-    def create_ramp_setup_string(parameter: chr, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p):
+    # Calculates the register words for the DRG setup
+    #   (lower_limit, upper_limit, decrement, increment, rate_n, rate_p)
+    def calculate_ramp_setup_words(parameter: chr, sysclk, reference, start, stop, decrement, increment, rate_n, rate_p):
 
         if parameter not in (DDS_FREQUENCY, DDS_PHASE, DDS_AMPLITUDE):
 
             raise ValueError('Invalid Parameter')
-            return ''
 
         drg_lower_limit = DDS.calculate_full_scale_binary(32, start, reference)
         drg_upper_limit = DDS.calculate_full_scale_binary(32, stop, reference)
@@ -249,51 +1972,145 @@ class DDS:
         drg_decrement = DDS.calculate_full_scale_binary(32, decrement, reference)
         drg_increment = DDS.calculate_full_scale_binary(32, increment, reference)
 
-        drg_rate_n = DDS.calculate_full_scale_binary(16, rate_n, (4 / sysclk) * (1 << 16))
-        drg_rate_p = DDS.calculate_full_scale_binary(16, rate_p, (4 / sysclk) * (1 << 16))
+        drg_rate_n = DDS.calculate_rate_word(rate_n, sysclk)
+        drg_rate_p = DDS.calculate_rate_word(rate_p, sysclk)
 
-        working_string = parameter
-        working_string = str(working_string + str(drg_lower_limit))
-        working_string = str(working_string + ',')
-        working_string = str(working_string + str(drg_upper_limit))
-        working_string = str(working_string + ',')
-        working_string = str(working_string + str(drg_decrement))
-        working_string = str(working_string + ',')
-        working_string = str(working_string + str(drg_increment))
-        working_string = str(working_string + ',')
-        working_string = str(working_string + str(drg_rate_n))
-        working_string = str(working_string + ',')
-        working_string = str(working_string + str(drg_rate_p))
+        return drg_lower_limit, drg_upper_limit, drg_decrement, drg_increment, drg_rate_n, drg_rate_p
 
-        return working_string
+    @staticmethod
+    # Picks the DRG words for a sweep from start to stop that takes roughly "duration" seconds without any single
+    #   step being bigger than "resolution" (both in the units of the reference, e.g. Hz for frequency ramps).
+    #   The DRG only knows a step size and how many SYNC_CLK cycles to wait between steps, so this searches the
+    #   rate words for the one whose whole number of steps lands closest to the desired duration. Returns a RampPlan
+    #   with the words, what the hardware will actually do, and the quantization errors.
+    def plan_ramp(parameter: chr, sysclk, reference, start, stop, duration, resolution):
+
+        if parameter not in (DDS_FREQUENCY, DDS_PHASE, DDS_AMPLITUDE):
+            raise ValueError('Invalid Parameter')
+        if stop <= start:
+            raise ValueError('Stop must be greater than start')
+        if start < 0 or stop >= reference:
+            raise ValueError('Start and stop must be between 0 and the reference')
+        if duration <= 0 or resolution <= 0:
+            raise ValueError('Duration and resolution must be positive')
+
+        # Nearest rather than floor so the ends land as close as possible to what was asked for
+        lower_limit = DDS.calculate_full_scale_binary(DDS_DRG_WORD_BITS, start, reference, DDS_ROUND_NEAREST)
+        upper_limit = DDS.calculate_full_scale_binary(DDS_DRG_WORD_BITS, stop, reference, DDS_ROUND_NEAREST)
+
+        # Values just under the reference can round up to a word that doesn't fit, which would carry into the other
+        #   limit once the two are packed into one register
+        lower_limit = min(lower_limit, (1 << DDS_DRG_WORD_BITS) - 1)
+        upper_limit = min(upper_limit, (1 << DDS_DRG_WORD_BITS) - 1)
+        span = max(upper_limit - lower_limit, 1)
+
+        # Biggest step allowed and so the fewest steps the ramp can be broken into
+        max_step = max(DDS.calculate_full_scale_binary(DDS_DRG_WORD_BITS, resolution, reference), 1)
+        min_steps = -(-span // max_step)
+
+        # Number of SYNC_CLK cycles that the whole sweep should take
+        cycles = duration * sysclk / DDS_DRG_SYNC_DIVIDER
+
+        # Rates that keep the step size between one LSB and the biggest step allowed
+        rate_low = max(math.ceil(cycles / span), 1)
+        rate_high = min(math.floor(cycles / min_steps), DDS_DRG_RATE_MAX)
+
+        # Too fast for the DRG at this resolution, or too slow even with single LSB steps
+        in_hardware = rate_low <= rate_high
+        if not in_hardware:
+            rate_low = rate_high = min(max(round(cycles / min_steps), 1), DDS_DRG_RATE_MAX)
+
+        # Smallest rates first since those give the finest steps, stops early on an exact fit. The step can only be a
+        #   whole number of LSBs, so both neighbours of the ideal step get tried for every rate.
+        best = None
+        for rate in range(rate_low, min(rate_high, rate_low + DDS_DRG_PLAN_SEARCH - 1) + 1):
+            ideal_step = span * rate / cycles
+            for step in {math.floor(ideal_step), math.ceil(ideal_step)}:
+                step = min(max(step, 1), max_step)
+                steps = -(-span // step)
+                error = abs(steps * rate - cycles)
+                if best is None or error < best[0]:
+                    best = (error, rate, step, steps)
+            if best[0] < 1:
+                break
+
+        error, rate, step, steps = best
+
+        return RampPlan(parameter, lower_limit, upper_limit, step, rate, steps, in_hardware,
+                        reference, sysclk, start, stop, duration)
 
     @staticmethod
     # literally just works the same as the single tone because I'm using the same method to take care of it, it's just
     #   that the one parameter that you are ramping can be zero as it will get overridden by the ramp anyways
     def create_ramp_parameters_command(amplitude, ref_amplitude, phase, frequency, freq_sysclk):
-        working_string = str(DDS_INDICATOR + DDS_OUTPUT + DDS_RAMP + DDS_RAMP_PARAMETERS)
-        parameters = DDS.create_parameters_string(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
-        working_string = str(working_string + parameters)
-        working_string = str(working_string + DONE)
-        return working_string
+        words = DDS.calculate_parameters_words(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
+        return DDS_DEVICE.commands['ramp_parameters'].encode(*words)
 
     @staticmethod
     # Creates a string for a proper single tone command to send to the Arduino
     def create_single_tone_command(amplitude, ref_amplitude, phase, frequency, freq_sysclk):
-        working_string = str(DDS_INDICATOR + DDS_OUTPUT + DDS_SINGLE_TONE)
-        parameters = DDS.create_parameters_string(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
-        working_string = str(working_string + parameters)
-        working_string = str(working_string + DONE)
-        return working_string
+        words = DDS.calculate_parameters_words(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
+        return DDS_DEVICE.commands['single_tone'].encode(*words)
+
+    @staticmethod
+    # Calculates the parameter words for setting amplitude, phase, and frequency
+    #   (amplitude_scale_factor, phase_offset_word, frequency_tuning_word)
+    def calculate_parameters_words(amplitude, ref_amplitude, phase, frequency, freq_sysclk):
+        amp = DDS.calculate_amplitude_binary(amplitude, ref_amplitude)
+        phs = DDS.calculate_phase_binary(phase)
+        freq = DDS.calculate_frequency_binary(frequency, freq_sysclk)
+        return amp, phs, freq
+
+    ###################
+    # SHADOWED WRITES #
+    ###################
+    # These return the commands for a write after checking it against DDS_SHADOW, so only what changed goes out
+
+    @staticmethod
+    # Command that writes one whole register with an already calculated value
+    def create_register_command(register: int, value: int, instance: int = 0):
+        return DDS_DEVICE.instance(instance).commands['register'].encode(register, value >> 32, value & 0xFFFFFFFF)
+
+    @staticmethod
+    # Registers written by a ramp setup, the same values the Arduino builds out of the command
+    def ramp_setup_registers(parameter: chr, lower_limit, upper_limit, decrement, increment, rate_n, rate_p) -> dict:
+        return {DDS_RAMP_LIMIT_REGISTER: (lower_limit << 32) + upper_limit,
+                DDS_RAMP_STEP_SIZE_REGISTER: (decrement << 32) + increment,
+                DDS_RAMP_RATE_REGISTER: (rate_n << 16) + rate_p,
+                DDS_CFR2_REGISTER: DDS_CFR2_RAMP_ENABLE + (DDS_RAMP_DESTINATIONS[parameter] << 20)}
+
+    @staticmethod
+    def shadow_ramp_setup_commands(parameter: chr, lower_limit, upper_limit, decrement, increment, rate_n, rate_p,
+                                   instance: int = 0):
+        registers = DDS.ramp_setup_registers(parameter, lower_limit, upper_limit, decrement, increment, rate_n, rate_p)
+        command = DDS_DEVICE.instance(instance).commands['ramp_setup'].encode(parameter, lower_limit, upper_limit,
+                                                                              decrement, increment, rate_n, rate_p)
+        return DDS_SHADOWS[instance].write(registers, command,
+                                           functools.partial(DDS.create_register_command, instance=instance))
+
+    @staticmethod
+    # Single tones and ramp parameters both end up in the profile 0 register
+    def shadow_profile_commands(command_name: str, amplitude_word, phase_word, frequency_word, instance: int = 0):
+        registers = {DDS_PROFILE_0_REGISTER: (amplitude_word << 48) + (phase_word << 32) + frequency_word}
+        command = DDS_DEVICE.instance(instance).commands[command_name].encode(amplitude_word, phase_word,
+                                                                             frequency_word)
+        return DDS_SHADOWS[instance].write(registers, command,
+                                           functools.partial(DDS.create_register_command, instance=instance))
 
     @staticmethod
-    # Calculates the parameter words for setting amplitude, phase, and frequency, and then converts them to a usable
-    #   string to send in a command
-    def create_parameters_string(amplitude, ref_amplitude, phase, frequency, freq_sysclk):
-        amp = str(DDS.calculate_amplitude_binary(amplitude, ref_amplitude))
-        phs = str(DDS.calculate_phase_binary(phase))
-        freq = str(DDS.calculate_frequency_binary(frequency, freq_sysclk))
-        return str(amp + ',' + phs + ',' + freq)
+    def shadow_disable_ramp_commands(instance: int = 0):
+        registers = {DDS_CFR2_REGISTER: DDS_CFR2_DEFAULT}
+        return DDS_SHADOWS[instance].write(registers, DDS_DEVICE.instance(instance).encode('disable_ramp'),
+                                           functools.partial(DDS.create_register_command, instance=instance))
+
+    @staticmethod
+    # Only loads if something was written since the last load. IO_UPDATE is shared, so one load does every DDS.
+    def shadow_load_commands():
+        if not any(shadow.staged for shadow in DDS_SHADOWS):
+            return []
+        for shadow in DDS_SHADOWS:
+            shadow.staged = False
+        return [DDS.create_load_command()]
 
     # Commands for calculating the binary integer equivalents for sending to the registers
     @staticmethod
@@ -313,12 +2130,192 @@ class DDS:
         return frequency_tuning_word
 
     # I made an abstraction so prof Ben Lerner will be happy with me and I can say I'm using what I learned in fundies
+    #   Done in exact integers, since a float product loses the bottom bits of a 32 bit word and truncates results
+    #   that should be whole numbers (1 us at 1 GHz used to come out as 249 SYNC_CLK cycles instead of 250).
+    @staticmethod
+    def calculate_full_scale_binary(num_of_bits, desired, full_scale, rounding: str = DDS_ROUND_FLOOR):
+        desired_numerator, desired_denominator = DDS.exact_ratio(desired)
+        scale_numerator, scale_denominator = DDS.exact_ratio(full_scale)
+        numerator = (desired_numerator * scale_denominator) << num_of_bits
+        denominator = desired_denominator * scale_numerator
+
+        if rounding == DDS_ROUND_NEAREST:
+            return (2 * numerator + denominator) // (2 * denominator)
+        return numerator // denominator
+
+    @staticmethod
+    # Number of SYNC_CLK cycles (sysclk / 4) in "seconds", the DRG ramp rate word
+    def calculate_rate_word(seconds, sysclk, rounding: str = DDS_ROUND_FLOOR):
+        seconds_numerator, seconds_denominator = DDS.exact_ratio(seconds)
+        sysclk_numerator, sysclk_denominator = DDS.exact_ratio(sysclk)
+        numerator = seconds_numerator * sysclk_numerator
+        denominator = seconds_denominator * sysclk_denominator * DDS_DRG_SYNC_DIVIDER
+
+        if rounding == DDS_ROUND_NEAREST:
+            return (2 * numerator + denominator) // (2 * denominator)
+        return numerator // denominator
+
+    @staticmethod
+    # A value as numerator, denominator. Floats are taken as the decimal they print as (1e-06 is 1/1000000, not the
+    #   binary fraction just under it), which is what was typed into the GUI or code in the first place. Integers and
+    #   fractions of any type (e.g. numpy.int64 out of an array) are exact, anything else goes through float.
+    #   Cached since the same clocks and full scales come through on every call.
+    @functools.lru_cache(maxsize=1024)
+    def exact_ratio(value):
+        if isinstance(value, numbers.Integral):
+            return operator.index(value), 1
+        if isinstance(value, numbers.Rational):
+            return operator.index(value.numerator), operator.index(value.denominator)
+        if isinstance(value, decimal.Decimal):
+            return value.as_integer_ratio()
+        return decimal.Decimal(repr(float(value))).as_integer_ratio()
+
+    @staticmethod
+    # calculate_full_scale_binary() for a whole array. Works it out in floats and then redoes the few values that
+    #   land so close to a rounding boundary that the float result could be on the wrong side of it exactly.
+    def calculate_full_scale_binary_array(num_of_bits, desired, full_scale, rounding: str = DDS_ROUND_FLOOR):
+        desired = numpy.asarray(desired, dtype=numpy.float64)
+        scaled = desired * (float(1 << num_of_bits) / full_scale)
+
+        if rounding == DDS_ROUND_NEAREST:
+            words = numpy.floor(scaled + 0.5)
+            boundary = numpy.abs(scaled - numpy.floor(scaled) - 0.5)
+        else:
+            words = numpy.floor(scaled)
+            boundary = numpy.abs(scaled - numpy.rint(scaled))
+        words = words.astype(numpy.int64)
+
+        for index in numpy.flatnonzero(boundary <= numpy.abs(scaled) * 1e-12 + 1e-9).tolist():
+            words[index] = DDS.calculate_full_scale_binary(num_of_bits, float(desired[index]), full_scale, rounding)
+
+        return words
+
     @staticmethod
-    def calculate_full_scale_binary(num_of_bits, desired, full_scale):
-        bits = 1 << num_of_bits
-        fraction = desired / full_scale
-        word = int(fraction * bits)
-        return word
+    # What a register word actually puts out, the reverse of calculate_full_scale_binary(). Works on arrays too.
+    def calculate_full_scale_value(num_of_bits, word, full_scale):
+        if isinstance(word, numpy.ndarray):
+            return word * (full_scale / (1 << num_of_bits))
+        return word * full_scale / (1 << num_of_bits)
+
+    @staticmethod
+    # The frequencies the DDS can really make that are closest to the ones given, e.g. to plan around
+    def calculate_actual_frequencies(frequencies, freq_sysclk):
+        words = DDS.calculate_full_scale_binary_array(32, frequencies, freq_sysclk, DDS_ROUND_NEAREST)
+        return DDS.calculate_full_scale_value(32, words, freq_sysclk)
+
+
+# Result of DDS.plan_ramp(). Holds the DRG register words and what they actually turn into on the hardware.
+#   The ramp is symmetric, so the decrement and negative rate match the increment and positive rate.
+class RampPlan:
+
+    def __init__(self, parameter: chr, lower_limit: int, upper_limit: int, step: int, rate: int, steps: int,
+                 in_hardware: bool, reference, sysclk, start, stop, duration):
+        self.parameter = parameter
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.increment = step
+        self.decrement = step
+        self.rate_p = rate
+        self.rate_n = rate
+        self.steps = steps
+
+        # False when the DRG can't do the sweep (too fast at this resolution or too slow), so it has to be streamed
+        self.in_hardware = in_hardware
+
+        # What the hardware will actually put out
+        self.actual_start = DDS.calculate_full_scale_value(DDS_DRG_WORD_BITS, lower_limit, reference)
+        self.actual_stop = DDS.calculate_full_scale_value(DDS_DRG_WORD_BITS, upper_limit, reference)
+        self.actual_step = DDS.calculate_full_scale_value(DDS_DRG_WORD_BITS, step, reference)
+        self.actual_step_time = rate * DDS_DRG_SYNC_DIVIDER / sysclk
+        self.actual_duration = steps * self.actual_step_time
+
+        # Quantization errors (actual - desired)
+        self.start_error = self.actual_start - start
+        self.stop_error = self.actual_stop - stop
+        self.duration_error = self.actual_duration - duration
+
+    def __repr__(self):
+        return str('RampPlan(' + self.parameter + ', steps=' + str(self.steps) + ', step=' + str(self.actual_step) +
+                   ', duration=' + str(self.actual_duration) + ', in_hardware=' + str(self.in_hardware) + ')')
+
+
+# Named DRG ramps, worked out once and kept as the register writes they turn into, so switching to one only costs the
+#   registers that differ from what the DDS has. Ramps stored on the board (up to DDS_RAMP_SLOTS, the least recently
+#   used one making room) are switched to with one short select command instead.
+class RampLibrary:
+
+    def __init__(self):
+        self.setups = {}
+        self.registers = {}
+        self.encoded = {}
+
+        # Slot on the board each stored ramp is in, least recently used first
+        self.slots = collections.OrderedDict()
+
+    def __contains__(self, name) -> bool:
+        return name in self.registers
+
+    def names(self) -> list:
+        return list(self.registers)
+
+    # Adds (or replaces) a ramp from DRG setup words, see DDS.calculate_ramp_setup_words()
+    def add(self, name, parameter: chr, lower_limit, upper_limit, decrement, increment, rate_n, rate_p):
+        setup = (parameter, lower_limit, upper_limit, decrement, increment, rate_n, rate_p)
+        if self.setups.get(name) == setup:
+            return
+        self.setups[name] = setup
+        self.registers[name] = DDS.ramp_setup_registers(*setup)
+        for key in [key for key in self.encoded if key[0] == name]:
+            del self.encoded[key]
+        self.slots.pop(name, None)
+
+    def add_plan(self, name, plan):
+        self.add(name, plan.parameter, plan.lower_limit, plan.upper_limit, plan.decrement, plan.increment,
+                 plan.rate_n, plan.rate_p)
+
+    # Commands that keep a ramp on the board, in a free slot or the least recently used one
+    def store_commands(self, name) -> list:
+        require('ramps')
+        if name in self.slots:
+            return []
+        used = set(self.slots.values())
+        free = [slot for slot in range(DDS_RAMP_SLOTS) if slot not in used]
+        slot = free[0] if free else self.slots.popitem(last=False)[1]
+        self.slots[name] = slot
+
+        rows = [(slot, register, value >> 32, value & 0xFFFFFFFF)
+                for register, value in self.registers[name].items()]
+        return [DDS_DEVICE.encode('store_ramp', rows)]
+
+    # Commands that switch a DDS to a ramp, nothing if it already has it. Still needs a load like any other write.
+    def select_commands(self, name, instance: int = 0) -> list:
+        registers = self.registers[name]
+        shadow = DDS_SHADOWS[instance]
+        changed = shadow.diff(registers)
+        if not changed:
+            return []
+        shadow.registers.update(changed)
+        shadow.staged = True
+
+        if name in self.slots and len(changed) > 1:
+            self.slots.move_to_end(name)
+            return [DDS_DEVICE.instance(instance).encode('select_ramp', self.slots[name])]
+        if not CAPABILITIES.supports('registers'):
+            return [DDS_DEVICE.instance(instance).encode('ramp_setup', *self.setups[name])]
+
+        encoded = self.encoded.get((name, instance))
+        if encoded is None:
+            encoded = {register: DDS.create_register_command(register, value, instance)
+                       for register, value in registers.items()}
+            self.encoded[(name, instance)] = encoded
+        return [encoded[register] for register in changed]
+
+    # The board lost its stored ramps (it was reset or reconnected)
+    def forget_slots(self):
+        self.slots.clear()
+
+
+RAMP_LIBRARY = RampLibrary()
 
 
 #################
@@ -335,30 +2332,82 @@ class DAC:
     # Returns a formatted string command that can be sent
     def create_voltage_command(address: chr, desired_voltage: float,
                              reference_voltage: float, gain: float, bipolar: bool) -> str:
-        instructions = str(DAC_INDICATOR + DAC_WRITE + address)
-
-        data = str(DAC.calculate_bits(desired_voltage, reference_voltage, gain, bipolar))
+        if address == DAC_2 and DAC.calibrated(address):
+            return str(DAC.create_voltage_command(DAC_A, desired_voltage, reference_voltage, gain, bipolar) +
+                       DAC.create_voltage_command(DAC_B, desired_voltage, reference_voltage, gain, bipolar))
+        data = DAC.calculate_bits(desired_voltage, reference_voltage, gain, bipolar, address)
+        return DAC_DEVICE.commands['write'].encode(address, data)
 
-        command = str(instructions + data + DONE)
-
-        return command
+    @staticmethod
+    # Name of an output of one of the DACs, which its calibration is kept under: 'a' for output A of the first one,
+    #   '1a' for output A of the second
+    def output_name(address: chr, instance: int = 0) -> str:
+        return address if not instance else str(str(instance) + address)
 
     @staticmethod
-    # Calculates the integer for the DAC to use
-    def calculate_bits(desired_voltage: float, reference_voltage: float, gain: float, bipolar: bool) -> int:
+    # Calculates the integer for the DAC to use, corrected with the output's calibration if it has one
+    def calculate_bits(desired_voltage: float, reference_voltage: float, gain: float, bipolar: bool,
+                       address: chr = None) -> int:
+        calibration = DAC_CALIBRATIONS.get(address)
+        if calibration is not None:
+            desired_voltage = (desired_voltage - calibration.offset) / calibration.gain
+
         if bipolar:
             fraction = (desired_voltage + gain * reference_voltage) / (2 * reference_voltage) / gain
         else:
             fraction = (desired_voltage / reference_voltage) / gain
 
         # Bitwise operators in python are a goddamn sin i just want my fixed variable sizes why is that a problem smh
-        data = int(fraction * (1 << DAC_BITS)) * (1 << (DAC_MAX_BITS - DAC_BITS))
+        code = int(fraction * (1 << DAC_BITS))
+        if calibration is not None:
+            code = int(calibration.table[min(max(code, 0), DAC_CODES - 1)])
+        data = code * (1 << (DAC_MAX_BITS - DAC_BITS))
 
         return data
 
+    @staticmethod
+    # calculate_bits() for a whole array of voltages at once
+    def calculate_bits_array(desired_voltages, reference_voltage: float, gain: float, bipolar: bool,
+                             address: chr = None):
+        voltages = numpy.asarray(desired_voltages, dtype=numpy.float64)
+        calibration = DAC_CALIBRATIONS.get(address)
+        if calibration is not None:
+            voltages = (voltages - calibration.offset) / calibration.gain
+
+        if bipolar:
+            fractions = (voltages + gain * reference_voltage) / (2 * reference_voltage) / gain
+        else:
+            fractions = (voltages / reference_voltage) / gain
+
+        codes = numpy.trunc(fractions * (1 << DAC_BITS)).astype(numpy.int64)
+        if calibration is not None:
+            codes = calibration.table[numpy.clip(codes, 0, DAC_CODES - 1)]
+        return codes << (DAC_MAX_BITS - DAC_BITS)
+
+    @staticmethod
+    # The ideal output voltage of a DAC code (DAC_BITS wide), works on arrays too
+    def code_to_voltage(code, reference_voltage: float, gain: float, bipolar: bool):
+        if bipolar:
+            return numpy.asarray(code) / (1 << DAC_BITS) * 2 * reference_voltage * gain - gain * reference_voltage
+        return numpy.asarray(code) / (1 << DAC_BITS) * reference_voltage * gain
+
+    @staticmethod
+    # Whether writing to both outputs needs a separate value for each because they're calibrated differently
+    def calibrated(address: chr, instance: int = 0) -> bool:
+        if address == DAC_2:
+            return (DAC.output_name(DAC_A, instance) in DAC_CALIBRATIONS or
+                    DAC.output_name(DAC_B, instance) in DAC_CALIBRATIONS)
+        return DAC.output_name(address, instance) in DAC_CALIBRATIONS
+
     @staticmethod
     # Sends a setup command
     def create_initialization_command(is_bipolar: bool, gain: str):
+        polarity, gain = DAC.calculate_setup_codes(is_bipolar, gain)
+        return DAC_DEVICE.commands['setup'].encode(polarity, gain)
+
+    @staticmethod
+    # Returns the polarity and gain characters for a setup command
+    def calculate_setup_codes(is_bipolar: bool, gain: str):
         # Finite state machine for polarity and gain
         if is_bipolar:
             polarity = DAC_BIPOLAR
@@ -372,8 +2421,661 @@ class DAC:
         elif str(gain) == '4.32':
             gain = DAC_GAIN_432
 
-        command = str(DAC_INDICATOR + DAC_START + polarity + gain + DONE)
-        return command
+        return polarity, gain
+
+    ###################
+    # SHADOWED WRITES #
+    ###################
+    # These return the commands for a write after checking it against DAC_SHADOW, so only what changed goes out.
+    #   Registers are keyed by (register, channel).
+
+    @staticmethod
+    def create_register_command(register: tuple, value: int, instance: int = 0):
+        return DAC_DEVICE.instance(instance).commands['register'].encode(register[0], register[1], value)
+
+    @staticmethod
+    # Registers written by the setup command
+    def setup_registers(is_bipolar: bool, gain: str) -> dict:
+        polarity, gain = DAC.calculate_setup_codes(is_bipolar, gain)
+        output_range = DAC_RANGES[(polarity, gain)]
+        return {(DAC_RANGE_REGISTER, DAC_CHANNELS[DAC_A]): output_range,
+                (DAC_RANGE_REGISTER, DAC_CHANNELS[DAC_B]): output_range,
+                (DAC_CONTROL_REGISTER, DAC_CONTROL_TOGGLES): DAC_TOGGLES_DEFAULT,
+                (DAC_POWER_REGISTER, 0): DAC_POWER_DEFAULT}
+
+    @staticmethod
+    def shadow_initialization_commands(is_bipolar: bool, gain: str, instance: int = 0):
+        polarity, gain_code = DAC.calculate_setup_codes(is_bipolar, gain)
+        return DAC_SHADOWS[instance].write(DAC.setup_registers(is_bipolar, gain),
+                                           DAC_DEVICE.instance(instance).encode('setup', polarity, gain_code),
+                                           functools.partial(DAC.create_register_command, instance=instance))
+
+    @staticmethod
+    # Writing to both outputs counts as writing to A and B
+    def shadow_voltage_commands(address: chr, desired_voltage: float, reference_voltage: float, gain: float,
+                                bipolar: bool, instance: int = 0):
+        if address == DAC_2 and DAC.calibrated(address, instance):
+            return (DAC.shadow_voltage_commands(DAC_A, desired_voltage, reference_voltage, gain, bipolar, instance) +
+                    DAC.shadow_voltage_commands(DAC_B, desired_voltage, reference_voltage, gain, bipolar, instance))
+
+        data = DAC.calculate_bits(desired_voltage, reference_voltage, gain, bipolar,
+                                  DAC.output_name(address, instance))
+        if address == DAC_2:
+            channels = (DAC_CHANNELS[DAC_A], DAC_CHANNELS[DAC_B])
+        else:
+            channels = (DAC_CHANNELS[address],)
+
+        registers = {}
+        for channel in channels:
+            registers[(DAC_DATA_REGISTER, channel)] = data
+
+        return DAC_SHADOWS[instance].write(registers, DAC_DEVICE.instance(instance).encode('write', address, data),
+                                           functools.partial(DAC.create_register_command, instance=instance))
+
+    @staticmethod
+    # The data registers out of {address: voltage} that differ from what the DAC has, {channel: data}, recorded as
+    #   written
+    def shadow_data(voltages: dict, reference_voltage: float, gain: float, bipolar: bool, instance: int = 0) -> dict:
+        registers = {}
+        for address, desired_voltage in voltages.items():
+            for output in ((DAC_A, DAC_B) if address == DAC_2 else (address,)):
+                data = DAC.calculate_bits(desired_voltage, reference_voltage, gain, bipolar,
+                                          DAC.output_name(output, instance))
+                registers[(DAC_DATA_REGISTER, DAC_CHANNELS[output])] = data
+
+        changed = DAC_SHADOWS[instance].diff(registers)
+        DAC_SHADOWS[instance].registers.update(changed)
+        return {channel: data for (register, channel), data in changed.items()}
+
+    @staticmethod
+    # A plain write for every channel, for firmware that can't load them together
+    def create_channel_write_commands(channels: dict, instance: int = 0) -> list:
+        addresses = {channel: address for address, channel in DAC_CHANNELS.items()}
+        write = DAC_DEVICE.instance(instance).commands['write']
+        return [write.encode(addresses[channel], data) for channel, data in channels.items()]
+
+    @staticmethod
+    # Voltages for several outputs ({address: voltage}) as one command that loads them all on the same LDAC edge, with
+    #   only the channels that changed in it. Firmware without it gets a write for each instead.
+    def shadow_simultaneous_commands(voltages: dict, reference_voltage: float, gain: float, bipolar: bool,
+                                     instance: int = 0):
+        changed = DAC.shadow_data(voltages, reference_voltage, gain, bipolar, instance)
+        if not changed:
+            return []
+        if not CAPABILITIES.supports('simultaneous'):
+            return DAC.create_channel_write_commands(changed, instance)
+        return [DAC_DEVICE.instance(instance).encode('write_together', list(changed.items()))]
+
+    @staticmethod
+    # The same for every DAC on the board at once, {instance: {address: voltage}}: each DAC's changes get staged, then
+    #   one LDAC edge loads all of them
+    def shadow_bulk_commands(voltages: dict, reference_voltage: float, gain: float, bipolar: bool):
+        commands = []
+        for instance, instance_voltages in voltages.items():
+            changed = DAC.shadow_data(instance_voltages, reference_voltage, gain, bipolar, instance)
+            if not changed:
+                continue
+            if not CAPABILITIES.supports('simultaneous'):
+                commands += DAC.create_channel_write_commands(changed, instance)
+            else:
+                commands.append(DAC_DEVICE.instance(instance).encode('stage', list(changed.items())))
+
+        if commands and CAPABILITIES.supports('simultaneous'):
+            commands.append(DAC_DEVICE.encode('ldac'))
+        return commands
+
+    ############
+    # READBACK #
+    ############
+    # Registers are (register, channel) like in DAC_SHADOW
+
+    @staticmethod
+    # Every register that gets set up, both outputs' data included
+    def readback_registers() -> list:
+        return [(DAC_DATA_REGISTER, DAC_CHANNELS[DAC_A]), (DAC_DATA_REGISTER, DAC_CHANNELS[DAC_B]),
+                (DAC_RANGE_REGISTER, DAC_CHANNELS[DAC_A]), (DAC_RANGE_REGISTER, DAC_CHANNELS[DAC_B]),
+                (DAC_POWER_REGISTER, 0), (DAC_CONTROL_REGISTER, DAC_CONTROL_TOGGLES)]
+
+    @staticmethod
+    # Read commands for a list of registers, DAC_READBACK_BATCH to a command since each one is answered by one frame
+    def create_read_commands(registers: list, instance: int = 0) -> list:
+        command = DAC_DEVICE.instance(instance).commands['read_registers']
+        return [command.encode(registers[start:start + DAC_READBACK_BATCH])
+                for start in range(0, len(registers), DAC_READBACK_BATCH)]
+
+    @staticmethod
+    # {(register, channel): value} out of the readback frames
+    def parse_readback(payloads: list) -> dict:
+        registers = {}
+        for payload in payloads:
+            for start in range(0, len(payload) - 2, 3):
+                header = payload[start]
+                registers[(header >> 3, header & 0x7)] = payload[start + 1] | (payload[start + 2] << 8)
+        return registers
+
+    @staticmethod
+    # The registers that didn't read back what was expected, as {(register, channel): (expected, read)}
+    def readback_mismatches(readback: dict, expected: dict) -> dict:
+        mismatches = {}
+        for register, value in expected.items():
+            mask = DAC_READBACK_MASKS[register[0]]
+            read = readback.get(register)
+            if read is None or (read & mask) != (value & mask):
+                mismatches[register] = (value, read)
+        return mismatches
+
+
+###################
+# DAC CALIBRATION #
+###################
+# Corrections for how far each output is from the ideal transfer function, measured with calibrate_dac() in the
+#   controller. The measured output is modeled as gain * ideal + offset, plus an optional integral nonlinearity (INL)
+#   in LSBs for every code. Everything is compiled into a lookup table from the code that's wanted to the code that
+#   gets there, so a calibrated conversion costs one division and one index.
+
+# Calibration of each output of the board in use, by DAC.output_name() ('a' and 'b' for the first DAC)
+DAC_CALIBRATIONS = {}
+
+
+class Calibration:
+
+    def __init__(self, gain: float = 1.0, offset: float = 0.0, inl=None):
+        self.gain = gain
+        self.offset = offset
+        self.inl = None if inl is None else numpy.asarray(inl, dtype=numpy.float64)
+        self.table = self.compile()
+
+    # For every code, the code whose actual output (code + INL) comes closest to it. Assumes the DAC is monotonic.
+    def compile(self):
+        codes = numpy.arange(DAC_CODES)
+        if self.inl is None:
+            return codes
+
+        actual = numpy.maximum.accumulate(codes + self.inl)
+        above = numpy.clip(numpy.searchsorted(actual, codes), 0, DAC_CODES - 1)
+        below = numpy.clip(above - 1, 0, DAC_CODES - 1)
+        closer_below = numpy.abs(actual[below] - codes) < numpy.abs(actual[above] - codes)
+        return numpy.where(closer_below, below, above)
+
+    # Fits a calibration to the voltages measured for a set of codes
+    @staticmethod
+    def fit(codes, measured, reference_voltage: float, gain: float, bipolar: bool, inl: bool = True):
+        codes = numpy.asarray(codes)
+        measured = numpy.asarray(measured, dtype=numpy.float64)
+        ideal = DAC.code_to_voltage(codes, reference_voltage, gain, bipolar)
+        fit_gain, fit_offset = numpy.polyfit(ideal, measured, 1)
+
+        if not inl:
+            return Calibration(float(fit_gain), float(fit_offset))
+
+        # Whatever the straight line doesn't explain, in LSBs, spread over every code
+        lsb = (DAC.code_to_voltage(1, reference_voltage, gain, bipolar) -
+               DAC.code_to_voltage(0, reference_voltage, gain, bipolar)) * fit_gain
+        residual = (measured - (fit_gain * ideal + fit_offset)) / lsb
+        return Calibration(float(fit_gain), float(fit_offset), numpy.interp(numpy.arange(DAC_CODES), codes, residual))
+
+
+# Name of the calibration file for a board, by its USB serial number (the board in use if none is given)
+def calibration_path(board: str = None) -> str:
+    if board is None:
+        board = 'unknown'
+        for port in serial.tools.list_ports.comports():
+            if port.device == com_port and port.serial_number:
+                board = port.serial_number
+    return str('calibration_' + board + '.npz')
+
+
+def save_calibrations(path: str = None):
+    if path is None:
+        path = calibration_path()
+
+    arrays = {}
+    for address, calibration in DAC_CALIBRATIONS.items():
+        arrays[str(address + '_gain')] = calibration.gain
+        arrays[str(address + '_offset')] = calibration.offset
+        if calibration.inl is not None:
+            arrays[str(address + '_inl')] = calibration.inl
+    numpy.savez(path, **arrays)
+
+
+# Replaces the calibrations in use with the ones saved for a board
+def load_calibrations(path: str = None):
+    if path is None:
+        path = calibration_path()
+
+    DAC_CALIBRATIONS.clear()
+    with numpy.load(path) as arrays:
+        for address in [DAC.output_name(output, instance) for instance in range(DAC_INSTANCES)
+                        for output in (DAC_A, DAC_B)]:
+            if str(address + '_gain') in arrays:
+                inl = arrays[str(address + '_inl')] if str(address + '_inl') in arrays else None
+                DAC_CALIBRATIONS[address] = Calibration(float(arrays[str(address + '_gain')]),
+                                                        float(arrays[str(address + '_offset')]), inl)
+
+
+##################
+# PMIC FUNCTIONS #
+##################
+
+# VOUT_MODE of each page, which sets the exponent of its L16 values. Only read off the PMIC once (see
+#   PMIC.create_read_vout_mode_command()) instead of before every conversion, and it's fixed on the LTC2977 anyway.
+PMIC_VOUT_MODES = numpy.full(PMIC_PAGES, PMIC_VOUT_MODE_DEFAULT, dtype=numpy.uint8)
+
+
+# Works out PMBus words on the host so the Arduino only has to pass them along. Writes are (page, code, value) with
+#   the value still in volts/ms, and come back out as commands for write_words and write_bytes.
+#   The scalar conversions are plain Python for single values, the *_array ones take and return whole NumPy arrays.
+class PMIC:
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    # L11: 5 bit signed exponent and 11 bit signed mantissa, picking the exponent that keeps the most precision
+    def float_to_l11(value: float) -> int:
+        exponent = -16
+        mantissa = round(value * (1 << 16))
+        while not -1024 <= mantissa <= 1023 and exponent < 15:
+            exponent += 1
+            mantissa = round(value / (2 ** exponent))
+
+        return ((exponent & 0x1F) << 11) | (mantissa & 0x7FF)
+
+    @staticmethod
+    def l11_to_float(word: int) -> float:
+        exponent = word >> 11
+        mantissa = word & 0x7FF
+        if exponent > 15:
+            exponent -= 32
+        if mantissa > 1023:
+            mantissa -= 2048
+        return mantissa * 2.0 ** exponent
+
+    @staticmethod
+    # L16: unsigned 16 bit mantissa with the exponent from the page's VOUT_MODE
+    def float_to_l16(value: float, vout_mode: int = PMIC_VOUT_MODE_DEFAULT) -> int:
+        exponent = vout_mode & 0x1F
+        if exponent > 15:
+            exponent -= 32
+        return min(max(round(value / (2 ** exponent)), 0), 0xFFFF)
+
+    @staticmethod
+    def l16_to_float(word: int, vout_mode: int = PMIC_VOUT_MODE_DEFAULT) -> float:
+        exponent = vout_mode & 0x1F
+        if exponent > 15:
+            exponent -= 32
+        return word * 2.0 ** exponent
+
+    @staticmethod
+    # Same as float_to_l11() for a whole array. Starts each value one exponent below where its mantissa would fit and
+    #   moves up until it does, which is never more than twice (once for the range, once if rounding carried over).
+    def float_to_l11_array(values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        magnitudes = numpy.abs(values)
+        exponents = numpy.full(values.shape, -16, dtype=numpy.int64)
+        nonzero = magnitudes > 0
+        exponents[nonzero] = numpy.floor(numpy.log2(magnitudes[nonzero])) - 10
+        exponents = numpy.clip(exponents, -16, 15)
+
+        for attempt in range(3):
+            mantissas = numpy.rint(numpy.ldexp(values, -exponents)).astype(numpy.int64)
+            too_big = ((mantissas < -1024) | (mantissas > 1023)) & (exponents < 15)
+            if not too_big.any():
+                break
+            exponents += too_big
+
+        return (((exponents & 0x1F) << 11) | (mantissas & 0x7FF)).astype(numpy.uint16)
+
+    @staticmethod
+    def l11_to_float_array(words):
+        words = numpy.asarray(words, dtype=numpy.int64)
+        exponents = words >> 11
+        exponents -= (exponents > 15) * 32
+        mantissas = words & 0x7FF
+        mantissas -= (mantissas > 1023) * 2048
+        return numpy.ldexp(mantissas.astype(numpy.float64), exponents)
+
+    @staticmethod
+    # vout_modes can be one mode for everything or an array of them, one for each value
+    def float_to_l16_array(values, vout_modes=PMIC_VOUT_MODE_DEFAULT):
+        exponents = PMIC.vout_mode_exponents(vout_modes)
+        words = numpy.rint(numpy.ldexp(numpy.asarray(values, dtype=numpy.float64), -exponents))
+        return numpy.clip(words, 0, 0xFFFF).astype(numpy.uint16)
+
+    @staticmethod
+    def l16_to_float_array(words, vout_modes=PMIC_VOUT_MODE_DEFAULT):
+        exponents = PMIC.vout_mode_exponents(vout_modes)
+        return numpy.ldexp(numpy.asarray(words, dtype=numpy.float64), exponents)
+
+    @staticmethod
+    # The signed 5 bit exponents out of VOUT_MODE values
+    def vout_mode_exponents(vout_modes):
+        exponents = numpy.asarray(vout_modes, dtype=numpy.int64) & 0x1F
+        return exponents - (exponents > 15) * 32
+
+    @staticmethod
+    # Turns a register value into the word or byte that gets written, using the page's cached VOUT_MODE for L16
+    def encode_value(code: int, value, page: int = 0) -> int:
+        value_format = PMIC_FORMATS.get(code, PMIC_BYTE)
+        if value_format == PMIC_L16:
+            return PMIC.float_to_l16(value, int(PMIC_VOUT_MODES[page]))
+        elif value_format == PMIC_L11:
+            return PMIC.float_to_l11(value)
+        return int(value)
+
+    @staticmethod
+    # Encodes a whole list of writes at once. Returns the pages, codes, encoded values and whether each is a byte.
+    def encode_writes(writes: list):
+        pages = numpy.array([write[0] for write in writes], dtype=numpy.int64)
+        codes = numpy.array([write[1] for write in writes], dtype=numpy.int64)
+        values = numpy.array([write[2] for write in writes], dtype=numpy.float64)
+        formats = numpy.array([PMIC_FORMATS.get(code, PMIC_BYTE) for code in codes.tolist()])
+
+        encoded = numpy.zeros(len(writes), dtype=numpy.int64)
+        l16 = formats == PMIC_L16
+        l11 = formats == PMIC_L11
+        single_bytes = formats == PMIC_BYTE
+        encoded[l16] = PMIC.float_to_l16_array(values[l16], PMIC_VOUT_MODES[pages[l16]])
+        encoded[l11] = PMIC.float_to_l11_array(values[l11])
+        encoded[single_bytes] = values[single_bytes]
+
+        return pages, codes, encoded, single_bytes
+
+    @staticmethod
+    # Command asking for the VOUT_MODE of the given pages, whose answer goes to PMIC.update_vout_modes()
+    def create_read_vout_mode_command(pages=range(PMIC_PAGES)) -> str:
+        mask = 0
+        for page in pages:
+            mask |= 1 << page
+        return PMIC_DEVICE.encode('read_vout_mode', mask)
+
+    @staticmethod
+    # Caches the VOUT_MODEs from a FRAME_VOUT_MODE payload: the bit mask of pages, then one byte for each of them
+    def update_vout_modes(payload: bytes):
+        mask = payload[0]
+        modes = iter(payload[1:])
+        for page in range(PMIC_PAGES):
+            if mask & (1 << page):
+                PMIC_VOUT_MODES[page] = next(modes)
+
+    @staticmethod
+    # The writes to set up one rail, only for the settings given (names from PMIC_RAIL_SETTINGS)
+    def rail_writes(page: int, **settings) -> list:
+        writes = []
+        for name, value in settings.items():
+            if value is not None:
+                writes.append((page, PMIC_RAIL_SETTINGS[name], value))
+        return writes
+
+    @staticmethod
+    # Sorts the writes by page (so the Arduino changes PAGE as little as possible), encodes them all in one go and
+    #   splits them into word and byte write commands of at most PMIC_BATCH_SIZE entries
+    def create_write_commands(writes: list) -> list:
+        if not writes:
+            return []
+        return PMIC.create_register_commands(PMIC.write_registers(writes))
+
+    @staticmethod
+    # {(page, code): encoded value} for a list of writes, the same keys PMIC_SHADOW uses
+    def write_registers(writes: list) -> dict:
+        pages, codes, encoded, single_bytes = PMIC.encode_writes(writes)
+        return dict(zip(zip(pages.tolist(), codes.tolist()), encoded.tolist()))
+
+    @staticmethod
+    # Commands for already encoded registers, sorted by page and split into words and bytes. staged ones wait on the
+    #   board for a commit.
+    def create_register_commands(registers: dict, staged: bool = False) -> list:
+        words = []
+        single_bytes = []
+        for (page, code), value in sorted(registers.items(), key=lambda register: register[0][0]):
+            if PMIC_FORMATS.get(code, PMIC_BYTE) == PMIC_BYTE:
+                single_bytes.append((page, code, value))
+            else:
+                words.append((page, code, value))
+
+        commands = []
+        names = ('stage_words', 'stage_bytes') if staged else ('write_words', 'write_bytes')
+        for name, rows in zip(names, (words, single_bytes)):
+            command = PMIC_DEVICE.commands[name]
+            for start in range(0, len(rows), PMIC_BATCH_SIZE):
+                command.validate(rows[start:start + PMIC_BATCH_SIZE])
+                commands.append(command.encode(rows[start:start + PMIC_BATCH_SIZE]))
+
+        return commands
+
+    @staticmethod
+    # Same as create_write_commands() but only for the registers that PMIC_SHADOW says changed
+    def shadow_write_commands(writes: list) -> list:
+        if not writes:
+            return []
+        changed = PMIC_SHADOW.diff(PMIC.write_registers(writes))
+        PMIC_SHADOW.registers.update(changed)
+        return PMIC.create_register_commands(changed)
+
+    @staticmethod
+    # Turns a rail on or off through OPERATION
+    def create_enable_command(page: int, enabled: bool) -> str:
+        return PMIC.create_write_commands([(page, PMIC_OPERATION, PMIC_ON if enabled else PMIC_OFF)])[0]
+
+
+subscribe(FRAME_VOUT_MODE, PMIC.update_vout_modes)
+
+
+###################################################
+
+################
+# TRANSACTIONS #
+################
+# Changes to the DACs, DDSs and PMIC that have to take effect together. A Transaction collects them on the host, then
+#   they all go out in one frame as writes that wait on the board: DAC data staged without LDAC ("Dn"), DDS registers
+#   (which always wait for IO_UPDATE) and PMIC writes held by the firmware ("Pq"). The commit at the end of the frame
+#   ("Bx!") writes the PMIC registers back to back and then moves every DDS and DAC on the same IO_UPDATE/LDAC edge.
+#   Only what the shadow registers say changed gets sent.
+#
+# The board answers with a commit frame: PMIC writes done, PMIC writes that didn't fit, then the microseconds the PMIC
+#   writes and the whole commit took, see COMMIT_PAYLOAD.
+
+COMMIT_PAYLOAD = struct.Struct('<BBLL')
+
+
+# Everything that happens in one commit
+class Transaction:
+
+    def __init__(self):
+        self.dac = []
+        self.dds = []
+        self.pmic = {}
+
+    # {address: voltage} for one DAC
+    def set_voltages(self, voltages: dict, reference_voltage: float, gain: float, bipolar: bool, instance: int = 0):
+        require_instance(instance, DAC_INSTANCES)
+        self.dac.append((instance, voltages, reference_voltage, gain, bipolar))
+        return self
+
+    def set_single_tone(self, amplitude: float, ref_amplitude: float, phase: float, frequency: float,
+                        freq_sysclk: float, instance: int = 0):
+        require_instance(instance, DDS_INSTANCES)
+        words = DDS.calculate_parameters_words(amplitude, ref_amplitude, phase, frequency, freq_sysclk)
+        self.dds.append(functools.partial(DDS.shadow_profile_commands, 'single_tone', *words, instance=instance))
+        return self
+
+    # The DRG setup words picked by DDS.plan_ramp()
+    def set_ramp_plan(self, plan, instance: int = 0):
+        require_instance(instance, DDS_INSTANCES)
+        self.dds.append(functools.partial(DDS.shadow_ramp_setup_commands, plan.parameter, plan.lower_limit,
+                                          plan.upper_limit, plan.decrement, plan.increment, plan.rate_n, plan.rate_p,
+                                          instance))
+        return self
+
+    # (page, code, value) PMBus writes, values in volts/ms like PMIC.write_registers() takes
+    def set_pmic_writes(self, writes: list):
+        self.pmic.update(PMIC.write_registers(writes))
+        return self
+
+    # The commands for the whole transaction, ending with the commit. The shadow registers are updated as if it's
+    #   already been sent.
+    def commands(self) -> list:
+        require('transactions')
+        pmic = PMIC_SHADOW.diff(self.pmic)
+        if len(pmic) > PMIC_STAGE_MAX:
+            raise ValueError(str('A commit can only hold ' + str(PMIC_STAGE_MAX) + ' PMIC writes, not ' +
+                                 str(len(pmic))))
+
+        commands = []
+        for instance, voltages, reference_voltage, gain, bipolar in self.dac:
+            changed = DAC.shadow_data(voltages, reference_voltage, gain, bipolar, instance)
+            if changed:
+                commands.append(DAC_DEVICE.instance(instance).encode('stage', list(changed.items())))
+        for create_commands in self.dds:
+            commands += create_commands()
+        PMIC_SHADOW.registers.update(pmic)
+        commands += PMIC.create_register_commands(pmic, staged=True)
+
+        # The commit's IO_UPDATE loads every DDS
+        for shadow in DDS_SHADOWS:
+            shadow.staged = False
+        commands.append(BOARD_DEVICE.encode('commit'))
+        return commands
+
+
+# What the board said about a commit, with how long it took from the host sending it to hearing back (seconds)
+class CommitResult:
+
+    def __init__(self, payload: bytes, sent: float):
+        self.latency = time.perf_counter() - sent
+        self.pmic_writes, self.pmic_dropped, pmic_time, commit_time = COMMIT_PAYLOAD.unpack(payload)
+        self.pmic_time = pmic_time / 1e6
+        self.commit_time = commit_time / 1e6
+
+    def __repr__(self):
+        return str('CommitResult(latency=' + str(self.latency) + ', commit_time=' + str(self.commit_time) +
+                   ', pmic_writes=' + str(self.pmic_writes) + ', pmic_dropped=' + str(self.pmic_dropped) + ')')
+
+
+###################################################
+
+#############
+# SNAPSHOTS #
+#############
+# The shadow registers already hold everything that's been set up on a board, so a snapshot is just a copy of them:
+#   {'dds': {register: value}, 'dac': {(register, channel): value}, 'pmic': {(page, code): encoded value}}
+#   with 'dds1', 'dac1' and so on for the other instances.
+# Restoring writes those registers straight back, one register command each, which is the least that has to be sent
+#   to put a freshly reset board back the way it was.
+#
+# On disk it's packed to a few bytes per register: SNAPSHOT_MAGIC, then for the DDS, DAC, PMIC and the other instances
+#   in SNAPSHOT_ENTRIES order a 2 byte count followed by that many entries. Version 1 files only have the first three.
+
+SNAPSHOT_MAGIC = b'PYDS\x02'
+SNAPSHOT_MAGIC_V1 = b'PYDS\x01'
+SNAPSHOT_COUNT = struct.Struct('<H')
+SNAPSHOT_ENTRIES = ((('dds', struct.Struct('<BQ')), ('dac', struct.Struct('<BBH')), ('pmic', struct.Struct('<BBH'))) +
+                    tuple((str('dds' + str(instance)), struct.Struct('<BQ')) for instance in range(1, DDS_INSTANCES)) +
+                    tuple((str('dac' + str(instance)), struct.Struct('<BBH')) for instance in range(1, DAC_INSTANCES)))
+
+
+# Name of a device instance's registers in a snapshot
+def snapshot_name(device: str, instance: int = 0) -> str:
+    return device if not instance else str(device + str(instance))
+
+
+# DAC registers get restored powered up first and data last, since a powered down output ignores data writes
+DAC_RESTORE_ORDER = (DAC_POWER_REGISTER, DAC_RANGE_REGISTER, DAC_CONTROL_REGISTER, DAC_DATA_REGISTER)
+
+
+# Copy of the state of every device
+def take_snapshot() -> dict:
+    snapshot = {'pmic': dict(PMIC_SHADOW.registers)}
+    for instance, shadow in enumerate(DDS_SHADOWS):
+        snapshot[snapshot_name('dds', instance)] = dict(shadow.registers)
+    for instance, shadow in enumerate(DAC_SHADOWS):
+        snapshot[snapshot_name('dac', instance)] = dict(shadow.registers)
+    return snapshot
+
+
+def pack_snapshot(snapshot: dict) -> bytes:
+    data = bytearray(SNAPSHOT_MAGIC)
+    for name, entry in SNAPSHOT_ENTRIES:
+        registers = snapshot.get(name, {})
+        data += SNAPSHOT_COUNT.pack(len(registers))
+        for register, value in registers.items():
+            if isinstance(register, tuple):
+                data += entry.pack(*register, value)
+            else:
+                data += entry.pack(register, value)
+    return bytes(data)
+
+
+def unpack_snapshot(data: bytes) -> dict:
+    if data.startswith(SNAPSHOT_MAGIC):
+        entries = SNAPSHOT_ENTRIES
+    elif data.startswith(SNAPSHOT_MAGIC_V1):
+        entries = SNAPSHOT_ENTRIES[:3]
+    else:
+        raise ValueError('Not a pyduino snapshot')
+
+    snapshot = {}
+    offset = len(SNAPSHOT_MAGIC)
+    for name, entry in entries:
+        count = SNAPSHOT_COUNT.unpack_from(data, offset)[0]
+        offset += SNAPSHOT_COUNT.size
+        registers = {}
+        for values in entry.iter_unpack(data[offset:offset + count * entry.size]):
+            if len(values) == 2:
+                registers[values[0]] = values[1]
+            else:
+                registers[values[:-1]] = values[-1]
+        offset += count * entry.size
+        snapshot[name] = registers
+    return snapshot
+
+
+def save_snapshot(path: str, snapshot: dict = None):
+    if snapshot is None:
+        snapshot = take_snapshot()
+    with open(path, 'wb') as file:
+        file.write(pack_snapshot(snapshot))
+
+
+def load_snapshot(path: str) -> dict:
+    with open(path, 'rb') as file:
+        return unpack_snapshot(file.read())
+
+
+# The commands that put a board back into a snapshot's state, and records it in the shadow registers. With force
+#   off only what differs from the shadow registers gets sent, for when the board wasn't reset.
+#   Legacy firmware can't write single registers, so nothing is restored and the shadows are left empty so the next
+#   writes send everything.
+def restore_commands(snapshot: dict, force: bool = True) -> list:
+    if force or not CAPABILITIES.supports('registers'):
+        invalidate_shadows()
+    if not CAPABILITIES.supports('registers'):
+        return []
+
+    commands = []
+    for instance, shadow in enumerate(DDS_SHADOWS):
+        dds = shadow.diff(snapshot.get(snapshot_name('dds', instance), {}))
+        for register in sorted(dds):
+            commands.append(DDS.create_register_command(register, dds[register], instance))
+        shadow.registers.update(dds)
+
+    # One load does every DDS
+    if commands:
+        commands.append(DDS.create_load_command())
+        for shadow in DDS_SHADOWS:
+            shadow.staged = False
+
+    for instance, shadow in enumerate(DAC_SHADOWS):
+        dac = shadow.diff(snapshot.get(snapshot_name('dac', instance), {}))
+        for register in sorted(dac, key=lambda register: (DAC_RESTORE_ORDER.index(register[0]), register[1])):
+            commands.append(DAC.create_register_command(register, dac[register], instance))
+        shadow.registers.update(dac)
+
+    pmic = PMIC_SHADOW.diff(snapshot.get('pmic', {}))
+    commands.extend(PMIC.create_register_commands(pmic))
+    PMIC_SHADOW.registers.update(pmic)
+
+    return commands
 
 
 ###################################################
@@ -382,10 +3084,16 @@ class DAC:
 # LOWER-LEVEL FUNCTIONS #
 #########################
 
-# Sends a written command through the serial port to the device being communicated to
+# Sends a written command through the serial port to the device being communicated to. If there's no port right now
+#   it gets held and sent once there is.
 def send_command(command: str):
     print(command)
-    serial_port.write(command.encode())
+    SUPERVISOR.write(command.encode())
+
+
+# Sends a whole frame of commands (bytes, bytearray or memoryview, usually FrameBuilder.frame()) in one write
+def send_frame(frame):
+    SUPERVISOR.write(frame)
 
 
 ###################################################
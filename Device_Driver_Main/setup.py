@@ -14,7 +14,7 @@ os.environ['TK_LIBRARY'] = env_locations[1]
 setup(name='DAC Programmer',
       version='0.2.1',
       description='https://github.com/McNibbler/DAC-Controller',
-      options={'build_exe': {'packages': ['sys', 'PyQt5', 'serial', 'pyduino', 'controller']}},
+      options={'build_exe': {'packages': ['sys', 'PyQt5', 'serial', 'numpy', 'pyduino', 'controller', 'telemetry', 'farm', 'bridge']}},
       executables=[Executable('gui.py', base='Win32GUI')])
 
 # To build with an MSI installer, run with the argument "bdist_msi"
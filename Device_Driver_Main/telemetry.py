@@ -0,0 +1,261 @@
+#########################################
+# PMIC Telemetry                        #
+# Version: Beta 0.3                     #
+#                                       #
+# Keeps a rolling history of the rail   #
+# readings the Arduino streams back     #
+# from the LTC2977.                     #
+#########################################
+
+# HOW THIS WORKS
+#
+# After start() the Arduino reads VOUT, IOUT, temperature and STATUS_WORD from each selected page in turn and sends
+# every reading back as a telemetry frame (see INCOMING FRAMES in pyduino). The pyduino reader thread hands those to
+# TELEMETRY, which decodes them into a fixed-size NumPy ring buffer and calls anything subscribed to it.
+#
+# Payload of a telemetry frame, little endian:
+#   page (1 byte), STATUS_WORD (2), READ_VOUT as L16 (2), READ_IOUT as L11 (2), READ_TEMPERATURE_1 as L11 (2),
+#   Arduino millis() when it was read (4)
+#
+# FUNCTIONS
+# start()
+#   (period: int = 0, pages: list = all) -> void
+#   Starts streaming, period is the least ms between samples (0 for as fast as PMBus goes)
+#
+# stop()
+#   () -> void
+#   Stops streaming
+#
+# TELEMETRY.subscribe()
+#   (callback) -> void
+#   Calls callback(sample) from the reader thread for every sample received, sample being one record of SAMPLE_TYPE
+#
+# FAULTS.subscribe()
+#   (callback) -> void
+#   Calls callback(event) with a FaultEvent as soon as a fault frame comes in. The Arduino sends one the moment the
+#   LTC2977 pulls ALERT low, ahead of any queued command or telemetry, and the reader hands it out before anything
+#   else it received, so this never waits behind command traffic.
+#
+# FAULTS.latency_stats()
+#   () -> dict
+#   Min/mean/max seconds from ALERT asserting to the callbacks being called, over the last LATENCY_HISTORY faults
+
+###################################################
+
+###########
+# IMPORTS #
+###########
+
+import struct
+import threading
+import time
+import numpy
+import pyduino
+from pyduino import *
+
+
+###################################################
+
+#############
+# CONSTANTS #
+#############
+
+PAYLOAD = struct.Struct('<BHHHHI')
+
+# Fault frame: micros() when ALERT asserted, micros() when the frame was sent, bit mask of pages with a fault and
+#   every page's STATUS_WORD
+FAULT_PAYLOAD = struct.Struct('<IIB8H')
+
+# One sample in the history
+SAMPLE_TYPE = numpy.dtype([('page', numpy.uint8), ('status', numpy.uint16), ('vout', numpy.float32),
+                           ('iout', numpy.float32), ('temperature', numpy.float32), ('device_time', numpy.uint32),
+                           ('host_time', numpy.float64)])
+
+# Samples kept before the oldest get overwritten
+HISTORY_SIZE = 8192
+
+# Fault latencies kept for latency_stats()
+LATENCY_HISTORY = 256
+
+# Asks for no delay between samples, so pages get read back to back as fast as PMBus goes
+FASTEST = 0
+
+
+###################################################
+
+###############
+# RING BUFFER #
+###############
+
+# Fixed-size history of samples. Nothing is allocated per sample, the oldest one just gets overwritten.
+class RingBuffer:
+
+    def __init__(self, size: int = HISTORY_SIZE, dtype=SAMPLE_TYPE):
+        self.data = numpy.zeros(size, dtype=dtype)
+        self.size = size
+        self.index = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, sample: tuple):
+        with self.lock:
+            self.data[self.index] = sample
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def clear(self):
+        with self.lock:
+            self.index = 0
+            self.count = 0
+
+    # Copy of the last n samples (all of them if n is None), oldest first
+    def latest(self, n: int = None):
+        with self.lock:
+            if n is None or n > self.count:
+                n = self.count
+            start = self.index - n
+            if start >= 0:
+                return self.data[start:self.index].copy()
+            return numpy.concatenate((self.data[start:], self.data[:self.index]))
+
+    # Copy of the last n samples from one page, oldest first
+    def page(self, page: int, n: int = None):
+        samples = self.latest()
+        samples = samples[samples['page'] == page]
+        if n is not None:
+            samples = samples[-n:]
+        return samples
+
+
+###################################################
+
+#############
+# TELEMETRY #
+#############
+
+class Telemetry:
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.history = RingBuffer(size)
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    # Runs on the reader thread, so it only decodes, stores and passes the sample on
+    def handle(self, payload: bytes):
+        page, status, vout, iout, temperature, device_time = PAYLOAD.unpack(payload)
+        sample = (page, status, PMIC.l16_to_float(vout, int(PMIC_VOUT_MODES[page])), PMIC.l11_to_float(iout),
+                  PMIC.l11_to_float(temperature), device_time, time.perf_counter())
+        self.history.append(sample)
+
+        if self.subscribers:
+            record = numpy.array(sample, dtype=SAMPLE_TYPE)
+            for callback in tuple(self.subscribers):
+                callback(record)
+
+
+TELEMETRY = Telemetry()
+pyduino.subscribe(FRAME_TELEMETRY, TELEMETRY.handle)
+
+
+##########
+# FAULTS #
+##########
+
+class FaultEvent:
+
+    def __init__(self, pages: list, statuses: tuple, latency: float):
+        self.pages = pages
+        self.statuses = statuses
+        self.latency = latency
+
+    def __repr__(self):
+        return str('FaultEvent(pages=' + str(self.pages) + ', statuses=' + str([hex(status) for status in self.statuses])
+                   + ', latency=' + str(self.latency) + ')')
+
+
+class FaultMonitor:
+
+    def __init__(self):
+        self.subscribers = []
+        self.latencies = RingBuffer(LATENCY_HISTORY, numpy.float64)
+        self.count = 0
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    # The latency is put together from three parts since the Arduino and the host don't share a clock: how long the
+    #   Arduino took from ALERT to sending (its own micros()), how long the frame takes on the wire at the baud rate,
+    #   and how long since the reader got it off the port.
+    def handle(self, payload: bytes):
+        values = FAULT_PAYLOAD.unpack(payload)
+        assert_time, send_time, faulted = values[0], values[1], values[2]
+
+        device_delay = ((send_time - assert_time) & 0xFFFFFFFF) / 1e6
+        baudrate = 9600 if pyduino.serial_port == "none" else pyduino.serial_port.baudrate
+        wire_delay = (FRAME_HEADER_SIZE + len(payload) + 1) * 10 / baudrate
+        received = time.perf_counter() if pyduino.READER is None else pyduino.READER.received
+
+        pages = [page for page in range(PMIC_PAGES) if faulted & (1 << page)]
+        latency = device_delay + wire_delay + time.perf_counter() - received
+        event = FaultEvent(pages, values[3:], latency)
+
+        self.count += 1
+        self.latencies.append(latency)
+        for callback in tuple(self.subscribers):
+            callback(event)
+
+    def latency_stats(self) -> dict:
+        latencies = self.latencies.latest()
+        if not len(latencies):
+            return {'count': 0}
+        return {'count': self.count, 'min': float(latencies.min()), 'mean': float(latencies.mean()),
+                'max': float(latencies.max()), 'last': float(latencies[-1])}
+
+
+FAULTS = FaultMonitor()
+pyduino.subscribe(FRAME_FAULT, FAULTS.handle)
+
+
+# Bit mask of pages for the telemetry command
+def page_mask(pages) -> int:
+    mask = 0
+    for page in pages:
+        mask |= 1 << page
+    return mask
+
+
+# Starts the reader and asks the Arduino to stream the given pages
+def start(period: int = FASTEST, pages=range(PMIC_PAGES)):
+    pyduino.require('telemetry')
+    start_reader()
+    send_command(PMIC_DEVICE.encode('telemetry', period, page_mask(pages)))
+
+
+def stop():
+    send_command(PMIC_DEVICE.encode('telemetry', 0, 0))
+
+
+###################################################
+
+#############
+# EXECUTION #
+#############
+
+# Prints rail readings for a few seconds
+if __name__ == '__main__':
+    if connect():
+        TELEMETRY.subscribe(print)
+        FAULTS.subscribe(print)
+        start()
+        time.sleep(5)
+        stop()
+        stop_reader()
+        print(FAULTS.latency_stats())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules sit next to this folder and aren't installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+import os
+import time
+import pytest
+import pyduino
+from bridge import *
+from emulator import PtyBoard
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'openpty'), reason='needs ptys')
+
+
+def wait_until(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def dac_writes(start: int, count: int) -> list:
+    return [DAC_DEVICE.encode('write', DAC_A, value).encode() for value in range(start, start + count)]
+
+
+# A board opened by name gets packets, and everything sent while it's unplugged goes to it once it's back
+def test_board_dropped_and_reopened(tmp_path, monkeypatch):
+    monkeypatch.setattr(pyduino, 'RECONNECT_INTERVAL', 0.05)
+    pty = PtyBoard(str(tmp_path / 'board'))
+    bridge = Bridge({'board': pty.name}, ('127.0.0.1', 0))
+    client = BridgeClient(bridge.listener.getsockname())
+    try:
+        dac = client.controller('board')
+        assert dac.capabilities()
+        assert dac.link_stats()['enabled']
+
+        before = dac_writes(0, 50)
+        for frame in before:
+            client.send_frame('board', frame).wait()
+        wait_until(lambda: pty.received == b''.join(before))
+
+        pty.drop()
+        wait_until(lambda: not dac.is_connected())
+        after = dac_writes(50, 50)
+        for frame in after:
+            client.send_frame('board', frame).wait()
+
+        pty.open()
+        wait_until(lambda: dac.is_connected())
+        # The new board gets the state back first, then what was held
+        wait_until(lambda: pty.board.received.endswith(b''.join(after)))
+        assert pty.boards[0].received == b''.join(before)
+        assert dac.reconnect_stats()['reconnects'] >= 1
+    finally:
+        client.close()
+        bridge.close()
+        pty.drop()
@@ -0,0 +1,58 @@
+import os
+import types
+import pyduino
+from pyduino import *
+
+
+def port(device: str, serial_number: str):
+    return types.SimpleNamespace(device=device, serial_number=serial_number, vid=0x2341, pid=0x0043)
+
+
+# Stands in for the probe, answering for the ports in answers and counting who got asked
+def fake_ports(monkeypatch, ports: list, answers: dict):
+    asked = []
+
+    def identify_ports(names, timeout=IDENTIFY_TIMEOUT):
+        asked.extend(names)
+        return {name: answers.get(name) for name in names}
+
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', lambda: ports)
+    monkeypatch.setattr(pyduino, 'identify_ports', identify_ports)
+    return asked
+
+
+def identify(board: int) -> bytes:
+    return IDENTIFY_PAYLOAD.pack(board, 1, 2, BOARD_DEVICES['dac'])
+
+
+# A port that didn't answer is asked again next time instead of being cached as not a board
+def test_unanswered_ports_are_not_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / 'ports.json')
+    ports = [port('/dev/ttyACM0', 'A'), port('/dev/ttyACM1', 'B')]
+    asked = fake_ports(monkeypatch, ports, {'/dev/ttyACM0': identify(7)})
+
+    infos = discover(path=path)
+    assert [info.is_board() for info in infos] == [True, False]
+    assert set(load_discovery_cache(path)) == {'A'}
+
+    asked = fake_ports(monkeypatch, ports, {'/dev/ttyACM1': identify(8)})
+    infos = discover(path=path)
+    assert asked == ['/dev/ttyACM1']
+    assert [info.board for info in infos] == [7, 8]
+
+
+# A role given to a board keeps through it not answering once
+def test_role_kept_when_not_answering(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache' / 'ports.json')
+    set_role('A', 'dac bench', path)
+    fake_ports(monkeypatch, [port('/dev/ttyACM0', 'A')], {})
+    assert not discover(path=path)[0].is_board()
+    assert load_discovery_cache(path)['A']['role'] == 'dac bench'
+
+    fake_ports(monkeypatch, [port('/dev/ttyACM0', 'A')], {'/dev/ttyACM0': identify(3)})
+    info = discover(path=path)[0]
+    assert (info.role, info.board) == ('dac bench', 3)
+
+
+def test_cache_is_per_user():
+    assert os.path.isabs(DISCOVERY_CACHE)
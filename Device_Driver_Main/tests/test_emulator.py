@@ -0,0 +1,23 @@
+import pytest
+from emulator import *
+
+
+# Every packet that came through the line undamaged is delivered, in order, and nothing damaged or made up is
+@pytest.mark.parametrize('error_rate', [0.0, 0.01, 0.05])
+def test_parser_delivers_only_intact_packets(error_rate):
+    result = fuzz_parser(packets=5000, error_rate=error_rate)
+    assert result['missed'] == 0
+    assert result['false'] == 0
+    assert result['in_order']
+    assert result['delivered'] >= result['packets'] - result['damaged']
+    if not error_rate:
+        assert result['delivered'] == result['packets']
+
+
+# The board runs exactly the commands sent, once each and in order, however noisy the line
+@pytest.mark.parametrize('error_rate', [0.0, 0.001, 0.01])
+def test_packets_deliver_every_command_once(error_rate):
+    result = fuzz_packets(commands=2000, error_rate=error_rate)
+    assert result['intact']
+    if error_rate >= 0.01:
+        assert result['retransmits'] > 0
@@ -0,0 +1,28 @@
+import os
+import pytest
+from farm import *
+from emulator import PtyDevices
+from pyduino import DAC_DEVICE, DAC_A
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'openpty'), reason='needs ptys')
+
+
+# Every board gets every byte of its own frames, with frames spread over more boards than workers and more slots than
+#   the shared memory has
+def test_every_board_gets_its_frames():
+    devices = PtyDevices(5)
+    board_farm = Farm(devices.names, 2)
+    frames = {name: ''.join(DAC_DEVICE.encode('write', DAC_A, index * 1000 + value) for value in range(50)).encode()
+              for index, name in enumerate(devices.names)}
+    repeats = 100
+    try:
+        for repeat in range(repeats):
+            board_farm.send_many(frames)
+        metrics = board_farm.metrics()
+    finally:
+        board_farm.close()
+    received, commands = devices.stop()
+
+    assert received == [len(frames[name]) * repeats for name in devices.names]
+    assert commands == [50 * repeats] * len(devices.names)
+    assert all(metrics[name]['errors'] == 0 for name in devices.names)
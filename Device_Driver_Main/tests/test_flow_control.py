@@ -0,0 +1,42 @@
+import time
+import pytest
+import pyduino
+from emulator import *
+
+WRITE = DAC_DEVICE.encode('write', DAC_A, 12345)
+SETUP = DAC_DEVICE.encode('setup', DAC_BIPOLAR, DAC_GAIN_2)
+
+
+@pytest.fixture
+def board():
+    board = BufferedBoard(1000000)
+    pyduino.serial_port = board
+    yield board
+    stop_reader()
+    pyduino.FLOW.disable()
+    pyduino.serial_port = "none"
+
+
+# DAC writes with a slow DAC setup (100 ms with nothing read) every so often, sent a few at a time
+def send_stream(board, commands: int = 600, setup_every: int = 200, batch: int = 20) -> int:
+    stream = [SETUP if index % setup_every == 0 else WRITE for index in range(commands)]
+    for index in range(0, commands, batch):
+        send_frame(''.join(stream[index:index + batch]).encode())
+    deadline = time.monotonic() + 30
+    while not board.finished():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+    return board.commands[WRITE[:-1].encode()] + board.commands[SETUP[:-1].encode()]
+
+
+# The setups overflow the 64 byte receive buffer when nothing holds the writes back
+def test_without_flow_control_drops(board):
+    assert send_stream(board) < 600
+    assert board.dropped > 0
+
+
+def test_flow_control_keeps_every_command(board):
+    assert enable_flow_control(board, board.rx_buffer)
+    start_reader()
+    assert send_stream(board) == 600
+    assert board.dropped == 0